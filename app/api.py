@@ -1,15 +1,35 @@
+import asyncio
+import json
 import logging
 from pathlib import Path
-from typing import List
+from typing import AsyncIterator, Iterator, List, Literal, Optional
 
 from fastapi import APIRouter, Body, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 
+from .backup.catalog import DEFAULT_TREE_LIMIT, SnapshotCatalog, UnknownSnapshotError, check_restore_paths, restore_paths
 from .backup.config import BackupConfig, load_config, save_config
-from .backup.engine import run_backup
-from .backup.filesystem import list_directory, normalize_selection, UnsafePathError
+from .backup.dirsizes import selection_total
+from .backup.engine import LOG_BACKUP_COUNT, LOG_FILE, run_backup, run_history, verify_snapshots
+from .backup.filesystem import (
+    DEFAULT_PAGE_SIZE,
+    InvalidCursorError,
+    UnsafePathError,
+    browse_directory,
+    is_allowed,
+    iter_directory,
+    normalize_selection,
+)
+from .backup.history import render_metrics
+from .backup.jobs import Job, JobBusyError, job_manager
+from .backup.logreader import DEFAULT_LIMIT as DEFAULT_LOG_LIMIT, LogQuery, follow, read_logs
+from .backup.retention import parse_timestamped_dirs
+from .backup.scheduler import CronSpec
+from .backup.throttle import check_throttle
 
 api_router = APIRouter()
+# Mounted at the application root so Prometheus can scrape the conventional /metrics path.
+metrics_router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
@@ -22,6 +42,15 @@ def get_config() -> dict:
 @api_router.post("/config", response_model=dict)
 def update_config(data: dict = Body(...)) -> dict:
     config = BackupConfig.from_dict(data)
+    if config.schedule.cron:
+        try:
+            CronSpec(config.schedule.cron)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+    try:
+        check_throttle(config.throttle)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
     normalized = normalize_selection(config.selected_paths)
     config.selected_paths = normalized
     save_config(config)
@@ -29,21 +58,242 @@ def update_config(data: dict = Body(...)) -> dict:
 
 
 @api_router.get("/browse")
-def browse(path: str) -> JSONResponse:
+def browse(
+    path: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    sort: Literal["name", "size", "mtime"] = "name",
+    order: Literal["asc", "desc"] = "asc",
+    pattern: Optional[str] = None,
+    kind: Optional[Literal["dir", "file"]] = None,
+    stream: bool = False,
+) -> Response:
     config = load_config()
     target = Path(path) if path else Path(config.allowed_roots[0])
     try:
-        entries = list_directory(target)
-    except UnsafePathError as exc:
+        if stream:
+            # JSON lines in directory order, so huge directories start arriving immediately.
+            lines = (json.dumps(entry) + "\n" for entry in iter_directory(target, pattern, kind))
+            return StreamingResponse(lines, media_type="application/x-ndjson")
+        page = browse_directory(target, cursor, limit, sort, order == "desc", pattern, kind)
+    except (UnsafePathError, InvalidCursorError) as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
-    return JSONResponse({"path": str(target.resolve()), "entries": entries})
+    return JSONResponse(
+        {
+            "path": str(target.resolve()),
+            "entries": page.entries,
+            "next_cursor": page.next_cursor,
+            "total": page.total,
+            "selection": selection_total(config.selected_paths).to_dict(),
+        }
+    )
+
+
+JOB_EVENT_INTERVAL = 1.0
 
 
 @api_router.post("/run")
 def run_backup_now() -> JSONResponse:
+    config = load_config()
+    try:
+        job = job_manager.submit("backup", config.destination, lambda progress: run_backup(config, progress=progress))
+    except JobBusyError as exc:
+        raise HTTPException(status_code=409, detail={"message": str(exc), "job_id": exc.job.id}) from exc
+    return JSONResponse({"status": job.status, "job_id": job.id}, status_code=202)
+
+
+def _snapshot_path(config: BackupConfig, snapshot_id: str) -> Path:
+    for snapshot in parse_timestamped_dirs(Path(config.destination)):
+        if snapshot.name == snapshot_id:
+            return snapshot
+    raise HTTPException(status_code=404, detail=f"Unknown snapshot {snapshot_id}")
+
+
+def _open_catalog(config: BackupConfig) -> Optional[SnapshotCatalog]:
+    # None while the destination does not exist yet. Snapshots written since the last run
+    # (or by another tool) are catalogued on the way.
+    destination_root = Path(config.destination)
+    if not destination_root.is_dir():
+        return None
+    catalog = SnapshotCatalog.open(destination_root)
+    catalog.sync(destination_root)
+    return catalog
+
+
+@api_router.get("/snapshots")
+def list_snapshots() -> JSONResponse:
+    catalog = _open_catalog(load_config())
+    if catalog is None:
+        return JSONResponse({"snapshots": []})
+    with catalog:
+        return JSONResponse({"snapshots": [info.to_dict() for info in catalog.snapshots()]})
+
+
+@api_router.get("/snapshots/{snapshot_id}/tree")
+def snapshot_tree(
+    snapshot_id: str, path: str = "", cursor: Optional[str] = None, limit: int = DEFAULT_TREE_LIMIT
+) -> JSONResponse:
+    catalog = _open_catalog(load_config())
+    if catalog is None:
+        raise HTTPException(status_code=404, detail=f"Unknown snapshot {snapshot_id}")
+    with catalog:
+        try:
+            entries, next_cursor = catalog.tree(snapshot_id, path, cursor, limit)
+        except UnknownSnapshotError as exc:
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
+    return JSONResponse({"snapshot": snapshot_id, "path": path.strip("/"), "entries": entries, "next_cursor": next_cursor})
+
+
+@api_router.get("/versions")
+def file_versions(path: str) -> JSONResponse:
+    catalog = _open_catalog(load_config())
+    if catalog is None:
+        return JSONResponse({"path": path.strip("/"), "versions": []})
+    with catalog:
+        return JSONResponse({"path": path.strip("/"), "versions": catalog.versions(path)})
+
+
+@api_router.post("/snapshots/{snapshot_id}/restore")
+def restore_snapshot_paths(snapshot_id: str, data: dict = Body(...)) -> JSONResponse:
+    config = load_config()
+    snapshot = _snapshot_path(config, snapshot_id)
+    try:
+        paths = check_restore_paths(data.get("paths") or [])
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    target = Path(str(data.get("target") or "")).expanduser()
+    destination_root = Path(config.destination).resolve()
+    if not target.is_absolute() or not is_allowed(target, config.allowed_roots):
+        raise HTTPException(status_code=400, detail=f"Restore target {target} is outside allowed roots")
+    resolved = target.resolve()
+    if resolved == destination_root or destination_root in resolved.parents:
+        raise HTTPException(status_code=400, detail="Cannot restore into the backup destination")
+
+    def restore(progress):
+        restored = restore_paths(snapshot, paths, target, config.max_workers, progress)
+        return f"Restored {restored} files to {target}"
+
     try:
-        destination = run_backup()
-    except Exception as exc:  # noqa: BLE001
-        logger.exception("Backup error")
-        raise HTTPException(status_code=500, detail=str(exc)) from exc
-    return JSONResponse({"status": "ok", "destination": str(destination)})
+        job = job_manager.submit("restore", config.destination, restore)
+    except JobBusyError as exc:
+        raise HTTPException(status_code=409, detail={"message": str(exc), "job_id": exc.job.id}) from exc
+    return JSONResponse({"status": job.status, "job_id": job.id}, status_code=202)
+
+
+@api_router.post("/snapshots/{snapshot_id}/verify")
+def verify_snapshot_now(snapshot_id: str) -> JSONResponse:
+    config = load_config()
+    _snapshot_path(config, snapshot_id)
+
+    def verify(progress):
+        (report,) = verify_snapshots([snapshot_id], config, progress)
+        if not report.ok:
+            raise RuntimeError(str(report))
+        return report
+
+    # Shares the destination's job slot, so a backup started here cannot prune the snapshot mid-check.
+    try:
+        job = job_manager.submit("verify", config.destination, verify)
+    except JobBusyError as exc:
+        raise HTTPException(status_code=409, detail={"message": str(exc), "job_id": exc.job.id}) from exc
+    return JSONResponse({"status": job.status, "job_id": job.id}, status_code=202)
+
+
+def _get_job(job_id: str) -> Job:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
+
+
+@api_router.get("/jobs")
+def list_jobs() -> JSONResponse:
+    return JSONResponse({"jobs": [job.to_dict() for job in job_manager.list()]})
+
+
+@api_router.get("/jobs/{job_id}")
+def get_job(job_id: str) -> JSONResponse:
+    return JSONResponse(_get_job(job_id).to_dict())
+
+
+@api_router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str) -> StreamingResponse:
+    job = _get_job(job_id)
+
+    async def stream() -> AsyncIterator[str]:
+        while True:
+            payload = job.to_dict()
+            yield f"event: progress\ndata: {json.dumps(payload)}\n\n"
+            if job.finished:
+                yield f"event: done\ndata: {json.dumps(payload)}\n\n"
+                return
+            await asyncio.sleep(JOB_EVENT_INTERVAL)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@api_router.get("/runs")
+def list_runs(limit: int = 50) -> JSONResponse:
+    records = run_history().records()[: max(0, limit)]
+    return JSONResponse({"runs": [record.to_dict() for record in records]})
+
+
+@api_router.get("/runs/{run_id}")
+def get_run(run_id: str) -> JSONResponse:
+    record = run_history().get(run_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Unknown run {run_id}")
+    return JSONResponse(record.to_dict())
+
+
+LOG_STREAM_INTERVAL = 1.0
+
+
+def _log_query(level: Optional[str], run_id: Optional[str], since: Optional[str], until: Optional[str]) -> LogQuery:
+    try:
+        return LogQuery(level=level, run_id=run_id, since=since, until=until)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+@api_router.get("/logs")
+def get_logs(
+    limit: int = DEFAULT_LOG_LIMIT,
+    cursor: Optional[str] = None,
+    level: Optional[str] = None,
+    run_id: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> JSONResponse:
+    query = _log_query(level, run_id, since, until)
+    try:
+        page = read_logs(LOG_FILE, LOG_BACKUP_COUNT, limit, cursor, query)
+    except InvalidCursorError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return JSONResponse({"entries": [entry.to_dict() for entry in page.entries], "next_cursor": page.next_cursor})
+
+
+@api_router.get("/logs/stream")
+def stream_logs(
+    level: Optional[str] = None,
+    run_id: Optional[str] = None,
+) -> StreamingResponse:
+    query = _log_query(level, run_id, None, None)
+
+    # A plain generator: Starlette iterates it in a worker thread, so the polling never blocks
+    # the event loop. Idle polls send an SSE comment, which also detects closed connections.
+    def stream() -> Iterator[str]:
+        for entry in follow(LOG_FILE, LOG_STREAM_INTERVAL):
+            if entry is None:
+                yield ": keep-alive\n\n"
+            elif query.matches(entry):
+                yield f"event: log\ndata: {json.dumps(entry.to_dict())}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    history = run_history()
+    text = render_metrics(history.records(), history.totals())
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
@@ -0,0 +1,413 @@
+import bisect
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .copier import CopyStats, SourceFile, iter_source_files
+from .fastcopy import COPY_BUFFER_SIZE, Limiter
+from .filters import PathFilter
+from .logreader import run_context
+from .manifest import ManifestWriter, read_manifest
+from .progress import Progress
+
+try:
+    import zstandard
+except ImportError:  # optional; archives fall back to gzip without it
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = "archive"
+COMPRESSIONS = ("auto", "zstd", "gzip")
+ARCHIVE_STEM = "archive.tar"
+BLOCK_INDEX_NAME = ".pi-backup-blocks.jsonl"
+BLOCK_INDEX_VERSION = 1
+# The tar stream is cut into blocks of this many bytes, each compressed on its own (one gzip
+# member or zstd frame). The concatenation is still an ordinary .tar.gz / .tar.zst, but blocks
+# can be compressed on every core and a file read back by decompressing only its blocks.
+BLOCK_SIZE = 4 * 1024 * 1024
+# Compression is CPU-bound and zlib/zstd release the GIL, so threads use every core.
+DEFAULT_COMPRESS_WORKERS = os.cpu_count() or 1
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# (uncompressed offset, compressed offset, compressed length) of each block.
+Block = Tuple[int, int, int]
+
+
+class CorruptArchiveError(ValueError):
+    pass
+
+
+@dataclass
+class Codec:
+    name: str
+    extension: str
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    # Compressor objects are not thread-safe, and one per 4 MiB block costs next to nothing.
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+CODECS = {
+    "gzip": Codec("gzip", "gz", lambda data: gzip.compress(data, GZIP_LEVEL, mtime=0), gzip.decompress),
+    "zstd": Codec("zstd", "zst", _zstd_compress, _zstd_decompress),
+}
+
+
+# What a damaged block makes the decompressors raise.
+_DECOMPRESS_ERRORS: Tuple[type, ...] = (OSError, EOFError, zlib.error)
+if zstandard is not None:
+    _DECOMPRESS_ERRORS += (zstandard.ZstdError,)
+
+
+def resolve_compression(name: str) -> Codec:
+    if name not in COMPRESSIONS:
+        raise ValueError(f"Unknown archive_compression {name!r}; expected one of {', '.join(COMPRESSIONS)}")
+    if name == "auto":
+        name = "zstd" if zstandard is not None else "gzip"
+    if name == "zstd" and zstandard is None:
+        raise ValueError("archive_compression 'zstd' needs the zstandard package (pip install zstandard)")
+    return CODECS[name]
+
+
+class _BlockWriter:
+    # File object for tarfile: buffers the tar stream into BLOCK_SIZE blocks, compresses them
+    # on a thread pool and writes them to ``out`` in order. At most two blocks per worker are
+    # in flight, so memory stays flat and a slow destination holds the tar writer back.
+
+    def __init__(self, out: BinaryIO, codec: Codec, workers: int) -> None:
+        self._out = out
+        self._codec = codec
+        self._workers = max(1, workers)
+        self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="backup-compress", **run_context())
+        self._buffer = bytearray()
+        self._position = 0
+        self._pending: Deque[Tuple[int, Future]] = deque()
+        self._uncompressed = 0
+        self._compressed = 0
+        self.blocks: List[Block] = []
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self._position += len(data)
+        while len(self._buffer) >= BLOCK_SIZE:
+            self._submit(bytes(self._buffer[:BLOCK_SIZE]))
+            del self._buffer[:BLOCK_SIZE]
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def _submit(self, block: bytes) -> None:
+        self._pending.append((len(block), self._pool.submit(self._codec.compress, block)))
+        if len(self._pending) > self._workers * 2:
+            self._drain_one()
+
+    def _drain_one(self) -> None:
+        length, future = self._pending.popleft()
+        data = future.result()
+        self._out.write(data)
+        self.blocks.append((self._uncompressed, self._compressed, len(data)))
+        self._uncompressed += length
+        self._compressed += len(data)
+
+    def close(self) -> None:
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._drain_one()
+        finally:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+
+    @property
+    def size(self) -> int:
+        return self._position
+
+
+class _MemberReader:
+    # Source file as tarfile reads it: hashed on the way, charged to the limiter, and held
+    # to the size announced in the member header. A file that shrinks or fails to read
+    # mid-way is padded with zeros, since the header is already written, and flagged.
+
+    def __init__(self, handle: BinaryIO, size: int, limiter: Optional[Limiter]) -> None:
+        self._handle = handle
+        self._remaining = size
+        self._limiter = limiter
+        self.hasher = hashlib.sha256()
+        self.error: Optional[str] = None
+
+    def read(self, size: int) -> bytes:
+        size = min(size, self._remaining)
+        data = b""
+        if self.error is None:
+            try:
+                data = self._handle.read(size)
+            except OSError as exc:
+                self.error = str(exc)
+            if len(data) < size and self.error is None:
+                self.error = "file shrank while it was archived"
+        if len(data) < size:
+            data += bytes(size - len(data))
+        self._remaining -= size
+        self.hasher.update(data)
+        if self._limiter is not None:
+            self._limiter.consume(size)
+        return data
+
+
+def _member_info(item: SourceFile) -> tarfile.TarInfo:
+    # Built from the scan's stat(), like the copy engine: symlinked files are stored with the
+    # contents they point to.
+    info = tarfile.TarInfo(item.relative.as_posix())
+    info.size = item.stat.st_size
+    info.mtime = item.stat.st_mtime
+    info.mode = item.stat.st_mode & 0o7777
+    info.uid = item.stat.st_uid
+    info.gid = item.stat.st_gid
+    return info
+
+
+def _padded(size: int) -> int:
+    return -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+
+def backup_to_archive(
+    sources: List[str],
+    snapshot: Path,
+    path_filter: PathFilter,
+    compression: str = "auto",
+    max_workers: int = DEFAULT_COMPRESS_WORKERS,
+    progress: Optional[Progress] = None,
+    limiter: Optional[Limiter] = None,
+) -> CopyStats:
+    # Streams the filtered sources into one compressed tar per snapshot. The manifest doubles
+    # as the member index: besides each file's sha256 it records where the file's data starts
+    # in the uncompressed stream, and the block index maps that to compressed blocks.
+    codec = resolve_compression(compression)
+    stats = CopyStats(progress=progress)
+    started = time.monotonic()
+    snapshot.mkdir(parents=True, exist_ok=True)
+    archive = snapshot / f"{ARCHIVE_STEM}.{codec.extension}"
+    manifest = ManifestWriter(snapshot, SNAPSHOT_FORMAT)
+    try:
+        with archive.open("wb") as out:
+            writer = _BlockWriter(out, codec, max_workers)
+            try:
+                with tarfile.open(
+                    fileobj=writer, mode="w", format=tarfile.PAX_FORMAT, copybufsize=COPY_BUFFER_SIZE
+                ) as tar:
+                    for item in iter_source_files(sources, path_filter, stats):
+                        stats.record_scanned(item.stat.st_size)
+                        _add_member(tar, item, manifest, stats, limiter)
+            finally:
+                writer.close()
+            out.flush()
+            os.fsync(out.fileno())
+        _write_block_index(snapshot, codec, archive.name, writer.size, writer.blocks)
+    except BaseException:
+        manifest.abort()
+        raise
+    manifest.close()
+    if progress is not None:
+        progress.finish_scan()
+    stats.elapsed = time.monotonic() - started
+    compressed = archive.stat().st_size
+    logger.info(
+        "Archive %s: %d bytes compressed to %d with %s in %d blocks",
+        archive,
+        writer.size,
+        compressed,
+        codec.name,
+        len(writer.blocks),
+    )
+    return stats
+
+
+def _add_member(
+    tar: tarfile.TarFile, item: SourceFile, manifest: ManifestWriter, stats: CopyStats, limiter: Optional[Limiter]
+) -> None:
+    size = item.stat.st_size
+    try:
+        handle = item.path.open("rb")
+    except OSError as exc:
+        # Nothing is written yet, so the file is simply left out.
+        logger.error("Failed to archive %s: %s", item.path, exc)
+        stats.record_error()
+        return
+    with handle:
+        reader = _MemberReader(handle, size, limiter)
+        tar.addfile(_member_info(item), reader)
+    if reader.error is not None:
+        # The zero-padded member stays in the tar, but without a manifest entry it is neither
+        # restorable nor passed by --verify under a hash the source never had.
+        logger.error("Archived %s incompletely (%s); left out of the manifest", item.path, reader.error)
+        stats.record_error()
+        return
+    manifest.write(
+        {
+            "path": item.relative.as_posix(),
+            "size": size,
+            "mtime_ns": item.stat.st_mtime_ns,
+            "mode": item.stat.st_mode & 0o7777,
+            "sha256": reader.hasher.hexdigest(),
+            "offset": tar.offset - _padded(size),
+        }
+    )
+    stats.record_copy(size)
+
+
+def _write_block_index(snapshot: Path, codec: Codec, archive_name: str, size: int, blocks: List[Block]) -> None:
+    path = snapshot / BLOCK_INDEX_NAME
+    tmp_path = path.with_name(path.name + ".tmp")
+    header = {
+        "version": BLOCK_INDEX_VERSION,
+        "codec": codec.name,
+        "archive": archive_name,
+        "size": size,
+        "block_size": BLOCK_SIZE,
+    }
+    with tmp_path.open("w", encoding="utf-8") as f:
+        f.write(json.dumps(header) + "\n")
+        for block in blocks:
+            f.write(json.dumps(block) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ArchiveReader:
+    # Random access to an archive snapshot's uncompressed tar stream through its block index.
+    # Only the blocks covering the requested range are decompressed; the last one is kept for
+    # the next read. With ``read_ahead`` the following blocks are decompressed on a thread
+    # pool while the current one is consumed, for reading the whole archive in order.
+
+    def __init__(self, snapshot: Path, read_ahead: int = 0) -> None:
+        with (snapshot / BLOCK_INDEX_NAME).open("r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            self._blocks: List[Block] = [tuple(json.loads(line)) for line in f if line.strip()]
+        if header["codec"] not in CODECS:
+            raise ValueError(f"Unknown archive codec {header['codec']!r}")
+        if header["codec"] == "zstd" and zstandard is None:
+            raise ValueError("Reading zstd archives needs the zstandard package (pip install zstandard)")
+        self.codec = CODECS[header["codec"]]
+        self.path = snapshot / header["archive"]
+        self.size: int = header["size"]
+        self._starts = [block[0] for block in self._blocks]
+        self._fd = os.open(self.path, os.O_RDONLY)
+        self._cached: Optional[Tuple[int, bytes]] = None
+        self._read_ahead = read_ahead
+        self._pool = (
+            ThreadPoolExecutor(max_workers=read_ahead, thread_name_prefix="backup-decompress", **run_context())
+            if read_ahead > 0
+            else None
+        )
+        self._ahead: Dict[int, Future] = {}
+        self.blocks_read = 0
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+        os.close(self._fd)
+
+    def __enter__(self) -> "ArchiveReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _block_end(self, index: int) -> int:
+        return self._starts[index + 1] if index + 1 < len(self._blocks) else self.size
+
+    def _decompress(self, index: int) -> bytes:
+        start, offset, length = self._blocks[index]
+        data = os.pread(self._fd, length, offset)
+        try:
+            block = self.codec.decompress(data) if len(data) == length else None
+        except _DECOMPRESS_ERRORS as exc:
+            raise CorruptArchiveError(f"Block {index} of {self.path} is corrupt: {exc}") from exc
+        if block is None or len(block) != self._block_end(index) - start:
+            raise CorruptArchiveError(f"Block {index} of {self.path} is truncated")
+        return block
+
+    def _block(self, index: int) -> bytes:
+        if self._cached is not None and self._cached[0] == index:
+            return self._cached[1]
+        self.blocks_read += 1
+        if self._pool is None:
+            data = self._decompress(index)
+        else:
+            for stale in [i for i in self._ahead if i < index]:
+                self._ahead.pop(stale).cancel()
+            for ahead in range(index, min(index + self._read_ahead * 2, len(self._blocks))):
+                if ahead not in self._ahead:
+                    self._ahead[ahead] = self._pool.submit(self._decompress, ahead)
+            data = self._ahead.pop(index).result()
+        self._cached = (index, data)
+        return data
+
+    def read(self, offset: int, size: int) -> Iterator[memoryview]:
+        # The uncompressed bytes [offset, offset + size) in pieces, one per block touched.
+        if offset + size > self.size:
+            raise CorruptArchiveError(f"{self.path} ends before byte {offset + size}")
+        end = offset + size
+        index = bisect.bisect_right(self._starts, offset) - 1
+        while offset < end:
+            block = self._block(index)
+            start = self._starts[index]
+            stop = min(end, self._block_end(index))
+            yield memoryview(block)[offset - start : stop - start]
+            offset = stop
+            index += 1
+
+
+def restore_archive(
+    snapshot: Path,
+    target: Path,
+    paths: Optional[Iterable[str]] = None,
+    progress: Optional[Progress] = None,
+    read_ahead: int = 0,
+) -> int:
+    # Extracts files from an archive snapshot, decompressing only the blocks that hold them.
+    # ``paths`` limits the restore to those files or directories (snapshot-relative).
+    prefixes = [p.strip("/") for p in paths] if paths else None
+    restored = 0
+    with ArchiveReader(snapshot, read_ahead) as reader:
+        for entry in read_manifest(snapshot):
+            rel = entry["path"]
+            if prefixes is not None and not any(rel == p or rel.startswith(p + "/") for p in prefixes):
+                continue
+            if progress is not None:
+                progress.add_found(entry["size"])
+            out = target / rel
+            out.parent.mkdir(parents=True, exist_ok=True)
+            with out.open("wb") as f:
+                for piece in reader.read(entry["offset"], entry["size"]):
+                    f.write(piece)
+            os.chmod(out, entry["mode"])
+            os.utime(out, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            restored += 1
+            if progress is not None:
+                progress.advance(entry["size"])
+    if progress is not None:
+        progress.finish_scan()
+    return restored
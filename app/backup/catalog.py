@@ -0,0 +1,347 @@
+import itertools
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .archive import SNAPSHOT_FORMAT as ARCHIVE_FORMAT, restore_archive
+from .chunkstore import SNAPSHOT_FORMAT as CHUNK_FORMAT, restore_snapshot
+from .copier import DEFAULT_MAX_WORKERS, copy_files
+from .filters import PathFilter
+from .manifest import manifest_path, read_manifest, read_manifest_header, snapshot_format
+from .packs import iter_pack_index, packed_under, read_pack_index, restore_packed
+from .progress import Progress
+from .retention import parse_timestamped_dirs
+from .verify import iter_snapshot_files
+
+logger = logging.getLogger(__name__)
+
+CATALOG_FILENAME = ".pi-backup-catalog.sqlite"
+DEFAULT_TREE_LIMIT = 500
+MAX_TREE_LIMIT = 5000
+_INSERT_BATCH = 500
+
+# Every path is stored once in ``paths`` (with its parent, for directory listings) and each
+# snapshot that holds it adds a small ``versions`` row. Directories get rows too, carrying the
+# total size of the files beneath them.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    format TEXT NOT NULL,
+    files INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    stamp INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS paths (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS paths_parent ON paths (parent, name);
+CREATE TABLE IF NOT EXISTS versions (
+    path_id INTEGER NOT NULL,
+    snapshot_id INTEGER NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER,
+    sha256 TEXT,
+    PRIMARY KEY (path_id, snapshot_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS versions_snapshot ON versions (snapshot_id);
+"""
+
+
+class UnknownSnapshotError(LookupError):
+    pass
+
+
+@dataclass
+class SnapshotInfo:
+    name: str
+    format: str
+    files: int
+    bytes: int
+
+    def to_dict(self) -> Dict:
+        return {"id": self.name, "format": self.format, "files": self.files, "bytes": self.bytes}
+
+
+def _split(path: str) -> Tuple[str, str]:
+    cut = path.rfind("/")
+    return (path[:cut], path[cut + 1 :]) if cut >= 0 else ("", path)
+
+
+def _stamp(snapshot: Path) -> Optional[int]:
+    # The manifest's mtime identifies the content the catalog was built from; None means the
+    # snapshot has no manifest and is catalogued by walking it.
+    try:
+        return manifest_path(snapshot).stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+class SnapshotCatalog:
+    # Cross-snapshot index of every stored path, kept in the destination root and rebuilt from
+    # the snapshots' manifests, so it can always be deleted. Listing a snapshot's directory or
+    # all versions of one file are single indexed queries instead of walks over every snapshot.
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._conn = sqlite3.connect(str(path), timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    @classmethod
+    def open(cls, destination_root: Path) -> "SnapshotCatalog":
+        return cls(destination_root / CATALOG_FILENAME)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "SnapshotCatalog":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    # --- building ---
+
+    def sync(self, destination_root: Path, completed: Optional[str] = None) -> int:
+        # Brings the catalog in line with the snapshots on disk and returns how many were
+        # (re)indexed. The newest snapshot is left alone while it has no manifest, since it may
+        # still be being written; the engine passes it as ``completed`` once its run is done.
+        on_disk = {snapshot.name: snapshot for snapshot in parse_timestamped_dirs(destination_root)}
+        known = {name: (sid, stamp) for sid, name, stamp in self._conn.execute("SELECT id, name, stamp FROM snapshots")}
+        gone = [sid for name, (sid, _stamp) in known.items() if name not in on_disk]
+        for sid in gone:
+            self._drop(sid)
+        if gone:
+            self._conn.execute("DELETE FROM paths WHERE id NOT IN (SELECT path_id FROM versions)")
+            self._conn.commit()
+        newest = max(on_disk, default=None)
+        indexed = 0
+        for name, snapshot in on_disk.items():
+            stamp = _stamp(snapshot)
+            previous = known.get(name)
+            if previous is not None and (stamp is None or previous[1] == stamp) and name != completed:
+                continue
+            if previous is None and stamp is None and name == newest and name != completed:
+                continue
+            if previous is not None:
+                self._drop(previous[0])
+            self._ingest(snapshot, stamp)
+            indexed += 1
+        return indexed
+
+    def _drop(self, snapshot_id: int) -> None:
+        self._conn.execute("DELETE FROM versions WHERE snapshot_id = ?", (snapshot_id,))
+        self._conn.execute("DELETE FROM snapshots WHERE id = ?", (snapshot_id,))
+
+    def _entries(self, snapshot: Path) -> Tuple[str, Iterator[Dict]]:
+        header = read_manifest_header(snapshot)
+        if header is not None:
+            return header.get("format", "directory"), read_manifest(snapshot)
+        walked = (
+            {"path": rel, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns} for rel, stat in iter_snapshot_files(snapshot)
+        )
+        # Packed files are not in the tree, but their index lists them.
+        packed = ({"path": e["path"], "size": e["size"], "mtime_ns": e["mtime_ns"]} for e in iter_pack_index(snapshot))
+        return "directory", itertools.chain(walked, packed)
+
+    def _ingest(self, snapshot: Path, stamp: Optional[int]) -> None:
+        snapshot_format, entries = self._entries(snapshot)
+        cursor = self._conn.execute(
+            "INSERT INTO snapshots (name, format, files, bytes, stamp) VALUES (?, ?, 0, 0, ?)",
+            (snapshot.name, snapshot_format, stamp or 0),
+        )
+        sid = cursor.lastrowid
+        dir_sizes: Dict[str, int] = {}
+        files = total = 0
+        batch: List[Dict] = []
+        for entry in entries:
+            batch.append(entry)
+            files += 1
+            total += entry["size"]
+            parent = _split(entry["path"])[0]
+            while parent:
+                dir_sizes[parent] = dir_sizes.get(parent, 0) + entry["size"]
+                parent = _split(parent)[0]
+            if len(batch) >= _INSERT_BATCH:
+                self._insert(sid, batch, is_dir=False)
+                batch = []
+        self._insert(sid, batch, is_dir=False)
+        dir_rows = [{"path": path, "size": size} for path, size in dir_sizes.items()]
+        for start in range(0, len(dir_rows), _INSERT_BATCH):
+            self._insert(sid, dir_rows[start : start + _INSERT_BATCH], is_dir=True)
+        self._conn.execute("UPDATE snapshots SET files = ?, bytes = ? WHERE id = ?", (files, total, sid))
+        self._conn.commit()
+        logger.info("Catalogued snapshot %s: %d files, %d directories", snapshot.name, files, len(dir_sizes))
+
+    def _insert(self, snapshot_id: int, entries: List[Dict], is_dir: bool) -> None:
+        if not entries:
+            return
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO paths (path, parent, name) VALUES (?, ?, ?)",
+            ((e["path"], *_split(e["path"])) for e in entries),
+        )
+        placeholders = ",".join("?" * len(entries))
+        ids = dict(
+            self._conn.execute(f"SELECT path, id FROM paths WHERE path IN ({placeholders})", [e["path"] for e in entries])
+        )
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (ids[e["path"]], snapshot_id, int(is_dir), e["size"], e.get("mtime_ns"), e.get("sha256"))
+                for e in entries
+            ),
+        )
+
+    # --- queries ---
+
+    def snapshots(self) -> List[SnapshotInfo]:
+        rows = self._conn.execute("SELECT name, format, files, bytes FROM snapshots ORDER BY name DESC")
+        return [SnapshotInfo(*row) for row in rows]
+
+    def _snapshot_id(self, name: str) -> int:
+        row = self._conn.execute("SELECT id FROM snapshots WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise UnknownSnapshotError(f"Unknown snapshot {name}")
+        return row[0]
+
+    def tree(
+        self, snapshot: str, path: str = "", cursor: Optional[str] = None, limit: int = DEFAULT_TREE_LIMIT
+    ) -> Tuple[List[Dict], Optional[str]]:
+        # One page of a directory's children in name order; the cursor is the last name returned.
+        sid = self._snapshot_id(snapshot)
+        parent = path.strip("/")
+        limit = max(1, min(limit, MAX_TREE_LIMIT))
+        rows = self._conn.execute(
+            "SELECT p.name, p.path, v.is_dir, v.size, v.mtime_ns, v.sha256 FROM paths p "
+            "JOIN versions v ON v.path_id = p.id AND v.snapshot_id = ? "
+            "WHERE p.parent = ? AND p.name > ? ORDER BY p.name LIMIT ?",
+            (sid, parent, cursor or "", limit + 1),
+        ).fetchall()
+        entries = [
+            {
+                "name": name,
+                "path": rel,
+                "type": "dir" if is_dir else "file",
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "sha256": sha256,
+            }
+            for name, rel, is_dir, size, mtime_ns, sha256 in rows[:limit]
+        ]
+        next_cursor = entries[-1]["name"] if len(rows) > limit else None
+        return entries, next_cursor
+
+    def reclaimable_bytes(self, snapshot: str, kept: Iterable[str]) -> int:
+        # Estimated space freed by deleting ``snapshot`` while the ``kept`` snapshots stay: the
+        # files no kept snapshot of the same format holds unchanged. Unchanged files are shared
+        # through hard links or chunks in incremental and chunk snapshots; separate full copies
+        # are counted as shared too, so the estimate errs low.
+        sid = self._snapshot_id(snapshot)
+        names = list(kept)
+        placeholders = ",".join("?" * len(names))
+        row = self._conn.execute(
+            "SELECT COALESCE(SUM(v.size), 0) FROM versions v WHERE v.snapshot_id = ? AND v.is_dir = 0 "
+            "AND NOT EXISTS (SELECT 1 FROM versions o JOIN snapshots s ON s.id = o.snapshot_id "
+            f"WHERE o.path_id = v.path_id AND o.is_dir = 0 AND s.name IN ({placeholders}) "
+            "AND s.format = (SELECT format FROM snapshots WHERE id = ?) "
+            "AND o.size = v.size AND o.mtime_ns IS v.mtime_ns)",
+            (sid, *names, sid),
+        ).fetchone()
+        return row[0]
+
+    def versions(self, path: str) -> List[Dict]:
+        # Every snapshot holding ``path``, newest first. "changed" marks where the content differs
+        # from the next older copy, i.e. where a distinct version begins.
+        rows = self._conn.execute(
+            "SELECT s.name, v.is_dir, v.size, v.mtime_ns, v.sha256 FROM paths p "
+            "JOIN versions v ON v.path_id = p.id JOIN snapshots s ON s.id = v.snapshot_id "
+            "WHERE p.path = ? ORDER BY s.name DESC",
+            (path.strip("/"),),
+        ).fetchall()
+        found = []
+        for i, (name, is_dir, size, mtime_ns, sha256) in enumerate(rows):
+            older = rows[i + 1] if i + 1 < len(rows) else None
+            found.append(
+                {
+                    "snapshot": name,
+                    "type": "dir" if is_dir else "file",
+                    "size": size,
+                    "mtime_ns": mtime_ns,
+                    "sha256": sha256,
+                    "changed": older is None or _differs(rows[i], older),
+                }
+            )
+        return found
+
+
+def _differs(newer: Tuple, older: Tuple) -> bool:
+    # Rows are (snapshot, is_dir, size, mtime_ns, sha256); hashes decide when both have one.
+    if newer[4] and older[4]:
+        return newer[4] != older[4]
+    return newer[2:4] != older[2:4]
+
+
+def sync_catalog(destination_root: Path, completed: Optional[str] = None) -> None:
+    with SnapshotCatalog.open(destination_root) as catalog:
+        catalog.sync(destination_root, completed)
+
+
+def check_restore_paths(paths: Iterable[str]) -> List[str]:
+    # Snapshot-relative paths ("<source name>/..."); anything that could escape the target is refused.
+    checked = []
+    for path in paths:
+        parts = PurePosixPath(path).parts
+        if not parts or PurePosixPath(path).is_absolute() or ".." in parts:
+            raise ValueError(f"Invalid snapshot path {path!r}")
+        checked.append("/".join(parts))
+    if not checked:
+        raise ValueError("No paths selected for restore")
+    return checked
+
+
+def restore_paths(
+    snapshot: Path,
+    paths: Iterable[str],
+    target: Path,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    progress: Optional[Progress] = None,
+) -> int:
+    # Copies files or directories out of a snapshot to ``target``, keeping their snapshot-relative
+    # layout (target/<source name>/...). Directory snapshots go through the parallel copier,
+    # with packed files read straight from their packs; chunk snapshots through the parallel
+    # chunk restore, archive snapshots by decompressing just the blocks holding the files.
+    # Returns the number of files restored.
+    selected = check_restore_paths(paths)
+    if snapshot_format(snapshot) == CHUNK_FORMAT:
+        return restore_snapshot(snapshot, target, selected, max_workers=max_workers, progress=progress)
+    if snapshot_format(snapshot) == ARCHIVE_FORMAT:
+        return restore_archive(snapshot, target, selected, progress=progress)
+    restored = errors = 0
+    packed = read_pack_index(snapshot)
+    for rel in selected:
+        source = snapshot / rel
+        members = packed_under(packed, rel)
+        if not os.path.lexists(source):
+            if not members:
+                raise FileNotFoundError(f"{rel} is not in snapshot {snapshot.name}")
+        else:
+            parent = _split(rel)[0]
+            stats = copy_files([str(source)], target / parent, PathFilter(), max_workers=max_workers, progress=progress)
+            restored += stats.files_copied
+            errors += stats.errors
+        done, failed = restore_packed(snapshot, members, target, progress)
+        restored += done
+        errors += failed
+    if errors:
+        raise OSError(f"Restored {restored} files to {target}; {errors} could not be restored (see the log)")
+    return restored
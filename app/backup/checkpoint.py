@@ -0,0 +1,205 @@
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .manifest import ENGINE_FILE_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Present in a snapshot from the moment it is created until its run finished; a snapshot
+# carrying it was interrupted (power loss, a dropped USB drive, a crash) and is not a backup.
+INCOMPLETE_MARKER = ".pi-backup-incomplete"
+CHECKPOINT_NAME = ".pi-backup-checkpoint.jsonl"
+CHECKPOINT_VERSION = 1
+# Seconds between checkpoint writes. Each one syncs the destination filesystem first, so the
+# interval bounds both the work redone after a power cut and the cost of the syncs.
+CHECKPOINT_INTERVAL = 30.0
+
+# relative path -> (size, mtime_ns, sha256) of a file the interrupted run finished.
+Completed = Dict[str, Tuple[int, int, Optional[str]]]
+
+
+def _fsync_dir(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _load_syncfs():
+    # syncfs(2) is Linux-only and has no wrapper in the os module.
+    if not sys.platform.startswith("linux"):
+        return None
+    libc_name = ctypes.util.find_library("c") or "libc.so.6"
+    try:
+        syncfs = ctypes.CDLL(libc_name, use_errno=True).syncfs
+    except (OSError, AttributeError):
+        return None
+    syncfs.argtypes = [ctypes.c_int]
+    syncfs.restype = ctypes.c_int
+    return syncfs
+
+
+_syncfs = _load_syncfs()
+
+
+def sync_filesystem(path: Path) -> None:
+    # Writes back everything cached for the filesystem holding ``path`` (the files the copy
+    # workers wrote without fsyncing each one). Unlike os.sync() it does not wait for every
+    # other mounted disk, which on a Pi backing up to a slow USB stick or NFS share stalls
+    # unrelated I/O. os.sync() remains the fallback where syncfs is missing.
+    if _syncfs is None:
+        if hasattr(os, "sync"):
+            os.sync()
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if _syncfs(fd) != 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), str(path))
+    finally:
+        os.close(fd)
+
+
+def mark_incomplete(snapshot: Path, run_id: str, snapshot_format: str) -> None:
+    marker = snapshot / INCOMPLETE_MARKER
+    with marker.open("w", encoding="utf-8") as f:
+        json.dump({"run_id": run_id, "format": snapshot_format, "started_at": time.time()}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    _fsync_dir(snapshot)
+
+
+def mark_complete(snapshot: Path) -> None:
+    # Everything written into the snapshot reaches the disk before the marker goes away.
+    sync_filesystem(snapshot)
+    (snapshot / CHECKPOINT_NAME).unlink(missing_ok=True)
+    (snapshot / INCOMPLETE_MARKER).unlink(missing_ok=True)
+    _fsync_dir(snapshot)
+
+
+def incomplete_format(snapshot: Path) -> Optional[str]:
+    try:
+        with (snapshot / INCOMPLETE_MARKER).open("r", encoding="utf-8") as f:
+            return json.load(f).get("format")
+    except (OSError, ValueError):
+        return None
+
+
+def load_checkpoint(snapshot: Path) -> Tuple[Completed, Optional[str]]:
+    # Files the interrupted run recorded as finished, and the last source position it reached.
+    # A line cut short by the interruption is ignored.
+    completed: Completed = {}
+    position = None
+    try:
+        with (snapshot / CHECKPOINT_NAME).open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "position" in record:
+                    position = record["position"]
+                elif "path" in record:
+                    completed[record["path"]] = (record["size"], record["mtime_ns"], record.get("sha256"))
+    except OSError:
+        pass
+    return completed, position
+
+
+class Checkpoint:
+    # Append-only log of the files a run has finished, in manifest entry form, plus the source
+    # position reached. Entries are buffered and written every CHECKPOINT_INTERVAL seconds,
+    # after syncing the destination filesystem, so a file the checkpoint lists is on disk
+    # whatever happens next.
+    # ``completed`` holds what an interrupted earlier run into the same snapshot finished.
+
+    def __init__(self, snapshot: Path, completed: Optional[Completed] = None, interval: Optional[float] = None) -> None:
+        self.path = snapshot / CHECKPOINT_NAME
+        self.completed: Completed = completed or {}
+        self.resuming = completed is not None
+        self.interval = CHECKPOINT_INTERVAL if interval is None else interval
+        self._pending: List[Dict] = []
+        self._position: Optional[str] = None
+        self._last_write = time.monotonic()
+        self._lock = threading.Lock()
+        self._handle = self.path.open("a", encoding="utf-8")
+        if self._handle.tell() == 0:
+            self._handle.write(json.dumps({"version": CHECKPOINT_VERSION}) + "\n")
+            self._handle.flush()
+            os.fsync(self._handle.fileno())
+            _fsync_dir(snapshot)
+        else:
+            # Ends whatever line the interrupted run was cut off in; load_checkpoint skips it.
+            self._handle.write("\n")
+
+    def record(self, entries: Iterable[Dict], position: Optional[str] = None) -> None:
+        with self._lock:
+            self._pending.extend(entries)
+            if position is not None:
+                self._position = position
+            if self.due():
+                self._write()
+
+    def _write(self) -> None:
+        sync_filesystem(self.path.parent)
+        lines = [json.dumps(entry, separators=(",", ":")) for entry in self._pending]
+        if self._position is not None:
+            lines.append(json.dumps({"position": self._position}))
+        if lines:
+            self._handle.write("\n".join(lines) + "\n")
+            self._handle.flush()
+            os.fsync(self._handle.fileno())
+        self._pending.clear()
+        self._last_write = time.monotonic()
+
+    def due(self) -> bool:
+        return time.monotonic() - self._last_write >= self.interval
+
+    def lookup(self, relative: str, size: int, mtime_ns: int) -> Optional[Tuple[int, int, Optional[str]]]:
+        done = self.completed.get(relative)
+        if done is not None and done[0] == size and done[1] == mtime_ns:
+            return done
+        return None
+
+    def flush(self) -> None:
+        with self._lock:
+            self._write()
+
+    def close(self) -> None:
+        self._handle.close()
+
+
+def remove_leftovers(snapshot: Path, kept: Set[str]) -> int:
+    # After a resumed run: drops files the interrupted run stored that are no longer in the
+    # sources, so the snapshot matches what a fresh run would have written.
+    removed = 0
+    pending = [(str(snapshot), "")]
+    while pending:
+        dir_path, rel_root = pending.pop()
+        try:
+            with os.scandir(dir_path) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        for entry in entries:
+            if not rel_root and entry.name.startswith(ENGINE_FILE_PREFIX):
+                continue
+            rel = f"{rel_root}/{entry.name}" if rel_root else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                pending.append((entry.path, rel))
+            elif rel not in kept:
+                try:
+                    os.unlink(entry.path)
+                    removed += 1
+                except OSError as exc:
+                    logger.warning("Could not remove %s from the resumed snapshot: %s", entry.path, exc)
+    return removed
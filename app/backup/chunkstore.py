@@ -0,0 +1,353 @@
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .copier import DEFAULT_MAX_WORKERS, QUEUE_DEPTH_PER_WORKER, CopyStats, SourceFile, iter_source_files
+from .fastcopy import Limiter
+from .filters import PathFilter
+from .logreader import run_context
+from .manifest import ManifestCursor, ManifestWriter, OrderedWriter, read_manifest, snapshot_format
+from .profiling import active_profile
+from .progress import Progress
+
+try:
+    import numpy
+except ImportError:  # optional; boundaries are then found with big-integer arithmetic
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_DIR = ".chunks"
+SNAPSHOT_FORMAT = "chunks"
+
+# Content-defined chunking with a gear rolling hash (as in FastCDC): a cut happens where the
+# hash of the last 32 bytes has its top 20 bits clear, so boundaries move with the content and
+# an edit only changes the chunks around it. Sizes average roughly MIN + 1 MiB.
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+CHUNK_MASK = 0xFFFFF000
+_GEAR_RNG = random.Random(0x50494241)
+_GEAR = [_GEAR_RNG.getrandbits(32) for _ in range(256)]
+
+
+# The hash at a byte only depends on the last 32 bytes, so all hashes of a block can be worked
+# out at once: start from each byte's gear value and, for w = 1, 2, 4, 8, 16, add the sum ending
+# w bytes earlier shifted left by w. The boundary search does that a block at a time, carrying
+# the 31 bytes before each block over, and finds the same cut points as hashing byte by byte.
+_WINDOW = 32
+SCAN_BLOCK = 64 * 1024
+# Tables for the big-integer search: each byte's gear value split into its four bytes.
+_GEAR_BYTES = [bytes((value >> (8 * k)) & 0xFF for value in _GEAR) for k in range(4)]
+_GEAR_ARRAY = numpy.array(_GEAR, dtype=numpy.uint32) if numpy is not None else None
+
+
+def _find_boundary_numpy(data: bytearray, start: int, end: int, mask: int) -> int:
+    # numpy releases the GIL in its loops, so store workers chunk files in parallel.
+    lane_mask = numpy.uint32(mask)
+    shifted = numpy.empty(SCAN_BLOCK + _WINDOW, dtype=numpy.uint32)
+    pos = start
+    while pos < end:
+        stop = min(end, pos + SCAN_BLOCK)
+        lead = min(pos - start, _WINDOW - 1)
+        count = stop - pos + lead
+        hashes = _GEAR_ARRAY.take(numpy.frombuffer(data, dtype=numpy.uint8, count=count, offset=pos - lead))
+        for w in (1, 2, 4, 8, 16):
+            numpy.left_shift(hashes[:-w], w, out=shifted[: count - w])
+            hashes[w:] += shifted[: count - w]
+        hashes &= lane_mask
+        first = int(hashes[lead:].argmin())
+        if hashes[lead + first] == 0:
+            return pos + first + 1
+        pos = stop
+    return end
+
+
+@lru_cache(maxsize=8)
+def _lane_constants(count: int, mask: int) -> Tuple[int, int, int]:
+    # One 64-bit lane per byte: the low 32 bits, ``mask``, and bit 32 of every lane.
+    def lanes(pattern: bytes) -> int:
+        return int.from_bytes(pattern * count, "little")
+
+    return lanes(b"\xff\xff\xff\xff\0\0\0\0"), lanes(mask.to_bytes(4, "little") + b"\0\0\0\0"), lanes(b"\0\0\0\0\x01\0\0\0")
+
+
+def _find_boundary_int(data: bytearray, start: int, end: int, mask: int) -> int:
+    # Without numpy the lanes of a block are packed into one Python integer, so each step is a
+    # handful of big-integer operations instead of a Python loop over every byte.
+    pos = start
+    while pos < end:
+        stop = min(end, pos + SCAN_BLOCK)
+        lead = min(pos - start, _WINDOW - 1)
+        block = bytes(data[pos - lead : stop])
+        count = len(block)
+        lanes = bytearray(8 * count)
+        for k, table in enumerate(_GEAR_BYTES):
+            lanes[k::8] = block.translate(table)
+        hashes = int.from_bytes(lanes, "little")
+        low, lane_mask, carry = _lane_constants(count, mask)
+        for w in (1, 2, 4, 8, 16):
+            hashes = (hashes + (hashes << (65 * w))) & low
+        # Adding 2**32 - 1 carries into bit 32 of every lane whose masked hash is not zero.
+        flags = (((hashes & lane_mask) + low) & carry).to_bytes(8 * count, "little")[4::8]
+        first = flags.find(b"\0", lead)
+        if first >= 0:
+            return pos - lead + first + 1
+        pos = stop
+    return end
+
+
+def _find_boundary(data: bytearray, start: int, end: int, mask: int) -> int:
+    # Index just past the first byte in [start, end) whose gear hash, with the hash starting
+    # from zero at ``start``, has no bit of ``mask`` set; ``end`` when there is none.
+    if numpy is not None:
+        return _find_boundary_numpy(data, start, end, mask)
+    return _find_boundary_int(data, start, end, mask)
+
+
+def iter_chunks(handle: BinaryIO) -> Iterator[bytes]:
+    min_size, max_size, mask = MIN_CHUNK_SIZE, MAX_CHUNK_SIZE, CHUNK_MASK
+    buffer = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buffer) < max_size:
+            block = handle.read(max_size)
+            if block:
+                buffer += block
+            else:
+                eof = True
+        if not buffer:
+            return
+        if len(buffer) <= min_size:
+            cut = len(buffer)
+        else:
+            cut = _find_boundary(buffer, min_size, min(len(buffer), max_size), mask)
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+
+
+class ChunkStore:
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def chunk_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def put(self, data: bytes) -> Tuple[str, bool]:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if path.exists():
+            return digest, False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{digest}.{threading.get_ident()}.tmp")
+        with tmp_path.open("wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return digest, True
+
+    def get(self, digest: str) -> bytes:
+        data = self.chunk_path(digest).read_bytes()
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Chunk {digest} is corrupt")
+        return data
+
+    def iter_digests(self) -> Iterator[Path]:
+        if not self.root.exists():
+            return
+        for bucket in self.root.iterdir():
+            if bucket.is_dir():
+                yield from (p for p in bucket.iterdir() if not p.name.endswith(".tmp"))
+
+
+def _store_file(
+    item: SourceFile, store: ChunkStore, stats: CopyStats, limiter: Optional[Limiter] = None
+) -> Optional[List[str]]:
+    digests = []
+    written = 0
+    new = 0
+    try:
+        with item.path.open("rb") as f:
+            for chunk in iter_chunks(f):
+                digest, created = store.put(chunk)
+                digests.append(digest)
+                if created:
+                    written += len(chunk)
+                    new += 1
+                if limiter is not None:
+                    limiter.consume(len(chunk))
+    except OSError as exc:
+        logger.error("Failed to store %s: %s", item.path, exc)
+        stats.record_error()
+        return None
+    profile = active_profile()
+    profile.count("chunks.new", new)
+    profile.count("chunks.reused", len(digests) - new)
+    # Only bytes of chunks the store did not already hold count as copied.
+    stats.record_copy(written, source_size=item.stat.st_size)
+    return digests
+
+
+def _manifest_entry(item: SourceFile, digests: List[str]) -> Dict:
+    return {
+        "path": item.relative.as_posix(),
+        "size": item.stat.st_size,
+        "mtime_ns": item.stat.st_mtime_ns,
+        "mode": item.stat.st_mode & 0o7777,
+        "chunks": digests,
+    }
+
+
+def backup_to_chunks(
+    sources: List[str],
+    snapshot: Path,
+    path_filter: PathFilter,
+    previous: Optional[Path] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    progress: Optional[Progress] = None,
+    limiter: Optional[Limiter] = None,
+) -> CopyStats:
+    store = ChunkStore(snapshot.parent / CHUNK_DIR)
+    stats = CopyStats(progress=progress)
+    started = time.monotonic()
+    # The previous manifest is merge-walked alongside the sorted scan, and this one is written
+    # in scan order for the next run, so neither is ever held in memory.
+    previous_entries = ManifestCursor(previous)
+
+    snapshot.mkdir(parents=True, exist_ok=True)
+    writer = ManifestWriter(snapshot, SNAPSHOT_FORMAT)
+    ordered = OrderedWriter(writer)
+    workers = max(1, max_workers)
+    slots = threading.BoundedSemaphore(workers * QUEUE_DEPTH_PER_WORKER)
+
+    def store_and_record(slot: int, item: SourceFile) -> None:
+        entry = None
+        try:
+            digests = _store_file(item, store, stats, limiter)
+            if digests is not None:
+                entry = _manifest_entry(item, digests)
+        except Exception as exc:  # noqa: BLE001
+            # Nothing reads the future, so an unexpected error is counted here or not at all.
+            logger.error("Failed to store %s: %r", item.path, exc, exc_info=exc)
+            stats.record_error()
+        finally:
+            ordered.fill(slot, entry)
+            slots.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backup-chunk", **run_context()) as pool:
+            for item in iter_source_files(sources, path_filter, stats):
+                stats.record_scanned(item.stat.st_size)
+                entry = previous_entries.get(item.relative.as_posix())
+                if (
+                    entry is not None
+                    and entry["size"] == item.stat.st_size
+                    and entry["mtime_ns"] == item.stat.st_mtime_ns
+                ):
+                    # Unchanged since the previous snapshot: reuse its chunk list without reading the file.
+                    ordered.write(_manifest_entry(item, entry["chunks"]))
+                    stats.record_link(item.stat.st_size)
+                    continue
+                slot = ordered.reserve()
+                slots.acquire()
+                pool.submit(store_and_record, slot, item)
+            if progress is not None:
+                progress.finish_scan()
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        previous_entries.close()
+    writer.close()
+    stats.elapsed = time.monotonic() - started
+    return stats
+
+
+def restore_snapshot(
+    snapshot: Path,
+    target: Path,
+    paths: Optional[Iterable[str]] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    progress: Optional[Progress] = None,
+) -> int:
+    # Rebuilds files from a chunk snapshot, several files at a time. ``paths`` limits the
+    # restore to those files or directories (snapshot-relative); each chunk is re-hashed as it
+    # is read back.
+    store = ChunkStore(snapshot.parent / CHUNK_DIR)
+    prefixes = [p.strip("/") for p in paths] if paths else None
+    workers = max(1, max_workers)
+    slots = threading.BoundedSemaphore(workers * QUEUE_DEPTH_PER_WORKER)
+    lock = threading.Lock()
+    state: Dict = {"restored": 0, "error": None}
+
+    def restore_file(entry: Dict) -> None:
+        try:
+            out = target / entry["path"]
+            out.parent.mkdir(parents=True, exist_ok=True)
+            with out.open("wb") as f:
+                for digest in entry["chunks"]:
+                    f.write(store.get(digest))
+            os.chmod(out, entry["mode"])
+            os.utime(out, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            with lock:
+                state["restored"] += 1
+            if progress is not None:
+                progress.advance(entry["size"])
+        except Exception as exc:  # noqa: BLE001
+            with lock:
+                state["error"] = state["error"] or exc
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backup-restore", **run_context()) as pool:
+        for entry in read_manifest(snapshot):
+            rel = entry["path"]
+            if prefixes is not None and not any(rel == p or rel.startswith(p + "/") for p in prefixes):
+                continue
+            if progress is not None:
+                progress.add_found(entry["size"])
+            slots.acquire()
+            pool.submit(restore_file, entry)
+            if state["error"] is not None:
+                break
+        if progress is not None:
+            progress.finish_scan()
+    if state["error"] is not None:
+        raise state["error"]
+    return state["restored"]
+
+
+def chunk_references(snapshots: Iterable[Path]) -> Counter:
+    refs: Counter = Counter()
+    for snapshot in snapshots:
+        if snapshot_format(snapshot) != SNAPSHOT_FORMAT:
+            continue
+        for entry in read_manifest(snapshot):
+            refs.update(entry["chunks"])
+    return refs
+
+
+def collect_garbage(base: Path, snapshots: Iterable[Path]) -> Tuple[int, int]:
+    # Reference counts are rebuilt from the surviving manifests rather than persisted, so a
+    # crash between writing a manifest and updating counters can never leak or lose chunks.
+    refs = chunk_references(snapshots)
+    removed = 0
+    freed = 0
+    for chunk in ChunkStore(base / CHUNK_DIR).iter_digests():
+        if refs[chunk.name] > 0:
+            continue
+        try:
+            freed += chunk.stat().st_size
+            chunk.unlink()
+            removed += 1
+        except OSError as exc:
+            logger.warning("Could not remove unreferenced chunk %s: %s", chunk, exc)
+    if removed:
+        logger.info("Removed %d unreferenced chunks (%d bytes)", removed, freed)
+    return removed, freed
@@ -1,10 +1,13 @@
 import json
+import threading
 from dataclasses import asdict, dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
 
 DEFAULT_ALLOWED_ROOTS = ["/home/pi", "/mnt", "/media"]
 CONFIG_FILENAME = "backup_config.json"
+DESTINATION_FORMATS = ("directory", "chunks", "archive")
 
 
 def get_config_dir() -> Path:
@@ -19,6 +22,32 @@ def get_config_path() -> Path:
 class RetentionRules:
     keep_last: Optional[int] = 3
     max_age_days: Optional[int] = None
+    # Also prune the oldest snapshots until this much space is free on the destination.
+    min_free_gb: Optional[float] = None
+
+
+@dataclass
+class ScheduleRules:
+    # Five-field cron spec ("30 2 * * *") in local time; None leaves backups manual-only.
+    cron: Optional[str] = None
+    jitter_seconds: int = 0
+    catch_up: bool = True
+
+
+@dataclass
+class ThrottleRules:
+    # Bandwidth cap in KiB/s (rsync's --bwlimit unit) shared by all copy workers.
+    bwlimit_kib: Optional[int] = None
+    # Priority of the backup's threads and rsync processes: nice 0-19, and ionice
+    # "best-effort" (with level 0-7) or "idle".
+    nice: Optional[int] = None
+    ionice_class: Optional[str] = None
+    ionice_level: Optional[int] = None
+    # Slow down while I/O wait or the load average per core is above these, and speed back
+    # up once the system is idle.
+    adaptive: bool = False
+    max_iowait_percent: float = 20.0
+    max_load_per_cpu: float = 1.0
 
 
 @dataclass
@@ -29,11 +58,29 @@ class BackupConfig:
     include_patterns: List[str] = field(default_factory=list)
     exclude_patterns: List[str] = field(default_factory=list)
     retention: RetentionRules = field(default_factory=RetentionRules)
+    incremental: bool = False
+    max_workers: int = 4
+    destination_format: str = "directory"
+    # "auto" (zstd when the zstandard package is installed, else gzip), "zstd" or "gzip".
+    archive_compression: str = "auto"
+    rsync_concurrency: int = 1
+    watch_changes: bool = False
+    hash_manifests: bool = True
+    resume_incomplete: bool = True
+    # Directory snapshots: files smaller than this many KiB go into pack files (see packs.py)
+    # instead of one destination file each. None copies every file on its own.
+    pack_below_kib: Optional[int] = None
+    schedule: ScheduleRules = field(default_factory=ScheduleRules)
+    throttle: ThrottleRules = field(default_factory=ThrottleRules)
 
     @classmethod
     def from_dict(cls, data: Dict) -> "BackupConfig":
         retention_data = data.get("retention", {})
         retention = RetentionRules(**retention_data) if isinstance(retention_data, dict) else RetentionRules()
+        schedule_data = data.get("schedule", {})
+        schedule = ScheduleRules(**schedule_data) if isinstance(schedule_data, dict) else ScheduleRules()
+        throttle_data = data.get("throttle", {})
+        throttle = ThrottleRules(**throttle_data) if isinstance(throttle_data, dict) else ThrottleRules()
         return cls(
             destination=data.get("destination", BackupConfig().destination),
             selected_paths=data.get("selected_paths", []),
@@ -41,21 +88,103 @@ class BackupConfig:
             include_patterns=data.get("include_patterns", []),
             exclude_patterns=data.get("exclude_patterns", []),
             retention=retention,
+            incremental=bool(data.get("incremental", False)),
+            max_workers=int(data.get("max_workers", BackupConfig().max_workers)),
+            destination_format=data.get("destination_format", "directory"),
+            archive_compression=data.get("archive_compression", "auto"),
+            rsync_concurrency=int(data.get("rsync_concurrency", 1)),
+            watch_changes=bool(data.get("watch_changes", False)),
+            hash_manifests=bool(data.get("hash_manifests", True)),
+            resume_incomplete=bool(data.get("resume_incomplete", True)),
+            pack_below_kib=data.get("pack_below_kib"),
+            schedule=schedule,
+            throttle=throttle,
         )
 
     def to_dict(self) -> Dict:
         data = asdict(self)
         data["retention"] = asdict(self.retention)
+        data["schedule"] = asdict(self.schedule)
+        data["throttle"] = asdict(self.throttle)
         return data
 
+    def copy(self) -> "BackupConfig":
+        return BackupConfig.from_dict(self.to_dict())
+
+
+class AllowedRoots:
+    # Allowed roots resolved once, so checking a path is a few set lookups on its (already
+    # resolved) parents instead of resolving every root again for every path.
+
+    def __init__(self, roots: Iterable[str]) -> None:
+        resolved = set()
+        for root in roots:
+            try:
+                resolved.add(str(Path(root).resolve()))
+            except (OSError, RuntimeError):
+                continue
+        self.roots: FrozenSet[str] = frozenset(resolved)
+
+    def contains(self, resolved_path: Path) -> bool:
+        path = str(resolved_path)
+        while True:
+            if path in self.roots:
+                return True
+            cut = path.rfind("/")
+            if cut < 0:
+                return False
+            if cut == 0:
+                return "/" in self.roots
+            path = path[:cut]
+
+
+@lru_cache(maxsize=16)
+def _allowed_roots(roots: Tuple[str, ...]) -> AllowedRoots:
+    return AllowedRoots(roots)
+
+
+def get_allowed_roots(roots: Iterable[str]) -> AllowedRoots:
+    return _allowed_roots(tuple(roots))
+
+
+# Parsed config keyed by (path, mtime_ns, size) of the file it was read from. Callers always
+# get a copy, so mutating a loaded config never leaks into the cache.
+_cache_lock = threading.Lock()
+_cached: Optional[Tuple[Tuple[Path, int, int], BackupConfig]] = None
+
+
+def _signature(config_path: Path) -> Optional[Tuple[Path, int, int]]:
+    try:
+        stat = config_path.stat()
+    except FileNotFoundError:
+        return None
+    return (config_path, stat.st_mtime_ns, stat.st_size)
+
+
+def invalidate_config_cache() -> None:
+    global _cached
+    with _cache_lock:
+        _cached = None
+    _allowed_roots.cache_clear()
+
 
 def load_config() -> BackupConfig:
+    global _cached
     config_path = get_config_path()
-    if not config_path.exists():
+    signature = _signature(config_path)
+    if signature is None:
         return BackupConfig()
+    with _cache_lock:
+        if _cached is not None and _cached[0] == signature:
+            return _cached[1].copy()
     with config_path.open("r", encoding="utf-8") as f:
         data = json.load(f)
-    return BackupConfig.from_dict(data)
+    config = BackupConfig.from_dict(data)
+    # Roots may have been re-pointed (symlinks, mounts) along with the edit.
+    _allowed_roots.cache_clear()
+    with _cache_lock:
+        _cached = (signature, config.copy())
+    return config
 
 
 def save_config(config: BackupConfig) -> None:
@@ -63,6 +192,7 @@ def save_config(config: BackupConfig) -> None:
     config_path.parent.mkdir(parents=True, exist_ok=True)
     with config_path.open("w", encoding="utf-8") as f:
         json.dump(config.to_dict(), f, indent=2)
+    invalidate_config_cache()
 
 
 def ensure_default_config() -> None:
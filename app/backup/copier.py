@@ -0,0 +1,504 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from stat import S_ISDIR, S_ISREG
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from .checkpoint import Checkpoint, remove_leftovers
+from .fastcopy import Limiter, copy_file, hash_file
+from .filters import PathFilter
+from .index import FileIndex, index_row
+from .logreader import run_context
+from .manifest import ManifestWriter
+from .packs import PackWriter
+from .profiling import active_profile
+from .progress import Progress
+from .retention import parse_timestamped_dirs
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 4
+# Files queued ahead of the workers, per worker. Keeps the scanner from racing ahead and
+# holding millions of pending entries in memory on huge trees.
+QUEUE_DEPTH_PER_WORKER = 4
+INDEX_FLUSH_INTERVAL = 1000
+
+
+@dataclass
+class CopyStats:
+    files_scanned: int = 0
+    files_copied: int = 0
+    files_linked: int = 0
+    bytes_copied: int = 0
+    bytes_linked: int = 0
+    # Files an interrupted run into the same snapshot had already stored (see checkpoint).
+    files_resumed: int = 0
+    bytes_resumed: int = 0
+    errors: int = 0
+    elapsed: float = 0.0
+    scan_elapsed: float = 0.0
+    # Files copied per transfer method (see fastcopy.copy_file).
+    methods: Dict[str, int] = field(default_factory=dict)
+    progress: Optional[Progress] = field(default=None, repr=False, compare=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @property
+    def throughput(self) -> float:
+        return self.bytes_copied / self.elapsed if self.elapsed > 0 else 0.0
+
+    def record_scanned(self, size: int) -> None:
+        # Only the scanning thread updates files_scanned, so it needs no lock.
+        self.files_scanned += 1
+        if self.progress is not None:
+            self.progress.add_found(size)
+
+    def record_copy(self, size: int, source_size: Optional[int] = None, method: Optional[str] = None) -> None:
+        with self._lock:
+            self.files_copied += 1
+            self.bytes_copied += size
+            if method is not None:
+                self.methods[method] = self.methods.get(method, 0) + 1
+        if self.progress is not None:
+            self.progress.advance(size if source_size is None else source_size)
+
+    def record_link(self, size: int) -> None:
+        with self._lock:
+            self.files_linked += 1
+            self.bytes_linked += size
+        if self.progress is not None:
+            self.progress.advance(size)
+
+    def record_resumed(self, size: int) -> None:
+        with self._lock:
+            self.files_resumed += 1
+            self.bytes_resumed += size
+        if self.progress is not None:
+            self.progress.advance(size)
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+
+@dataclass
+class SourceFile:
+    path: Path
+    relative: Path
+    stat: os.stat_result
+
+
+def iter_source_files(sources: List[str], path_filter: PathFilter, stats: CopyStats) -> Iterator[SourceFile]:
+    return _timed(_iter_sources(sources, path_filter, stats), stats)
+
+
+def _timed(files: Iterator[SourceFile], stats: CopyStats) -> Iterator[SourceFile]:
+    # Scanning is interleaved with copying, so only the time spent producing the next entry
+    # counts towards stats.scan_elapsed.
+    while True:
+        started = time.monotonic()
+        item = next(files, None)
+        stats.scan_elapsed += time.monotonic() - started
+        if item is None:
+            return
+        yield item
+
+
+def _iter_sources(sources: List[str], path_filter: PathFilter, stats: CopyStats) -> Iterator[SourceFile]:
+    for src in sources:
+        src_path = Path(src)
+        if src_path.is_dir():
+            if path_filter.includes_dir(src_path.name):
+                yield from _walk(src_path, path_filter, stats)
+        elif src_path.is_file():
+            if path_filter.includes_file(src_path.name):
+                yield SourceFile(src_path, Path(src_path.name), src_path.stat())
+        else:
+            logger.warning("Skipping unknown path %s", src_path)
+
+
+def _walk(
+    src_path: Path, path_filter: PathFilter, stats: CopyStats, rel_root: Optional[str] = None
+) -> Iterator[SourceFile]:
+    # Iterative scandir walk over plain strings: DirEntry caches the d_type, so classifying an
+    # entry costs no extra syscall, excluded directories are never opened and only files that
+    # survive the filters are stat'ed. Paths are matched as "<source name>/<relative path>".
+    # Entries come in path order (manifest.path_key), each directory's contents at its place,
+    # so manifests written in scan order can be merge-walked by the next run.
+    profile = active_profile()
+    pending: List[Tuple[str, Iterator[os.DirEntry]]] = []
+    listing = _sorted_listing(str(src_path), stats)
+    if listing is not None:
+        pending.append((rel_root or src_path.name, listing))
+    stated = 0
+    while pending:
+        rel_root, entries = pending[-1]
+        entry = next(entries, None)
+        if entry is None:
+            pending.pop()
+            continue
+        rel = f"{rel_root}/{entry.name}"
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            # Same as os.walk: symlinked directories are neither followed nor copied.
+            if not entry.is_symlink() and path_filter.includes_dir(rel):
+                listing = _sorted_listing(entry.path, stats)
+                if listing is not None:
+                    pending.append((rel, listing))
+            continue
+        if not path_filter.includes_file(rel):
+            continue
+        stated += 1
+        try:
+            stat = entry.stat()
+        except OSError as exc:
+            logger.error("Cannot stat %s: %s", entry.path, exc)
+            stats.record_error()
+            continue
+        yield SourceFile(Path(entry.path), Path(rel), stat)
+    profile.count("scan.stats", stated)
+
+
+def _sorted_listing(dir_path: str, stats: CopyStats) -> Optional[Iterator[os.DirEntry]]:
+    try:
+        with os.scandir(dir_path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError as exc:
+        logger.error("Cannot scan %s: %s", dir_path, exc)
+        stats.record_error()
+        return None
+    # Counted once per directory rather than per entry.
+    profile = active_profile()
+    profile.count("scan.dirs")
+    profile.count("scan.entries", len(entries))
+    return iter(entries)
+
+
+def _is_dirty(path: str, changed_paths: Set[str]) -> bool:
+    while path:
+        if path in changed_paths:
+            return True
+        path = path[: path.rfind("/")]
+    return False
+
+
+def _changed_relative(path: str, sources: List[str], path_filter: PathFilter) -> Optional[str]:
+    # "<source name>/<relative path>" for a changed path, or None when it is outside the
+    # sources or inside an excluded directory.
+    for src in sources:
+        if path == src or path.startswith(src.rstrip("/") + "/"):
+            rel = Path(src).name + path[len(src) :]
+            parent = rel.rfind("/")
+            while parent != -1:
+                if not path_filter.includes_dir(rel[:parent]):
+                    return None
+                parent = rel.rfind("/", 0, parent)
+            return rel
+    return None
+
+
+def iter_changed_files(
+    sources: List[str], path_filter: PathFilter, index: FileIndex, changed_paths: Set[str], stats: CopyStats
+) -> Iterator[SourceFile]:
+    # The file list of a run driven by the change journal: every indexed file outside the
+    # changed paths is taken as unchanged without a stat(), and only the changed paths (a file,
+    # or a directory walked in full) are looked at on the source.
+    for entry in index.iter_entries():
+        if not _is_dirty(entry.path, changed_paths):
+            yield SourceFile(Path(entry.path), Path(entry.relative), entry.as_stat())
+    for path in sorted(changed_paths):
+        if _is_dirty(path[: path.rfind("/")], changed_paths):
+            continue  # walked as part of a changed parent directory
+        rel = _changed_relative(path, sources, path_filter)
+        if rel is None:
+            continue
+        try:
+            stat = os.stat(path)
+            is_link = os.path.islink(path)
+        except OSError:
+            continue  # deleted since; dropped from the index at the end of the run
+        if S_ISDIR(stat.st_mode):
+            if not is_link and path_filter.includes_dir(rel):
+                yield from _walk(Path(path), path_filter, stats, rel)
+        elif S_ISREG(stat.st_mode) and path_filter.includes_file(rel):
+            yield SourceFile(Path(path), Path(rel), stat)
+
+
+def is_unchanged(source: os.stat_result, previous: Path) -> bool:
+    try:
+        existing = previous.stat()
+    except OSError:
+        return False
+    # Same comparison rsync's quick check uses: size plus whole-second mtime.
+    return existing.st_size == source.st_size and int(existing.st_mtime) == int(source.st_mtime)
+
+
+def _link_source(
+    item: SourceFile,
+    destination: Path,
+    link_dest: Optional[Path],
+    index: Optional[FileIndex],
+    live_snapshots: Set[str],
+) -> Tuple[Optional[Path], bool, Optional[str]]:
+    # Returns the file to hard-link from, whether it is already known to be unchanged and,
+    # if so, its content hash when the index has one.
+    if index is not None and not index.is_empty:
+        entry = index.lookup(str(item.path))
+        if entry is not None and entry.matches(item.stat) and entry.snapshot in live_snapshots:
+            return destination.parent / entry.snapshot / entry.relative, True, entry.sha256
+        # New or changed according to the index: copy without looking at the destination.
+        return None, False, None
+    if link_dest is not None:
+        return link_dest / item.relative, False, None
+    return None, False, None
+
+
+def manifest_entry(item: SourceFile, sha256: str, packed: bool = False) -> Dict:
+    entry = {
+        "path": item.relative.as_posix(),
+        "size": item.stat.st_size,
+        "mtime_ns": item.stat.st_mtime_ns,
+        "sha256": sha256,
+    }
+    if packed:
+        # Stored in a pack rather than as a file; verify checks it through the pack index.
+        entry["packed"] = True
+    return entry
+
+
+def _transfer(
+    item: SourceFile,
+    target: Path,
+    previous: Optional[Path],
+    known_unchanged: bool,
+    known_digest: Optional[str],
+    stats: CopyStats,
+    stored: Deque[Tuple[SourceFile, Optional[str]]],
+    manifest: Optional[ManifestWriter],
+    checkpoint: Optional[Checkpoint] = None,
+    limiter: Optional[Limiter] = None,
+) -> None:
+    # With a manifest every stored file gets its sha256: copies are hashed while they are
+    # copied, links reuse the hash the index recorded for the earlier copy.
+    size = item.stat.st_size
+    try:
+        if checkpoint is not None and checkpoint.resuming:
+            done = checkpoint.lookup(item.relative.as_posix(), size, item.stat.st_mtime_ns)
+            if done is not None and _stored_size(target) == size:
+                digest = done[2]
+                if manifest is not None:
+                    digest = digest or hash_file(target)
+                    manifest.write(manifest_entry(item, digest))
+                stats.record_resumed(size)
+                stored.append((item, digest))
+                return
+            # Anything else the interrupted run left here is unverified, and may be a hard link
+            # into an older snapshot that copying over it would modify.
+            target.unlink(missing_ok=True)
+        if previous is not None and (known_unchanged or is_unchanged(item.stat, previous)):
+            try:
+                os.link(previous, target)
+            except OSError as exc:
+                logger.debug("Hard link from %s failed (%s); copying instead", previous, exc)
+            else:
+                # Outside the try above: copying over a linked target would write into the
+                # previous snapshot's file.
+                digest = known_digest
+                if manifest is not None:
+                    digest = digest or hash_file(target)
+                    manifest.write(manifest_entry(item, digest))
+                stats.record_link(size)
+                stored.append((item, digest))
+                return
+        hasher = hashlib.sha256() if manifest is not None else None
+        method = copy_file(item.path, target, hasher, limiter)
+        digest = None
+        if hasher is not None:
+            digest = hasher.hexdigest()
+            manifest.write(manifest_entry(item, digest))
+        stats.record_copy(size, method=method)
+        stored.append((item, digest))
+    except OSError as exc:
+        logger.error("Failed to copy %s: %s", item.path, exc)
+        stats.record_error()
+
+
+def _pack(
+    item: SourceFile,
+    packer: PackWriter,
+    target: Path,
+    stats: CopyStats,
+    stored: Deque[Tuple[SourceFile, Optional[str]]],
+    manifest: Optional[ManifestWriter],
+    checkpoint: Optional[Checkpoint] = None,
+    limiter: Optional[Limiter] = None,
+) -> None:
+    try:
+        packed = packer.add(item.path, item.relative.as_posix(), item.stat.st_size, item.stat.st_mtime_ns, limiter)
+        if packed is None:
+            # Grown since the scan, maybe past the pack threshold: stored as a file instead,
+            # with the size it has now.
+            item = SourceFile(item.path, item.relative, item.path.stat())
+            target.parent.mkdir(parents=True, exist_ok=True)
+    except OSError as exc:
+        logger.error("Failed to pack %s: %s", item.path, exc)
+        stats.record_error()
+        return
+    if packed is None:
+        _transfer(item, target, None, False, None, stats, stored, manifest, checkpoint, limiter)
+        return
+    size, digest = packed
+    if manifest is not None:
+        manifest.write(manifest_entry(item, digest, packed=True))
+    stats.record_copy(size, method="pack")
+    stored.append((item, digest))
+
+
+def _stored_size(target: Path) -> Optional[int]:
+    try:
+        return target.stat().st_size
+    except OSError:
+        return None
+
+
+def _flush_index(
+    index: Optional[FileIndex],
+    stored: Deque[Tuple[SourceFile, Optional[str]]],
+    snapshot: str,
+    checkpoint: Optional[Checkpoint] = None,
+    position: Optional[str] = None,
+) -> None:
+    rows = []
+    entries = []
+    while stored:
+        item, digest = stored.popleft()
+        if index is not None:
+            rows.append(index_row(item.path, item.relative, item.stat, snapshot, digest))
+        if checkpoint is not None:
+            entries.append(manifest_entry(item, digest))
+    if index is not None:
+        index.record(rows)
+    if checkpoint is not None:
+        checkpoint.record(entries, position)
+
+
+def copy_files(
+    sources: List[str],
+    destination: Path,
+    path_filter: PathFilter,
+    link_dest: Optional[Path] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    index: Optional[FileIndex] = None,
+    progress: Optional[Progress] = None,
+    changed_paths: Optional[Set[str]] = None,
+    manifest: Optional[ManifestWriter] = None,
+    checkpoint: Optional[Checkpoint] = None,
+    limiter: Optional[Limiter] = None,
+    packer: Optional[PackWriter] = None,
+) -> CopyStats:
+    # The calling thread scans, filters and creates directories while the pool copies what
+    # it has already found. Per-file failures are logged and counted, never fatal. With
+    # ``changed_paths`` (and an index) only those paths are scanned; see iter_changed_files.
+    # With ``manifest`` each stored file is recorded in it with its sha256. With
+    # ``checkpoint`` stored files are logged to it, and when it resumes an interrupted run
+    # the files that run finished are kept instead of copied again. ``limiter`` caps the
+    # bandwidth of all copies together (see throttle.TokenBucket). With ``packer`` files
+    # below its threshold go into pack files instead, and need no directory of their own.
+    stats = CopyStats(progress=progress)
+    started = time.monotonic()
+    workers = max(1, max_workers)
+    slots = threading.BoundedSemaphore(workers * QUEUE_DEPTH_PER_WORKER)
+    created_dirs: set[Path] = set()
+    stored: Deque[Tuple[SourceFile, Optional[str]]] = deque()
+    snapshot = destination.name
+    live_snapshots: Set[str] = set()
+    resuming = checkpoint is not None and checkpoint.resuming
+    kept: Set[str] = set()
+    if index is not None:
+        live_snapshots = {p.name for p in parse_timestamped_dirs(destination.parent)} - {snapshot}
+
+    def settle(item: SourceFile) -> Callable[[Future], None]:
+        # Workers count the OSErrors they expect themselves; anything else (a path that cannot
+        # be encoded, a bad index row) would otherwise be dropped with the future.
+        def done(future: Future) -> None:
+            slots.release()
+            exc = future.exception()
+            if exc is not None:
+                logger.error("Failed to copy %s: %r", item.path, exc, exc_info=exc)
+                stats.record_error()
+
+        return done
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backup-copy", **run_context()) as pool:
+        if changed_paths is not None and index is not None:
+            files = _timed(iter_changed_files(sources, path_filter, index, changed_paths, stats), stats)
+        else:
+            files = iter_source_files(sources, path_filter, stats)
+        for item in files:
+            stats.record_scanned(item.stat.st_size)
+            target = destination / item.relative
+            if resuming:
+                kept.add(item.relative.as_posix())
+            if packer is not None and packer.wants(item.stat.st_size):
+                known = packer.reuse(item.relative.as_posix(), item.stat.st_size, item.stat.st_mtime_ns)
+                if known is not None:
+                    # Unchanged since the previous snapshot, which already holds it in a pack.
+                    if manifest is not None:
+                        manifest.write(manifest_entry(item, known["sha256"], packed=True))
+                    stats.record_link(item.stat.st_size)
+                    stored.append((item, known["sha256"]))
+                else:
+                    slots.acquire()
+                    pool.submit(
+                        _pack, item, packer, target, stats, stored, manifest, checkpoint, limiter
+                    ).add_done_callback(settle(item))
+            else:
+                if target.parent not in created_dirs:
+                    try:
+                        target.parent.mkdir(parents=True, exist_ok=True)
+                    except OSError as exc:
+                        logger.error("Cannot create %s: %s", target.parent, exc)
+                        stats.record_error()
+                        continue
+                    created_dirs.add(target.parent)
+                previous, known_unchanged, known_digest = _link_source(
+                    item, destination, link_dest, index, live_snapshots
+                )
+                slots.acquire()
+                pool.submit(
+                    _transfer,
+                    item,
+                    target,
+                    previous,
+                    known_unchanged,
+                    known_digest,
+                    stats,
+                    stored,
+                    manifest,
+                    checkpoint,
+                    limiter,
+                ).add_done_callback(settle(item))
+            if len(stored) >= INDEX_FLUSH_INTERVAL or (checkpoint is not None and checkpoint.due()):
+                _flush_index(index, stored, snapshot, checkpoint, item.relative.as_posix())
+        if progress is not None:
+            progress.finish_scan()
+
+    _flush_index(index, stored, snapshot, checkpoint)
+    if resuming:
+        removed = remove_leftovers(destination, kept)
+        if removed:
+            logger.info("Removed %d files of the interrupted run that are no longer in the sources", removed)
+    if index is not None:
+        removed = index.prune(snapshot)
+        if removed:
+            logger.info("Dropped %d deleted files from the file index", removed)
+    stats.elapsed = time.monotonic() - started
+    return stats
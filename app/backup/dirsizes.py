@@ -0,0 +1,317 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from stat import S_ISDIR
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .config import get_config_dir, load_config
+
+logger = logging.getLogger(__name__)
+
+SIZE_INDEX_FILENAME = ".pi-backup-sizes.sqlite"
+REFRESH_INTERVAL = 300.0
+# A directory's mtime only changes when entries are added, removed or renamed, not when a
+# file in it grows in place, so cached directories are re-read after this long regardless.
+MAX_AGE = 24 * 3600.0
+_COMMIT_EVERY = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    files INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    subdirs TEXT NOT NULL,
+    total_files INTEGER NOT NULL,
+    total_bytes INTEGER NOT NULL,
+    scanned_at REAL NOT NULL
+)
+"""
+
+
+def size_index_path() -> Path:
+    return get_config_dir() / SIZE_INDEX_FILENAME
+
+
+@dataclass
+class DirSize:
+    files: int
+    bytes: int
+
+
+@dataclass
+class SelectionTotal:
+    files: int = 0
+    bytes: int = 0
+    # Selected directories the indexer has not sized yet.
+    pending: int = 0
+
+    def to_dict(self) -> Dict:
+        return {"files": self.files, "bytes": self.bytes, "pending": self.pending}
+
+
+@dataclass
+class _Frame:
+    path: str
+    mtime_ns: int
+    files: int
+    bytes: int
+    subdirs: List[str]
+    scanned_at: float
+    rescanned: bool
+    # Recursive totals as last stored, None for a directory not in the index yet.
+    stored: Optional[Tuple[int, int]] = None
+    total_files: int = 0
+    total_bytes: int = 0
+    next_child: int = 0
+
+
+class DirSizeIndex:
+    # Recursive file counts and sizes per directory. A refresh stats every directory but only
+    # lists (and stats the files of) those whose mtime changed; unchanged directories reuse
+    # their stored own totals and list of subdirectories, and only rows whose listing or
+    # totals changed are written back.
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path or size_index_path()
+        self._conn = sqlite3.connect(str(self.path), timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(dirs)")}
+        if "generation" in columns:
+            # Indexes from before refreshes stopped rewriting every row; the sizes are rebuilt.
+            self._conn.execute("DROP TABLE dirs")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "DirSizeIndex":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def lookup(self, paths: Iterable[str]) -> Dict[str, DirSize]:
+        wanted = list(dict.fromkeys(paths))
+        found: Dict[str, DirSize] = {}
+        for start in range(0, len(wanted), 500):
+            chunk = wanted[start : start + 500]
+            rows = self._conn.execute(
+                f"SELECT path, total_files, total_bytes FROM dirs WHERE path IN ({','.join('?' * len(chunk))})", chunk
+            )
+            found.update((path, DirSize(files, total)) for path, files, total in rows)
+        return found
+
+    def _cached(self, path: str) -> Optional[Tuple[int, int, int, List[str], float, Tuple[int, int]]]:
+        row = self._conn.execute(
+            "SELECT mtime_ns, files, bytes, subdirs, scanned_at, total_files, total_bytes FROM dirs WHERE path = ?",
+            (path,),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], row[2], json.loads(row[3]), row[4], (row[5], row[6])
+
+    def _forget(self, path: str) -> None:
+        # Drops the rows of a directory that is gone and of everything that was below it.
+        prefix = path.rstrip("/") + "/"
+        self._conn.execute(
+            "DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", (path, prefix, prefix[:-1] + "0")
+        )
+
+    def _frame(self, path: str, now: float) -> Optional[_Frame]:
+        try:
+            stat = os.lstat(path)
+        except OSError:
+            return None
+        if not S_ISDIR(stat.st_mode):
+            return None
+        cached = self._cached(path)
+        stored = cached[5] if cached is not None else None
+        if cached is not None and cached[0] == stat.st_mtime_ns and now - cached[4] < MAX_AGE:
+            return _Frame(path, stat.st_mtime_ns, cached[1], cached[2], cached[3], cached[4], False, stored)
+        files = size = 0
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif entry.is_file(follow_symlinks=False):
+                            files += 1
+                            size += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        except OSError as exc:
+            logger.debug("Cannot list %s: %s", path, exc)
+        if cached is not None:
+            # Subdirectories that were removed or renamed only show up in their parent's
+            # listing, and the parent's mtime changed when they went.
+            for name in set(cached[3]).difference(subdirs):
+                self._forget(os.path.join(path, name))
+        return _Frame(path, stat.st_mtime_ns, files, size, sorted(subdirs), now, True, stored)
+
+    def refresh(self, root: str, stop: Optional[threading.Event] = None) -> Tuple[int, int]:
+        # Post-order walk of ``root``; returns (directories seen, directories re-read). Rows of
+        # directories that no longer exist are dropped when their parent is re-read.
+        now = time.time()
+        root = root.rstrip("/") or "/"
+        seen = rescanned = pending_writes = 0
+        first = self._frame(root, now)
+        if first is None:
+            return 0, 0
+        stack = [first]
+        while stack:
+            if stop is not None and stop.is_set():
+                self._conn.commit()
+                return seen, rescanned
+            frame = stack[-1]
+            if frame.next_child < len(frame.subdirs):
+                name = frame.subdirs[frame.next_child]
+                frame.next_child += 1
+                child_path = os.path.join(frame.path, name)
+                child = self._frame(child_path, now)
+                if child is None:
+                    self._forget(child_path)
+                else:
+                    stack.append(child)
+                continue
+            stack.pop()
+            frame.total_files += frame.files
+            frame.total_bytes += frame.bytes
+            if stack:
+                stack[-1].total_files += frame.total_files
+                stack[-1].total_bytes += frame.total_bytes
+            seen += 1
+            rescanned += frame.rescanned
+            if not frame.rescanned and frame.stored == (frame.total_files, frame.total_bytes):
+                continue
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    frame.path,
+                    frame.mtime_ns,
+                    frame.files,
+                    frame.bytes,
+                    json.dumps(frame.subdirs),
+                    frame.total_files,
+                    frame.total_bytes,
+                    frame.scanned_at,
+                ),
+            )
+            pending_writes += 1
+            if pending_writes >= _COMMIT_EVERY:
+                self._conn.commit()
+                pending_writes = 0
+        self._conn.commit()
+        return seen, rescanned
+
+    def selection_total(self, paths: Iterable[str]) -> SelectionTotal:
+        # Totals for a backup selection; paths inside another selected directory count once.
+        selected = sorted({p.rstrip("/") or "/" for p in paths})
+        unique = [p for p in selected if not any(p.startswith(other.rstrip("/") + "/") for other in selected)]
+        total = SelectionTotal()
+        dirs = []
+        for path in unique:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if S_ISDIR(stat.st_mode):
+                dirs.append(os.path.realpath(path))
+            else:
+                total.files += 1
+                total.bytes += stat.st_size
+        sizes = self.lookup(dirs)
+        for path in dirs:
+            size = sizes.get(path)
+            if size is None:
+                total.pending += 1
+            else:
+                total.files += size.files
+                total.bytes += size.bytes
+        return total
+
+
+def cached_sizes(paths: Iterable[str]) -> Dict[str, DirSize]:
+    # Read-only helper for request handlers: sizes known so far, nothing if the index is unusable.
+    try:
+        with DirSizeIndex() as index:
+            return index.lookup(paths)
+    except sqlite3.Error as exc:
+        logger.debug("Directory size index unavailable: %s", exc)
+        return {}
+
+
+def selection_total(paths: Iterable[str]) -> SelectionTotal:
+    try:
+        with DirSizeIndex() as index:
+            return index.selection_total(paths)
+    except sqlite3.Error as exc:
+        logger.debug("Directory size index unavailable: %s", exc)
+        return SelectionTotal(pending=len(list(paths)))
+
+
+def _index_roots(roots: Iterable[str]) -> List[str]:
+    resolved = sorted({os.path.realpath(root) for root in roots if os.path.isdir(root)})
+    return [r for r in resolved if not any(r.startswith(other.rstrip("/") + "/") for other in resolved)]
+
+
+class DirSizeIndexer:
+    # Background thread keeping the size index of the allowed roots current.
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        roots: Optional[Callable[[], List[str]]] = None,
+        interval: float = REFRESH_INTERVAL,
+    ) -> None:
+        self.path = path
+        self.interval = interval
+        self._roots = roots or (lambda: load_config().allowed_roots)
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="dir-size-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def kick(self) -> None:
+        # Refresh now instead of at the next interval (e.g. after the allowed roots changed).
+        self._wake.set()
+
+    def refresh_all(self) -> None:
+        with DirSizeIndex(self.path) as index:
+            for root in _index_roots(self._roots()):
+                started = time.monotonic()
+                seen, rescanned = index.refresh(root, self._stop)
+                logger.info(
+                    "Sized %s: %d directories, %d re-read in %.1fs", root, seen, rescanned, time.monotonic() - started
+                )
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh_all()
+            except (OSError, sqlite3.Error) as exc:
+                logger.warning("Directory size refresh failed: %s", exc)
+            self._wake.wait(self.interval)
+            self._wake.clear()
@@ -1,118 +1,643 @@
-import fnmatch
+import argparse
 import logging
-import os
-import shutil
+import sqlite3
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
-from .config import BackupConfig, load_config
-from .filesystem import ensure_destination, has_rsync, normalize_selection
-from .retention import enforce_retention
+from .archive import SNAPSHOT_FORMAT as ARCHIVE_FORMAT, backup_to_archive, resolve_compression
+from .catalog import sync_catalog
+from .checkpoint import Checkpoint, Completed, incomplete_format, load_checkpoint, mark_complete, mark_incomplete
+from .chunkstore import SNAPSHOT_FORMAT as CHUNK_FORMAT, backup_to_chunks
+from .config import DESTINATION_FORMATS, BackupConfig, load_config
+from .copier import DEFAULT_MAX_WORKERS, CopyStats, copy_files
+from .fastcopy import reset_fallback_cache
+from .filters import PathFilter
+from .history import HISTORY_FILENAME, RunHistory, RunRecord
+from .index import FileIndex
+from .locking import DestinationLock, DestinationLockedError
+from .journal import ChangeJournal, JournalPlan, journal_signature
+from .logreader import LOG_FORMAT, RunIdFilter, reset_run_id, run_context, set_run_id
+from .manifest import ManifestWriter, snapshot_format
+from .packs import PackWriter
+from .profiling import RunProfile, SamplingProfiler, active_profile, format_report, reset_profile, set_profile
+from .progress import Progress, RsyncOutputParser
+from .filesystem import ensure_destination, group_by_device, has_rsync, normalize_selection
+from .retention import enforce_retention, incomplete_snapshots, parse_timestamped_dirs, wait_for_trash
+from .throttle import Throttle
+from .verify import InodeCache, VerifyReport, build_manifest, verify_snapshot
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 LOG_DIR = BASE_DIR / "logs"
 LOG_FILE = LOG_DIR / "backup.log"
+LOG_BACKUP_COUNT = 3
+# Profile spans copied into RunRecord.phases, the per-phase timings the history and metrics
+# show; "scan" comes from the copy stats.
+RECORDED_PHASES = ("copy", "hash", "retention", "catalog")
 
 logger = logging.getLogger("backup")
 
 
 def configure_logging() -> None:
     LOG_DIR.mkdir(parents=True, exist_ok=True)
-    handler = RotatingFileHandler(LOG_FILE, maxBytes=512000, backupCount=3)
-    formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    handler = RotatingFileHandler(LOG_FILE, maxBytes=512000, backupCount=LOG_BACKUP_COUNT)
+    formatter = logging.Formatter(LOG_FORMAT)
     handler.setFormatter(formatter)
+    # Tags every line logged on behalf of a run with its id ("backup[<run id>]: ...").
+    handler.addFilter(RunIdFilter())
     root = logging.getLogger()
     if not any(isinstance(h, RotatingFileHandler) for h in root.handlers):
         root.setLevel(logging.INFO)
         root.addHandler(handler)
 
 
-def _copy_with_shutil(sources: List[str], destination: Path, include_patterns: List[str], exclude_patterns: List[str]) -> None:
-    def should_include(path: Path) -> bool:
-        path_str = str(path)
-        if any(fnmatch.fnmatch(path_str, pattern) for pattern in exclude_patterns):
-            return False
-        if include_patterns:
-            return any(fnmatch.fnmatch(path_str, pattern) for pattern in include_patterns)
-        return True
+def _log_copy_stats(stats: CopyStats) -> None:
+    logger.info(
+        "Copied %d files (%d bytes), linked %d unchanged files in %.1fs (%.2f MB/s)",
+        stats.files_copied,
+        stats.bytes_copied,
+        stats.files_linked,
+        stats.elapsed,
+        stats.throughput / 1_000_000,
+    )
+    if stats.files_resumed:
+        logger.info("Kept %d files (%d bytes) stored by the interrupted run", stats.files_resumed, stats.bytes_resumed)
+    if stats.methods:
+        logger.info("Copy methods: %s", ", ".join(f"{name} {count}" for name, count in sorted(stats.methods.items())))
 
+
+def _copy_with_shutil(
+    sources: List[str],
+    destination: Path,
+    include_patterns: List[str],
+    exclude_patterns: List[str],
+    link_dest: Optional[Path] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    index: Optional[FileIndex] = None,
+    progress: Optional[Progress] = None,
+    changed_paths: Optional[Set[str]] = None,
+    manifest: Optional[ManifestWriter] = None,
+    checkpoint: Optional[Checkpoint] = None,
+    throttle: Optional[Throttle] = None,
+    packer: Optional[PackWriter] = None,
+) -> CopyStats:
+    path_filter = PathFilter(include_patterns, exclude_patterns)
+    limiter = throttle.limiter if throttle is not None else None
+    stats = copy_files(
+        sources,
+        destination,
+        path_filter,
+        link_dest,
+        max_workers,
+        index,
+        progress,
+        changed_paths,
+        manifest,
+        checkpoint,
+        limiter,
+        packer,
+    )
+    if packer is not None:
+        failed = packer.close()
+        if failed:
+            logger.error("%d unchanged packed files could not be carried over from the previous snapshot", failed)
+            stats.errors += failed
+    _log_copy_stats(stats)
+    return stats
+
+
+def _store_chunks(
+    sources: List[str],
+    destination: Path,
+    include_patterns: List[str],
+    exclude_patterns: List[str],
+    previous: Optional[Path] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    progress: Optional[Progress] = None,
+    throttle: Optional[Throttle] = None,
+) -> CopyStats:
+    path_filter = PathFilter(include_patterns, exclude_patterns)
+    limiter = throttle.limiter if throttle is not None else None
+    stats = backup_to_chunks(sources, destination, path_filter, previous, max_workers, progress, limiter)
+    _log_copy_stats(stats)
+    return stats
+
+
+def _store_archive(
+    sources: List[str],
+    destination: Path,
+    config: BackupConfig,
+    progress: Optional[Progress] = None,
+    throttle: Optional[Throttle] = None,
+) -> CopyStats:
+    path_filter = PathFilter(config.include_patterns, config.exclude_patterns)
+    limiter = throttle.limiter if throttle is not None else None
+    stats = backup_to_archive(
+        sources, destination, path_filter, config.archive_compression, progress=progress, limiter=limiter
+    )
+    _log_copy_stats(stats)
+    return stats
+
+
+def _output_lines(stream) -> Iterator[str]:
+    # rsync redraws its progress line with "\r"; treat it like a newline so every update is seen.
+    pending = b""
+    while True:
+        chunk = stream.read1(65536)
+        if not chunk:
+            break
+        lines = (pending + chunk).replace(b"\r", b"\n").split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line:
+                yield line.decode("utf-8", "replace")
+    if pending:
+        yield pending.decode("utf-8", "replace")
+
+
+def _rsync_source(
+    cmd: List[str], src: str, progress: Optional[Progress], throttle: Optional[Throttle] = None
+) -> Dict[str, int]:
+    parser = RsyncOutputParser()
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as proc:
+        with throttle.pace_process(proc) if throttle is not None else nullcontext():
+            for line in _output_lines(proc.stdout):
+                event = parser.feed(line)
+                if event is None:
+                    logger.info("rsync %s: %s", src, line)
+                elif event.kind == "file":
+                    logger.debug("rsync %s: %s", src, line)
+                if event is not None and progress is not None:
+                    progress.apply(src, event)
+        returncode = proc.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return parser.totals
+
+
+def _rsync_lane(
+    base_cmd: List[str],
+    sources: List[str],
+    destination: Path,
+    progress: Optional[Progress],
+    throttle: Optional[Throttle] = None,
+) -> Tuple[List[subprocess.CalledProcessError], Dict[str, int]]:
+    failures = []
+    totals: Dict[str, int] = {}
     for src in sources:
-        src_path = Path(src)
-        dest_path = destination / src_path.name
-        if src_path.is_dir():
-            for root, dirs, files in os.walk(src_path):
-                root_path = Path(root)
-                rel_root = root_path.relative_to(src_path)
-
-                dirs[:] = [d for d in dirs if should_include(rel_root / d)]
-
-                for file_name in files:
-                    rel_file = rel_root / file_name
-                    if not should_include(rel_file):
-                        continue
-                    source_file = root_path / file_name
-                    target_file = dest_path / rel_file
-                    target_file.parent.mkdir(parents=True, exist_ok=True)
-                    shutil.copy2(source_file, target_file)
-        elif src_path.is_file():
-            if should_include(Path(src_path.name)):
-                dest_path.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copy2(src_path, dest_path)
-        else:
-            logger.warning("Skipping unknown path %s", src_path)
-
-
-def _run_rsync(sources: List[str], destination: Path, include_patterns: List[str], exclude_patterns: List[str]) -> None:
+        cmd = base_cmd + [src, str(destination)]
+        logger.info("Running rsync: %s", " ".join(cmd))
+        started = time.monotonic()
+        try:
+            source_totals = _rsync_source(cmd, src, progress, throttle)
+        except subprocess.CalledProcessError as exc:
+            logger.error("rsync of %s failed with exit status %d", src, exc.returncode)
+            failures.append(exc)
+            continue
+        for key, value in source_totals.items():
+            totals[key] = totals.get(key, 0) + value
+        logger.info("rsync of %s finished in %.1fs", src, time.monotonic() - started)
+    return failures, totals
+
+
+def _run_rsync(
+    sources: List[str],
+    destination: Path,
+    include_patterns: List[str],
+    exclude_patterns: List[str],
+    link_dest: Optional[Path] = None,
+    concurrency: int = 1,
+    progress: Optional[Progress] = None,
+    throttle: Optional[Throttle] = None,
+) -> Dict[str, int]:
     base_cmd = [
         "rsync",
         "-a",
         "--delete",
     ]
-    for pattern in include_patterns:
-        base_cmd.extend(["--include", pattern])
-    for pattern in exclude_patterns:
-        base_cmd.extend(["--exclude", pattern])
-    base_cmd.append("--info=progress2")
+    if link_dest is not None:
+        # rsync resolves relative --link-dest paths against the destination, so always pass it absolute.
+        base_cmd.append(f"--link-dest={link_dest.resolve()}")
+    base_cmd.extend(PathFilter(include_patterns, exclude_patterns).rsync_args())
+    if throttle is not None:
+        base_cmd.extend(throttle.rsync_args)
+    base_cmd.extend(["--info=progress2", "--itemize-changes", "--stats"])
+
+    # Sources on the same disk run one after another in a lane so they never compete for the
+    # same spindle or SD card; lanes for different disks run side by side.
+    lanes = group_by_device(sources) if concurrency > 1 else [sources]
+    if progress is not None:
+        progress.expected_sources = len(sources)
+    if len(lanes) == 1:
+        results = [_rsync_lane(base_cmd, lanes[0], destination, progress, throttle)]
+    else:
+        logger.info("Running %d rsync lanes, up to %d at once", len(lanes), concurrency)
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(lanes)), thread_name_prefix="rsync", **run_context()) as pool:
+            results = list(pool.map(lambda lane: _rsync_lane(base_cmd, lane, destination, progress, throttle), lanes))
+
+    # --stats totals summed over every source, for the run record.
+    failures: List[subprocess.CalledProcessError] = []
+    totals: Dict[str, int] = {}
+    for lane_failures, lane_totals in results:
+        failures.extend(lane_failures)
+        for key, value in lane_totals.items():
+            totals[key] = totals.get(key, 0) + value
+
+    if len(failures) == 1:
+        raise failures[0]
+    if failures:
+        raise subprocess.CalledProcessError(
+            max(exc.returncode for exc in failures), [exc.cmd[-2] for exc in failures]
+        )
+    return totals
+
+
+def _previous_snapshot(destination_root: Path, exclude: Path, format_name: Optional[str] = None) -> Optional[Path]:
+    for snapshot in parse_timestamped_dirs(destination_root):
+        if snapshot == exclude:
+            continue
+        if format_name is None or snapshot_format(snapshot) == format_name:
+            return snapshot
+    return None
+
+
+def _resumable_snapshot(destination_root: Path, format_name: str) -> Optional[Path]:
+    # The newest interrupted snapshot, if no finished snapshot is newer and it has this format.
+    # Older interrupted snapshots are left to retention. An archive is one compressed stream
+    # that cannot be appended to, so interrupted archive runs always start over.
+    if format_name == ARCHIVE_FORMAT:
+        return None
+    incomplete = incomplete_snapshots(destination_root)
+    if not incomplete or incomplete_format(incomplete[0]) != format_name:
+        return None
+    finished = parse_timestamped_dirs(destination_root)
+    if finished and finished[0].name > incomplete[0].name:
+        return None
+    return incomplete[0]
+
+
+def run_history() -> RunHistory:
+    return RunHistory(LOG_DIR / HISTORY_FILENAME)
 
-    for src in sources:
-        cmd = base_cmd + [src, str(destination)]
-        logger.info("Running rsync: %s", " ".join(cmd))
-        subprocess.run(cmd, check=True)
 
+def _record_stats(record: RunRecord, stats: CopyStats) -> None:
+    record.files_scanned = stats.files_scanned
+    record.files_copied = stats.files_copied
+    record.files_linked = stats.files_linked
+    record.files_resumed = stats.files_resumed
+    record.bytes_copied = stats.bytes_copied
+    record.bytes_skipped = stats.bytes_linked + stats.bytes_resumed
+    record.errors = stats.errors
+    record.phases["scan"] = round(stats.scan_elapsed, 3)
+    # Scanning is interleaved with copying, so in the profile it is part of "copy".
+    active_profile().add_time("copy.scan", stats.scan_elapsed)
 
-def run_backup(config: BackupConfig | None = None) -> Path:
+
+def _record_rsync_totals(record: RunRecord, totals: Dict[str, int]) -> None:
+    record.files_scanned = totals.get("files_total", 0)
+    record.files_copied = totals.get("files_transferred", 0)
+    record.bytes_copied = totals.get("bytes_transferred", 0)
+    record.bytes_skipped = max(0, totals.get("bytes_total", 0) - record.bytes_copied)
+
+
+def run_backup(
+    config: BackupConfig | None = None,
+    progress: Optional[Progress] = None,
+    sampler: Optional[SamplingProfiler] = None,
+) -> Path:
+    # ``sampler`` (see main's --profile) samples stacks for the length of the run; its hotspots
+    # end up in the record's profile next to the spans and counters every run collects.
     config = config or load_config()
-    sources = normalize_selection(config.selected_paths)
+    progress = progress or Progress()
+    record = RunRecord(destination=config.destination)
+    token = set_run_id(record.run_id)
+    profile = RunProfile()
+    profile_token = set_profile(profile)
+    try:
+        with sampler or nullcontext(), profile.span("run"):
+            destination = _run_backup(config, progress, record)
+    except DestinationLockedError as exc:
+        logger.warning("Run %s skipped: %s", record.run_id, exc)
+        record.finish("skipped", error=str(exc))
+        raise
+    except Exception as exc:
+        record.finish("failed", error=str(exc))
+        raise
+    else:
+        record.finish("partial" if record.errors else "succeeded")
+    finally:
+        record.phases.update(profile.phases(RECORDED_PHASES))
+        record.profile = profile.to_dict()
+        if sampler is not None:
+            record.profile["hotspots"] = sampler.hotspots()
+        try:
+            run_history().append(record)
+        except OSError as exc:
+            logger.warning("Could not record run %s in the run history: %s", record.run_id, exc)
+        reset_profile(profile_token)
+        reset_run_id(token)
+    return destination
+
+
+def _run_backup(config: BackupConfig, progress: Progress, record: RunRecord) -> Path:
+    if config.destination_format not in DESTINATION_FORMATS:
+        raise ValueError(f"Unknown destination_format {config.destination_format!r}")
+    if config.destination_format == ARCHIVE_FORMAT:
+        # Fail before a snapshot directory is created, e.g. for zstd without zstandard.
+        resolve_compression(config.archive_compression)
+    with active_profile().span("select"):
+        sources = normalize_selection(config.selected_paths)
     if not sources:
         raise ValueError("No sources selected for backup")
 
     destination_root = ensure_destination(Path(config.destination))
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    destination = destination_root / timestamp
-    destination.mkdir(parents=True, exist_ok=True)
+    # Held until retention is done, so no other process can write into or prune this
+    # destination meanwhile.
+    with DestinationLock(destination_root):
+        return _run_locked(config, sources, destination_root, progress, record)
 
-    logger.info("Starting backup to %s", destination)
 
+def _run_python_engine(
+    config: BackupConfig,
+    sources: List[str],
+    destination: Path,
+    link_dest: Optional[Path],
+    progress: Progress,
+    record: RunRecord,
+    completed: Optional[Completed] = None,
+    throttle: Optional[Throttle] = None,
+) -> CopyStats:
+    record.engine = "python"
+    destination_root = destination.parent
+    # In incremental mode the file index lets unchanged files be linked without stat'ing
+    # their previous copies on the destination; with watch_changes the change journal
+    # also spares the stat() of unchanged source files.
+    index = FileIndex.open(destination_root) if config.incremental else None
+    journal = ChangeJournal.open() if index is not None and config.watch_changes else None
+    plan: Optional[JournalPlan] = None
+    changed_paths: Optional[Set[str]] = None
+    manifest = ManifestWriter(destination, "directory") if config.hash_manifests else None
+    checkpoint = Checkpoint(destination, completed)
+    packer = None
+    if config.pack_below_kib:
+        packer = PackWriter(destination, config.pack_below_kib * 1024, link_dest)
     try:
-        if has_rsync():
-            _run_rsync(sources, destination, config.include_patterns, config.exclude_patterns)
-        else:
-            _copy_with_shutil(sources, destination, config.include_patterns, config.exclude_patterns)
-        logger.info("Backup completed successfully")
+        if journal is not None:
+            previous = link_dest.name if link_dest is not None else None
+            plan = journal.begin(
+                journal_signature(destination_root, previous, sources, config.include_patterns, config.exclude_patterns)
+            )
+            if plan.changed_paths is not None and link_dest is not None and not index.is_empty:
+                changed_paths = plan.changed_paths
+                record.engine = "python-journal"
+                logger.info("Run %s: following the change journal, %d changed paths", record.run_id, len(changed_paths))
+            else:
+                logger.info("Run %s: scanning all sources (%s)", record.run_id, plan.reason or "no previous snapshot")
+        stats = _copy_with_shutil(
+            sources,
+            destination,
+            config.include_patterns,
+            config.exclude_patterns,
+            link_dest,
+            config.max_workers,
+            index,
+            progress,
+            changed_paths,
+            manifest,
+            checkpoint,
+            throttle,
+            packer,
+        )
+        packer = None
+        if manifest is not None:
+            manifest.close()
+            manifest = None
+        # Only a clean run is a reliable base for the next journaled one: a file that failed
+        # to copy is missing from the index and would otherwise never be retried.
+        if journal is not None and plan is not None and not stats.errors:
+            journal.commit(
+                plan,
+                journal_signature(
+                    destination_root, destination.name, sources, config.include_patterns, config.exclude_patterns
+                ),
+            )
+        return stats
+    finally:
+        checkpoint.close()
+        if packer is not None:
+            packer.abort()
+        if manifest is not None:
+            manifest.abort()
+        if journal is not None:
+            journal.close()
+        if index is not None:
+            index.close()
+
+
+def _hash_rsync_snapshot(
+    destination: Path, link_dest: Optional[Path], progress: Progress, record: RunRecord
+) -> None:
+    # rsync cannot hand over hashes of what it copied, so its snapshots are hashed afterwards;
+    # files it hard-linked from the previous snapshot reuse that snapshot's hashes. A file that
+    # cannot be hashed is missing from the manifest and counts as a file error of the run, as
+    # it would have in the Python engine, which hashes while it copies.
+    profile = active_profile()
+    progress.set_phase("hash")
+    with profile.span("hash"):
+        hashed, reused, failed = build_manifest(destination, link_dest, progress=progress)
+    profile.count("hash.files", hashed)
+    profile.count("hash.reused", reused)
+    record.errors += failed
+    logger.info("Manifest written: hashed %d files, reused %d hashes from the previous snapshot", hashed, reused)
+
+
+def _run_locked(
+    config: BackupConfig, sources: List[str], destination_root: Path, progress: Progress, record: RunRecord
+) -> Path:
+    resumed = _resumable_snapshot(destination_root, config.destination_format) if config.resume_incomplete else None
+    if resumed is not None:
+        # Finishing the interrupted snapshot keeps its name, so the files it already holds
+        # (and the file index entries pointing at them) stay where they are.
+        destination = resumed
+        record.resumed = True
+    else:
+        destination = destination_root / datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    record.snapshot = destination.name
+    if config.destination_format == CHUNK_FORMAT:
+        # Chunk snapshots always deduplicate against the previous chunk manifest.
+        link_dest = _previous_snapshot(destination_root, exclude=destination, format_name=CHUNK_FORMAT)
+    elif config.incremental:
+        link_dest = _previous_snapshot(destination_root, exclude=destination, format_name="directory")
+    else:
+        link_dest = None
+    completed: Optional[Completed] = None
+    if resumed is not None:
+        completed, position = load_checkpoint(destination)
+        logger.info(
+            "Run %s: resuming interrupted backup %s (%d files checkpointed%s)",
+            record.run_id,
+            destination,
+            len(completed),
+            f", last at {position}" if position else "",
+        )
+    else:
+        destination.mkdir(parents=True, exist_ok=True)
+        mark_incomplete(destination, record.run_id, config.destination_format)
+
+    if link_dest is not None:
+        logger.info(
+            "Run %s: starting incremental backup to %s against previous snapshot %s", record.run_id, destination, link_dest
+        )
+    else:
+        logger.info("Run %s: starting backup to %s", record.run_id, destination)
+
+    # Copy methods one run found missing may work after a remount, so every run probes again.
+    reset_fallback_cache()
+    # The run's threads and rsync processes inherit the lowered priority from here on.
+    throttle = Throttle(config.throttle)
+    throttle.apply_priority()
+    stats: Optional[CopyStats] = None
+    profile = active_profile()
+    progress.set_phase("copy")
+    try:
+        with profile.span("copy"), throttle.running():
+            if config.destination_format == CHUNK_FORMAT:
+                record.engine = "chunks"
+                stats = _store_chunks(
+                    sources,
+                    destination,
+                    config.include_patterns,
+                    config.exclude_patterns,
+                    link_dest,
+                    config.max_workers,
+                    progress,
+                    throttle,
+                )
+            elif config.destination_format == ARCHIVE_FORMAT:
+                record.engine = "archive"
+                stats = _store_archive(sources, destination, config, progress, throttle)
+            elif has_rsync() and not (config.watch_changes and config.incremental) and not config.pack_below_kib:
+                record.engine = "rsync"
+                totals = _run_rsync(
+                    sources,
+                    destination,
+                    config.include_patterns,
+                    config.exclude_patterns,
+                    link_dest,
+                    config.rsync_concurrency,
+                    progress,
+                    throttle,
+                )
+                _record_rsync_totals(record, totals)
+                if config.hash_manifests:
+                    _hash_rsync_snapshot(destination, link_dest, progress, record)
+            else:
+                stats = _run_python_engine(config, sources, destination, link_dest, progress, record, completed, throttle)
     except subprocess.CalledProcessError as exc:
         logger.exception("Backup failed: %s", exc)
         raise
 
-    enforce_retention(destination_root, config.retention)
+    if stats is not None:
+        _record_stats(record, stats)
+    if record.errors:
+        logger.warning("Backup completed with %d file errors; see above for details", record.errors)
+    else:
+        logger.info("Backup completed successfully")
+    mark_complete(destination)
+
+    progress.set_phase("retention")
+    with profile.span("retention"):
+        enforce_retention(destination_root, config.retention)
+
+    progress.set_phase("catalog")
+    try:
+        with profile.span("catalog"):
+            sync_catalog(destination_root, completed=destination.name)
+    except (OSError, sqlite3.Error) as exc:
+        # The catalog is derived data; the next run or API request rebuilds what is missing.
+        logger.warning("Could not update the snapshot catalog: %s", exc)
     return destination
 
 
-def main() -> None:
-    destination = run_backup()
+def verify_snapshots(
+    names: List[str], config: BackupConfig | None = None, progress: Optional[Progress] = None
+) -> List[VerifyReport]:
+    # ``names`` are snapshot directory names; "latest" and "all" are accepted too.
+    config = config or load_config()
+    destination_root = Path(config.destination)
+    snapshots = parse_timestamped_dirs(destination_root)
+    if not names or names == ["latest"]:
+        selected = snapshots[:1]
+    elif names == ["all"]:
+        selected = snapshots
+    else:
+        known = {snapshot.name: snapshot for snapshot in snapshots}
+        unknown = [name for name in names if name not in known]
+        if unknown:
+            raise ValueError(f"Unknown snapshot(s): {', '.join(unknown)}")
+        selected = [known[name] for name in names]
+    if not selected:
+        raise ValueError(f"No snapshots found in {destination_root}")
+    progress = progress or Progress()
+    progress.set_phase("verify")
+    cache: InodeCache = {}
+    return [verify_snapshot(snapshot, progress=progress, cache=cache) for snapshot in selected]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.backup.engine", description="Run or verify backups.")
+    parser.add_argument(
+        "--verify",
+        nargs="*",
+        metavar="SNAPSHOT",
+        help="re-hash snapshots against their manifests instead of backing up (default: latest; 'all' for every one)",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        metavar="FILE",
+        help="sample the run's stacks, print a per-phase report and write the stacks in collapsed "
+        "(flamegraph) format to FILE (default: logs/profile-<run id>.folded)",
+    )
+    args = parser.parse_args(argv)
+    if args.verify is not None:
+        try:
+            reports = verify_snapshots(args.verify)
+        except ValueError as exc:
+            parser.exit(2, f"{exc}\n")
+        for report in reports:
+            print(report)
+        if not all(report.ok for report in reports):
+            raise SystemExit(1)
+        return
+    sampler = SamplingProfiler() if args.profile is not None else None
+    try:
+        destination = run_backup(sampler=sampler)
+    except DestinationLockedError as exc:
+        print(exc)
+        # EX_TEMPFAIL: cron-style callers may simply try again later.
+        raise SystemExit(75) from exc
     print(f"Backup complete: {destination}")
+    if sampler is not None:
+        _print_profile(sampler, destination, args.profile)
+    # Pruned snapshots are deleted in the background; finish that before the process exits.
+    wait_for_trash()
+
+
+def _print_profile(sampler: SamplingProfiler, destination: Path, output: str) -> None:
+    record = next((r for r in run_history().records() if r.snapshot == destination.name), None)
+    if record is None:
+        return
+    print(format_report(record.profile))
+    path = Path(output) if output else LOG_DIR / f"profile-{record.run_id}.folded"
+    sampler.write_collapsed(path)
+    print(f"{sampler.samples} stack samples written to {path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,228 @@
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .profiling import active_profile
+
+logger = logging.getLogger(__name__)
+
+# Anything with hashlib's update(); typed loosely since hashlib exposes no common base class.
+Hasher = Any
+# Anything with consume(bytes) that may block, i.e. throttle.TokenBucket.
+Limiter = Any
+
+# ioctl(dest_fd, FICLONE, src_fd): share the source's extents (btrfs, XFS with reflink=1).
+FICLONE = 0x40049409
+COPY_BUFFER_SIZE = 1024 * 1024
+# Kernel-side copies are issued in pieces this large so a huge file never ties up one call.
+# Throttled copies use COPY_BUFFER_SIZE pieces instead, so the bandwidth cap stays smooth.
+KERNEL_CHUNK = 64 * 1024 * 1024
+
+# Errors meaning "this method does not work between these two filesystems" (ENOTTY: the
+# filesystem has no FICLONE ioctl). They are remembered for the device pair.
+_MISSING_FEATURE = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+}
+# Errors meaning "this method does not work for this file" (its open flags, a swap or running
+# executable, a file changing underneath), as opposed to a real I/O failure (ENOSPC, EIO, ...)
+# that must surface. Only that file falls back; the next one tries the method again.
+_UNSUPPORTED = _MISSING_FEATURE | {
+    errno.EINVAL,
+    errno.EPERM,
+    errno.EBADF,
+    errno.ETXTBSY,
+}
+
+
+class _Unsupported(Exception):
+    def __init__(self, reason: object, remember: bool = True) -> None:
+        super().__init__(reason)
+        # Whether later files between the same two devices should skip the method too.
+        self.remember = remember
+
+
+def _unsupported(exc: OSError) -> _Unsupported:
+    return _Unsupported(exc, remember=exc.errno in _MISSING_FEATURE)
+
+
+# Each transfer returns how many copy, read and write syscalls it made, for the run profile.
+
+
+def _reflink(
+    src_fd: int, dst_fd: int, size: int, hasher: Optional[Hasher] = None, limiter: Optional[Limiter] = None
+) -> int:
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError as exc:
+        if exc.errno in _UNSUPPORTED:
+            raise _unsupported(exc) from exc
+        raise
+    if hasher is not None:
+        # The clone itself read nothing, so this is still the only read of the data.
+        return 1 + hash_fd(src_fd, hasher, limiter)
+    return 1
+
+
+def _copy_file_range(
+    src_fd: int, dst_fd: int, size: int, hasher: Optional[Hasher] = None, limiter: Optional[Limiter] = None
+) -> int:
+    copy_range = getattr(os, "copy_file_range", None)
+    if copy_range is None:
+        raise _Unsupported("os.copy_file_range is not available")
+    step = KERNEL_CHUNK if limiter is None else COPY_BUFFER_SIZE
+    copied = 0
+    calls = 0
+    while True:
+        try:
+            sent = copy_range(src_fd, dst_fd, step)
+        except OSError as exc:
+            if exc.errno in _UNSUPPORTED and copied == 0:
+                raise _unsupported(exc) from exc
+            raise
+        calls += 1
+        if sent == 0:
+            # Some filesystems (procfs, older FUSE) report 0 instead of failing.
+            if copied == 0 and size > 0:
+                raise _Unsupported("copy_file_range copied nothing", remember=False)
+            return calls
+        copied += sent
+        if limiter is not None:
+            limiter.consume(sent)
+
+
+def _sendfile(
+    src_fd: int, dst_fd: int, size: int, hasher: Optional[Hasher] = None, limiter: Optional[Limiter] = None
+) -> int:
+    step = KERNEL_CHUNK if limiter is None else COPY_BUFFER_SIZE
+    offset = 0
+    calls = 0
+    while True:
+        try:
+            sent = os.sendfile(dst_fd, src_fd, offset, step)
+        except OSError as exc:
+            if exc.errno in _UNSUPPORTED and offset == 0:
+                raise _unsupported(exc) from exc
+            raise
+        calls += 1
+        if sent == 0:
+            return calls
+        offset += sent
+        if limiter is not None:
+            limiter.consume(sent)
+
+
+def _buffered(
+    src_fd: int, dst_fd: int, size: int, hasher: Optional[Hasher] = None, limiter: Optional[Limiter] = None
+) -> int:
+    buffer = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buffer)
+    calls = 0
+    while True:
+        read = os.readv(src_fd, [buffer])
+        calls += 1
+        if read == 0:
+            return calls
+        if hasher is not None:
+            hasher.update(view[:read])
+        written = 0
+        while written < read:
+            written += os.write(dst_fd, view[written:read])
+            calls += 1
+        if limiter is not None:
+            limiter.consume(read)
+
+
+def hash_fd(fd: int, hasher: Hasher, limiter: Optional[Limiter] = None) -> int:
+    # Returns the number of reads.
+    buffer = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buffer)
+    os.lseek(fd, 0, os.SEEK_SET)
+    calls = 0
+    while True:
+        read = os.readv(fd, [buffer])
+        calls += 1
+        if read == 0:
+            return calls
+        hasher.update(view[:read])
+        if limiter is not None:
+            limiter.consume(read)
+
+
+def hash_file(path: Path) -> str:
+    hasher = hashlib.sha256()
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        hash_fd(fd, hasher)
+    finally:
+        os.close(fd)
+    return hasher.hexdigest()
+
+
+TIERS: List[Tuple[str, Callable[..., int]]] = [
+    ("reflink", _reflink),
+    ("copy_file_range", _copy_file_range),
+    ("sendfile", _sendfile),
+    ("buffered", _buffered),
+]
+# In-kernel copies never pass the data through Python, so when the caller wants a hash only
+# a reflink (free, then one read to hash) or the buffered loop (hash while copying) keep the
+# data read exactly once.
+HASHING_TIERS = ("reflink", "buffered")
+
+# Methods found not to work between two devices, so later files of the run skip straight past
+# them. Each run starts afresh (see reset_fallback_cache), as a remount may change the answer.
+_failed_lock = threading.Lock()
+_failed: Dict[Tuple[int, int], Set[str]] = {}
+
+
+def reset_fallback_cache() -> None:
+    with _failed_lock:
+        _failed.clear()
+
+
+def copy_file(src: Path, dst: Path, hasher: Optional[Hasher] = None, limiter: Optional[Limiter] = None) -> str:
+    # Drop-in for shutil.copy2 (contents, then permissions, times and xattrs via copystat)
+    # that picks the cheapest transfer the two filesystems support: a reflink shares blocks
+    # and copies nothing, copy_file_range/sendfile copy inside the kernel, and the buffered
+    # loop is the portable last resort. Returns the method that was used. With ``hasher``
+    # (a hashlib object) the file's contents are also fed to it; with ``limiter`` every piece
+    # copied is charged to it (see throttle.TokenBucket).
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        src_stat = os.fstat(src_fd)
+        key = (src_stat.st_dev, os.fstat(dst_fd).st_dev)
+        with _failed_lock:
+            skip = set(_failed.get(key, ()))
+        method = "empty"
+        profile = active_profile()
+        if src_stat.st_size > 0:
+            for method, transfer in TIERS:
+                if method in skip or (hasher is not None and method not in HASHING_TIERS):
+                    continue
+                try:
+                    profile.count(f"syscalls.{method}", transfer(src_fd, dst_fd, src_stat.st_size, hasher, limiter))
+                    break
+                except _Unsupported as exc:
+                    logger.debug("%s not usable from %s to %s: %s", method, src, dst, exc)
+                    profile.count("copy.fallbacks")
+                    if exc.remember:
+                        with _failed_lock:
+                            _failed.setdefault(key, set()).add(method)
+                    # Start the next method from a clean slate.
+                    os.lseek(src_fd, 0, os.SEEK_SET)
+                    os.lseek(dst_fd, 0, os.SEEK_SET)
+                    os.ftruncate(dst_fd, 0)
+    shutil.copystat(src, dst)
+    profile.count(f"files.{method}")
+    profile.count(f"bytes.{method}", src_stat.st_size)
+    return method
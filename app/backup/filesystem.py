@@ -1,8 +1,15 @@
+import base64
+import bisect
+import fnmatch
+import json
 import os
+import re
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, List
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern, Tuple
 
-from .config import load_config
+from .config import get_allowed_roots, load_config
+from .dirsizes import cached_sizes
 
 
 class UnsafePathError(Exception):
@@ -10,44 +17,188 @@ class UnsafePathError(Exception):
 
 
 def is_allowed(path: Path, allowed_roots: Iterable[str]) -> bool:
-    resolved = path.resolve()
-    for root in allowed_roots:
-        try:
-            root_path = Path(root).resolve()
-            if resolved == root_path or resolved.is_relative_to(root_path):
-                return True
-        except FileNotFoundError:
-            continue
-    return False
+    return get_allowed_roots(allowed_roots).contains(path.resolve())
 
 
-def list_directory(path: Path) -> List[dict]:
+SORT_FIELDS = ("name", "size", "mtime")
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+@dataclass
+class DirectoryPage:
+    entries: List[dict]
+    next_cursor: Optional[str]
+    total: int
+
+
+@dataclass
+class _Listing:
+    entry: os.DirEntry
+    is_dir: bool
+
+
+def _check_allowed(path: Path) -> None:
     config = load_config()
     if not is_allowed(path, config.allowed_roots):
         raise UnsafePathError(f"Path {path} is outside allowed roots")
 
-    entries = []
-    if path.is_dir():
-        for entry in sorted(path.iterdir(), key=lambda p: (not p.is_dir(), p.name.lower())):
-            entries.append(
-                {
-                    "name": entry.name,
-                    "path": str(entry.resolve()),
-                    "is_dir": entry.is_dir(),
-                    "size": entry.stat().st_size if entry.is_file() else None,
-                }
-            )
-    return entries
+
+def _name_matcher(pattern: Optional[str]) -> Optional[Pattern[str]]:
+    return re.compile(fnmatch.translate(pattern), re.IGNORECASE) if pattern else None
+
+
+def _scan(path: Path, pattern: Optional[str], kind: Optional[str]) -> Iterator[_Listing]:
+    # One scandir pass; the d_type cached on each DirEntry answers is_dir() without a stat.
+    if not path.is_dir():
+        return
+    matcher = _name_matcher(pattern)
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if kind == "dir" and not is_dir or kind == "file" and is_dir:
+                continue
+            if matcher is not None and not matcher.match(entry.name):
+                continue
+            yield _Listing(entry, is_dir)
+
+
+def _stat(entry: os.DirEntry) -> Optional[os.stat_result]:
+    try:
+        return entry.stat()
+    except OSError:
+        return None
+
+
+def _entry_dict(listing: _Listing, base: str) -> dict:
+    entry = listing.entry
+    stat = _stat(entry)
+    path = os.path.join(base, entry.name)
+    if entry.is_symlink():
+        path = os.path.realpath(path)
+    return {
+        "name": entry.name,
+        "path": path,
+        "is_dir": listing.is_dir,
+        "size": stat.st_size if stat is not None and not listing.is_dir and entry.is_file() else None,
+        "mtime": stat.st_mtime if stat is not None else None,
+    }
+
+
+def _sort_value(listing: _Listing, sort: str) -> Tuple:
+    if sort == "name":
+        return (listing.entry.name.lower(), listing.entry.name)
+    stat = _stat(listing.entry)
+    number = 0 if stat is None else (stat.st_size if sort == "size" else stat.st_mtime_ns)
+    return (number, listing.entry.name.lower(), listing.entry.name)
+
+
+def _encode_cursor(sort: str, descending: bool, group: int, value: Tuple) -> str:
+    raw = json.dumps([sort, descending, group, list(value)]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor: str, sort: str, descending: bool) -> Tuple[int, Tuple]:
+    # A cursor only makes sense in the order it was made for; a sort key of another field does
+    # not even compare with this one's.
+    try:
+        cursor_sort, cursor_descending, group, value = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        value = tuple(value)
+        types = (str, str) if sort == "name" else (int, str, str)
+        valid = group in (0, 1) and len(value) == len(types) and all(type(v) is t for v, t in zip(value, types))
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursorError(f"Invalid cursor {cursor!r}") from exc
+    if (cursor_sort, cursor_descending) != (sort, descending):
+        order = "desc" if cursor_descending else "asc"
+        raise InvalidCursorError(f"Cursor was made for sort={cursor_sort} order={order}; start again without it")
+    if not valid:
+        raise InvalidCursorError(f"Invalid cursor {cursor!r}")
+    return group, value
+
+
+def _position_after(keys: List[Tuple], value: Tuple, descending: bool) -> int:
+    # Index of the first key that comes after ``value`` in ``keys``, which are sorted
+    # (descending when ``descending``).
+    if descending:
+        return len(keys) - bisect.bisect_left(keys[::-1], value)
+    return bisect.bisect_right(keys, value)
+
+
+def browse_directory(
+    path: Path,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    sort: str = "name",
+    descending: bool = False,
+    pattern: Optional[str] = None,
+    kind: Optional[str] = None,
+) -> DirectoryPage:
+    # Directories first, then files, each ordered by ``sort``. The cursor is the sort key of
+    # the last entry returned, so pages stay consistent while the directory changes. Sorting by
+    # name stats only the entries on the returned page; sorting by size or mtime stats every
+    # entry once. The cursor's position is found by bisection, not by walking the listing.
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"Unknown sort field {sort!r}")
+    _check_allowed(path)
+    after = _decode_cursor(cursor, sort, descending) if cursor else None
+    groups: List[List[Tuple[Tuple, _Listing]]] = [[], []]
+    for listing in _scan(path, pattern, kind):
+        groups[0 if listing.is_dir else 1].append((_sort_value(listing, sort), listing))
+    for members in groups:
+        members.sort(key=lambda member: member[0], reverse=descending)
+    ordered = [(group, key, listing) for group, members in enumerate(groups) for key, listing in members]
+
+    start = 0
+    if after is not None:
+        after_group, after_value = after
+        start = len(groups[0]) if after_group else 0
+        start += _position_after([key for key, _ in groups[after_group]], after_value, descending)
+
+    size = len(ordered) if limit is None else max(1, min(limit, MAX_PAGE_SIZE))
+    page = ordered[start : start + size]
+    next_cursor = None
+    if page and start + size < len(ordered):
+        last_group, last_key, _ = page[-1]
+        next_cursor = _encode_cursor(sort, descending, last_group, last_key)
+    base = str(path.resolve())
+    entries = [_entry_dict(listing, base) for _, _, listing in page]
+    # Recursive totals come from the background size index; directories it has not reached
+    # yet show None rather than being walked here.
+    sizes = cached_sizes(e["path"] for e in entries if e["is_dir"])
+    for entry in entries:
+        if entry["is_dir"]:
+            known = sizes.get(entry["path"])
+            entry["total_size"] = known.bytes if known else None
+            entry["total_files"] = known.files if known else None
+    return DirectoryPage(entries, next_cursor, len(ordered))
+
+
+def iter_directory(path: Path, pattern: Optional[str] = None, kind: Optional[str] = None) -> Iterator[dict]:
+    # Unsorted entries in directory order, for streaming huge directories without holding them.
+    _check_allowed(path)
+    base = str(path.resolve())
+    return (_entry_dict(listing, base) for listing in _scan(path, pattern, kind))
+
+
+def list_directory(path: Path) -> List[dict]:
+    return browse_directory(path).entries
 
 
 def normalize_selection(selection: List[str]) -> List[str]:
     config = load_config()
+    roots = get_allowed_roots(config.allowed_roots)
     normalized = []
     for item in selection:
-        path = Path(item).expanduser()
-        if not is_allowed(path, config.allowed_roots):
-            continue
-        normalized.append(str(path.resolve()))
+        resolved = Path(item).expanduser().resolve()
+        if roots.contains(resolved):
+            normalized.append(str(resolved))
     return normalized
 
 
@@ -63,6 +214,29 @@ def safe_relative_to(path: Path, root: Path) -> Path:
         return path.name
 
 
+def physical_device(path: str) -> str:
+    # Maps a path to the disk it lives on (partitions of one disk share a key) using
+    # /sys/dev/block. Network and virtual filesystems fall back to their own device number.
+    dev = os.stat(path).st_dev
+    key = f"{os.major(dev)}:{os.minor(dev)}"
+    try:
+        block = (Path("/sys/dev/block") / key).resolve(strict=True)
+    except OSError:
+        return key
+    return block.parent.name if (block / "partition").exists() else block.name
+
+
+def group_by_device(paths: Iterable[str]) -> List[List[str]]:
+    groups: Dict[str, List[str]] = {}
+    for path in paths:
+        try:
+            key = physical_device(path)
+        except OSError:
+            key = f"unknown:{path}"
+        groups.setdefault(key, []).append(path)
+    return list(groups.values())
+
+
 def has_rsync() -> bool:
     from shutil import which
 
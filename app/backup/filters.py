@@ -0,0 +1,107 @@
+import re
+from typing import Iterable, List, Optional, Pattern
+
+
+def _translate(pattern: str) -> str:
+    # rsync wildcard rules: "*" stops at "/", "**" crosses it, "?" is one non-"/" character,
+    # "[...]" is a character class and a trailing "/***" matches a directory and all it holds.
+    if pattern.endswith("/***"):
+        return _translate(pattern[:-4]) + "(?:/.*)?"
+    out = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "*":
+            if pattern.startswith("**", i):
+                out.append(".*")
+                i += 2
+                continue
+            out.append("[^/]*")
+        elif char == "?":
+            out.append("[^/]")
+        elif char == "[":
+            end = pattern.find("]", i + 2 if pattern.startswith("[!", i) or pattern.startswith("[^", i) else i + 1)
+            if end == -1:
+                out.append(re.escape(char))
+            else:
+                body = pattern[i + 1 : end]
+                if body[:1] in ("!", "^"):
+                    body = "^" + body[1:]
+                out.append("[" + body.replace("\\", "\\\\") + "]")
+                i = end
+        elif char == "\\" and i + 1 < len(pattern):
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(char))
+        i += 1
+    return "".join(out)
+
+
+def pattern_to_regex(pattern: str) -> str:
+    # A leading "/" anchors the pattern at the top of the transfer (the selected path's own name);
+    # otherwise it may match the end of the path at any depth.
+    if pattern.startswith("/"):
+        return "^" + _translate(pattern.lstrip("/")) + "$"
+    return "(?:^|/)" + _translate(pattern) + "$"
+
+
+def _combine(patterns: Iterable[str]) -> Optional[Pattern[str]]:
+    regexes = [pattern_to_regex(p) for p in patterns if p]
+    if not regexes:
+        return None
+    return re.compile("|".join(f"(?:{r})" for r in regexes))
+
+
+def _split_dir_only(patterns: Iterable[str]) -> tuple[List[str], List[str]]:
+    any_type, dir_only = [], []
+    for pattern in patterns:
+        if pattern.endswith("/") and not pattern.endswith("\\/"):
+            dir_only.append(pattern.rstrip("/"))
+        else:
+            any_type.append(pattern)
+    return any_type, dir_only
+
+
+class PathFilter:
+    # Include/exclude rules compiled once into a handful of combined regexes and matched against
+    # the path as rsync sees it: "<selected name>/sub/dir/file". The same rules produce the rsync
+    # arguments, so both engines select exactly the same files:
+    #   - exclude patterns win; an excluded directory is pruned with everything below it,
+    #   - with include patterns, only files matching one of them are backed up (directories are
+    #     still traversed and empty ones are not created),
+    #   - a trailing "/" restricts a pattern to directories.
+
+    def __init__(self, include_patterns: Iterable[str] = (), exclude_patterns: Iterable[str] = ()) -> None:
+        self.include_patterns = [p for p in include_patterns if p]
+        self.exclude_patterns = [p for p in exclude_patterns if p]
+        exclude_any, exclude_dirs = _split_dir_only(self.exclude_patterns)
+        include_any, _ = _split_dir_only(self.include_patterns)
+        self._exclude_any = _combine(exclude_any)
+        self._exclude_dirs = _combine(exclude_dirs)
+        self._include_files = _combine(include_any)
+
+    def includes_dir(self, path: str) -> bool:
+        if self._exclude_any is not None and self._exclude_any.search(path):
+            return False
+        if self._exclude_dirs is not None and self._exclude_dirs.search(path):
+            return False
+        return True
+
+    def includes_file(self, path: str) -> bool:
+        if self._exclude_any is not None and self._exclude_any.search(path):
+            return False
+        if self.include_patterns:
+            return self._include_files is not None and self._include_files.search(path) is not None
+        return True
+
+    def rsync_args(self) -> List[str]:
+        args: List[str] = []
+        for pattern in self.exclude_patterns:
+            args.extend(["--exclude", pattern])
+        if self.include_patterns:
+            args.extend(["--include", "*/"])
+            for pattern in self.include_patterns:
+                args.extend(["--include", pattern])
+            args.extend(["--exclude", "*", "--prune-empty-dirs"])
+        return args
@@ -0,0 +1,170 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+HISTORY_FILENAME = "runs.jsonl"
+MAX_RECORDS = 1000
+# Runs per final status since the history was started. Kept beside the history because
+# compaction drops old records, and a Prometheus counter must never go down.
+TOTALS_FILENAME = "runs-totals.json"
+
+_write_lock = threading.Lock()
+
+
+@dataclass
+class RunRecord:
+    run_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    status: str = "running"
+    engine: str = ""
+    destination: str = ""
+    snapshot: Optional[str] = None
+    # True when the run finished a snapshot an earlier, interrupted run had started.
+    resumed: bool = False
+    files_scanned: int = 0
+    files_copied: int = 0
+    files_linked: int = 0
+    files_resumed: int = 0
+    bytes_copied: int = 0
+    bytes_skipped: int = 0
+    errors: int = 0
+    phases: Dict[str, float] = field(default_factory=dict)
+    # profiling.RunProfile.to_dict(): every timing span and counter of the run.
+    profile: Dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.finished_at - self.started_at if self.finished_at is not None else None
+
+    def finish(self, status: str, error: Optional[str] = None) -> None:
+        self.finished_at = time.time()
+        self.status = status
+        self.error = error
+
+    def to_dict(self) -> Dict:
+        data = asdict(self)
+        data["duration"] = self.duration
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RunRecord":
+        known = {name: data[name] for name in cls.__dataclass_fields__ if name in data}
+        return cls(**known)
+
+
+class RunHistory:
+    # Append-only JSON-lines file, one record per finished run. Runs are few (a handful a day),
+    # so reading the whole file is cheap; it is compacted to the newest MAX_RECORDS entries.
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.totals_path = path.with_name(TOTALS_FILENAME)
+
+    def append(self, record: RunRecord) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with _write_lock:
+            totals = self.totals()
+            totals[record.status] = totals.get(record.status, 0) + 1
+            tmp_path = self.totals_path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(totals, sort_keys=True), encoding="utf-8")
+            tmp_path.replace(self.totals_path)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(record.to_dict(), separators=(",", ":")) + "\n")
+            self._compact()
+
+    def _compact(self) -> None:
+        with self.path.open("r", encoding="utf-8") as f:
+            lines = f.readlines()
+        if len(lines) <= MAX_RECORDS * 1.1:
+            return
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text("".join(lines[-MAX_RECORDS:]), encoding="utf-8")
+        tmp_path.replace(self.path)
+
+    def records(self) -> List[RunRecord]:
+        if not self.path.exists():
+            return []
+        records = []
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(RunRecord.from_dict(json.loads(line)))
+                except (ValueError, TypeError):
+                    logger.warning("Skipping malformed run history line in %s", self.path)
+        records.reverse()
+        return records
+
+    def get(self, run_id: str) -> Optional[RunRecord]:
+        return next((record for record in self.records() if record.run_id == run_id), None)
+
+    def totals(self) -> Dict[str, int]:
+        # Runs per status, including those compaction has dropped. A history written before
+        # the totals file existed has never been compacted past them, so its records are the count.
+        try:
+            return json.loads(self.totals_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logger.warning("Recounting unreadable run totals in %s", self.totals_path)
+        totals: Dict[str, int] = {}
+        for record in self.records():
+            totals[record.status] = totals.get(record.status, 0) + 1
+        return totals
+
+
+def _metric(lines: List[str], name: str, kind: str, help_text: str, samples: Dict[str, float]) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples.items():
+        lines.append(f"{name}{labels} {value:g}")
+
+
+def render_metrics(records: List[RunRecord], totals: Dict[str, int]) -> str:
+    # Prometheus text exposition format (version 0.0.4); ``records`` are newest first and
+    # ``totals`` is RunHistory.totals().
+    lines: List[str] = []
+    counts = {f'{{status="{status}"}}': count for status, count in sorted(totals.items())}
+    _metric(lines, "pi_backup_runs_total", "counter", "Backup runs by final status.", counts)
+
+    last_success = next((r for r in records if r.status == "succeeded"), None)
+    if last_success is not None and last_success.finished_at is not None:
+        _metric(
+            lines,
+            "pi_backup_last_success_timestamp_seconds",
+            "gauge",
+            "Unix time the last successful backup finished.",
+            {"": last_success.finished_at},
+        )
+
+    if records:
+        last = records[0]
+        gauges = {
+            "pi_backup_last_run_start_timestamp_seconds": ("Unix time the last run started.", last.started_at),
+            "pi_backup_last_run_duration_seconds": ("Wall-clock duration of the last run.", last.duration or 0),
+            "pi_backup_last_run_success": ("1 if the last run succeeded, else 0.", 1 if last.status == "succeeded" else 0),
+            "pi_backup_last_run_files_scanned": ("Files scanned by the last run.", last.files_scanned),
+            "pi_backup_last_run_files_copied": ("Files copied by the last run.", last.files_copied),
+            "pi_backup_last_run_bytes_copied": ("Bytes copied by the last run.", last.bytes_copied),
+            "pi_backup_last_run_bytes_skipped": ("Bytes of unchanged files the last run did not copy.", last.bytes_skipped),
+            "pi_backup_last_run_errors": ("Per-file errors in the last run.", last.errors),
+        }
+        for name, (help_text, value) in gauges.items():
+            _metric(lines, name, "gauge", help_text, {"": value})
+        if last.phases:
+            _metric(
+                lines,
+                "pi_backup_last_run_phase_seconds",
+                "gauge",
+                "Time spent in each phase of the last run.",
+                {f'{{phase="{phase}"}}': seconds for phase, seconds in last.phases.items()},
+            )
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,115 @@
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = ".pi-backup-index.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    relative TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    snapshot TEXT NOT NULL,
+    sha256 TEXT
+)
+"""
+_COLUMNS = "path, relative, size, mtime_ns, inode, snapshot, sha256"
+
+
+@dataclass
+class IndexEntry:
+    path: str
+    relative: str
+    size: int
+    mtime_ns: int
+    inode: int
+    snapshot: str
+    # Content hash from the manifest of the snapshot that stored it, when one was written.
+    sha256: Optional[str] = None
+
+    def matches(self, stat: os.stat_result) -> bool:
+        return self.size == stat.st_size and self.mtime_ns == stat.st_mtime_ns and self.inode == stat.st_ino
+
+    def as_stat(self) -> os.stat_result:
+        # The fields the engine uses, for files trusted to be unchanged without a fresh stat().
+        mtime = self.mtime_ns // 1_000_000_000
+        return os.stat_result((0, self.inode, 0, 1, 0, 0, self.size, mtime, mtime, mtime), {"st_mtime_ns": self.mtime_ns})
+
+
+IndexRow = Tuple[str, str, int, int, int, str, Optional[str]]
+
+
+class FileIndex:
+    # Persistent record of every source file stored by the Python engine, keyed by its source
+    # path. It lets a run decide "unchanged, link it from snapshot X" from the source stat alone,
+    # without touching the destination. The connection is owned by the scanning thread.
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._conn = sqlite3.connect(str(path))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(files)")}
+        if "sha256" not in columns:
+            # Indexes written before manifests carried hashes.
+            self._conn.execute("ALTER TABLE files ADD COLUMN sha256 TEXT")
+        self._conn.commit()
+        self.is_empty = self._conn.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None
+
+    @classmethod
+    def open(cls, destination_root: Path) -> Optional["FileIndex"]:
+        try:
+            return cls(destination_root / INDEX_FILENAME)
+        except sqlite3.Error as exc:
+            logger.warning("File index unavailable at %s (%s); comparing against the destination instead", destination_root, exc)
+            return None
+
+    def lookup(self, path: str) -> Optional[IndexEntry]:
+        row = self._conn.execute(f"SELECT {_COLUMNS} FROM files WHERE path = ?", (path,)).fetchone()
+        return IndexEntry(*row) if row else None
+
+    def iter_entries(self, batch: int = 1000) -> Iterator[IndexEntry]:
+        # Keyset pages instead of one open cursor, so the caller can record() while iterating.
+        last = ""
+        while True:
+            rows = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM files WHERE path > ? ORDER BY path LIMIT ?", (last, batch)
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield IndexEntry(*row)
+            last = rows[-1][0]
+
+    def record(self, rows: Iterable[IndexRow]) -> None:
+        self._conn.executemany(f"INSERT OR REPLACE INTO files ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self._conn.commit()
+
+    def prune(self, snapshot: str) -> int:
+        # Anything not stored in ``snapshot`` was deleted from the sources (or failed to copy).
+        cursor = self._conn.execute("DELETE FROM files WHERE snapshot != ?", (snapshot,))
+        self._conn.commit()
+        return cursor.rowcount
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "FileIndex":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def index_row(
+    path: Path, relative: Path, stat: os.stat_result, snapshot: str, sha256: Optional[str] = None
+) -> IndexRow:
+    return (str(path), relative.as_posix(), stat.st_size, stat.st_mtime_ns, stat.st_ino, snapshot, sha256)
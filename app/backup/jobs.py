@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from .progress import Progress
+
+logger = logging.getLogger(__name__)
+
+MAX_FINISHED_JOBS = 50
+ACTIVE_STATES = ("queued", "running")
+
+
+class JobBusyError(Exception):
+    def __init__(self, job: "Job") -> None:
+        super().__init__(f"A {job.kind} job ({job.id}) is already running for {job.key}")
+        self.job = job
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    key: str
+    status: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[str] = None
+    error: Optional[str] = None
+    progress: Progress = field(default_factory=Progress)
+    _done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status not in ACTIVE_STATES
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "key": self.key,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+            "progress": self.progress.snapshot(),
+        }
+
+
+class JobManager:
+    # Runs long operations on background threads so request handlers return immediately.
+    # Only one active job is allowed per key (the destination root), so two backups can
+    # never write into, and prune, the same destination at once.
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+
+    def submit(self, kind: str, key: str, target: Callable[[Progress], Any]) -> Job:
+        with self._lock:
+            for job in self._jobs.values():
+                if job.key == key and not job.finished:
+                    raise JobBusyError(job)
+            job = Job(id=uuid.uuid4().hex[:12], kind=kind, key=key)
+            self._jobs[job.id] = job
+            self._trim()
+        thread = threading.Thread(target=self._run, args=(job, target), name=f"job-{job.id}", daemon=True)
+        thread.start()
+        return job
+
+    def _run(self, job: Job, target: Callable[[Progress], Any]) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            result = target(job.progress)
+            job.result = str(result) if result is not None else None
+            job.status = "succeeded"
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("%s job %s failed", job.kind.capitalize(), job.id)
+            job.error = str(exc)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            job.progress.set_phase("done")
+            job._done.set()
+
+    def _trim(self) -> None:
+        finished = [job for job in self._jobs.values() if job.finished]
+        for job in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def active(self) -> Optional[Job]:
+        return next((job for job in self.list() if not job.finished), None)
+
+
+job_manager = JobManager()
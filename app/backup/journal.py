@@ -0,0 +1,157 @@
+import json
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from .config import get_config_dir
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILENAME = ".pi-backup-journal.sqlite"
+# A watcher that has not checked in for this long is considered down.
+HEARTBEAT_TIMEOUT = 90.0
+# Beyond this many changed paths a full scan is as cheap as following the journal.
+MAX_CHANGED_PATHS = 100_000
+# Seconds a connection waits for the other side's write to finish before giving up with
+# "database is locked"; the watcher and the engine each hold a connection.
+BUSY_TIMEOUT = 30.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def journal_path() -> Path:
+    return get_config_dir() / JOURNAL_FILENAME
+
+
+@dataclass
+class JournalPlan:
+    # What a run may rely on: ``changed_paths`` is None when it has to scan everything.
+    epoch: int
+    cutoff: int
+    changed_paths: Optional[Set[str]]
+    reason: str = ""
+
+
+class ChangeJournal:
+    # Persistent list of source paths changed since the last backup, written by the watcher
+    # and read by the engine (each with its own connection). The journal is only trusted when
+    # nothing can have been missed:
+    #   - "epoch" is bumped whenever the watcher (re)starts or loses events (queue overflow,
+    #     watch limit), and a run records the epoch it synced at,
+    #   - the watcher must be checking in ("heartbeat"),
+    #   - the last clean run must have produced the snapshot this run links against, with the
+    #     same sources and filters.
+    # Otherwise the run does a full scan, and a clean one makes the journal usable again.
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._conn = sqlite3.connect(str(path), timeout=BUSY_TIMEOUT)
+        self._conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}")
+        # Switching to WAL needs the database to itself; once it is WAL (a persistent
+        # setting), later connections leave it alone instead of contending for that.
+        if self._conn.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    @classmethod
+    def open(cls, path: Optional[Path] = None) -> Optional["ChangeJournal"]:
+        path = path or journal_path()
+        try:
+            return cls(path)
+        except sqlite3.Error as exc:
+            logger.warning("Change journal unavailable at %s (%s); runs will scan everything", path, exc)
+            return None
+
+    def _get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set(self, key: str, value: str) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    # --- watcher side ---
+
+    def record(self, paths: Iterable[str]) -> None:
+        # REPLACE gives a re-changed path a new, higher seq, so it survives the cleanup of a
+        # run that started before the change.
+        self._conn.executemany("INSERT OR REPLACE INTO changes (path) VALUES (?)", ((p,) for p in paths))
+        self._set("heartbeat", repr(time.time()))
+        self._conn.commit()
+
+    def heartbeat(self) -> None:
+        self._set("heartbeat", repr(time.time()))
+        self._conn.commit()
+
+    def invalidate(self, reason: str, degraded: bool = False) -> None:
+        # ``degraded`` marks a watcher that cannot see every directory (out of watches); its
+        # journal is not trusted at all until it restarts with complete coverage.
+        epoch = int(self._get("epoch", "0")) + 1
+        self._set("epoch", str(epoch))
+        self._set("degraded", "1" if degraded else "0")
+        self._set("heartbeat", repr(time.time()))
+        self._conn.commit()
+        logger.warning("Change journal invalidated (%s); the next backup will do a full scan", reason)
+
+    # --- engine side ---
+
+    def begin(self, signature: Dict) -> JournalPlan:
+        epoch = int(self._get("epoch", "0"))
+        cutoff = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        synced = json.loads(self._get("synced", "null") or "null")
+        heartbeat = float(self._get("heartbeat", "0"))
+        plan = JournalPlan(epoch=epoch, cutoff=cutoff, changed_paths=None)
+        if time.time() - heartbeat > HEARTBEAT_TIMEOUT:
+            plan.reason = "the change watcher is not running"
+        elif self._get("degraded") == "1":
+            plan.reason = "the change watcher cannot watch every directory"
+        elif synced is None or synced.get("epoch") != epoch:
+            plan.reason = "the watcher restarted or lost events since the last backup"
+        elif {k: synced.get(k) for k in signature} != signature:
+            plan.reason = "the previous snapshot, sources or filters changed since the last journaled backup"
+        else:
+            count = self._conn.execute("SELECT COUNT(*) FROM changes WHERE seq <= ?", (cutoff,)).fetchone()[0]
+            if count > MAX_CHANGED_PATHS:
+                plan.reason = f"{count} paths changed"
+            else:
+                rows = self._conn.execute("SELECT path FROM changes WHERE seq <= ?", (cutoff,))
+                plan.changed_paths = {row[0] for row in rows}
+        return plan
+
+    def commit(self, plan: JournalPlan, signature: Dict) -> None:
+        # After a clean run: everything up to the cutoff is in the new snapshot.
+        self._conn.execute("DELETE FROM changes WHERE seq <= ?", (plan.cutoff,))
+        self._set("synced", json.dumps({"epoch": plan.epoch, **signature}))
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "ChangeJournal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def journal_signature(
+    destination_root: Path, snapshot: Optional[str], sources: Iterable[str], include: List[str], exclude: List[str]
+) -> Dict:
+    return {
+        "destination": str(destination_root),
+        "snapshot": snapshot,
+        "sources": sorted(sources),
+        "filters": [list(include), list(exclude)],
+    }
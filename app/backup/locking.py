@@ -0,0 +1,56 @@
+import fcntl
+import os
+import socket
+import time
+from pathlib import Path
+from typing import Optional
+
+LOCK_FILENAME = ".pi-backup.lock"
+
+
+class DestinationLockedError(RuntimeError):
+    def __init__(self, root: Path, holder: str) -> None:
+        detail = f" (held by {holder})" if holder else ""
+        super().__init__(f"Another backup is already running for {root}{detail}")
+        self.root = root
+        self.holder = holder
+
+
+class DestinationLock:
+    # Exclusive flock on a file in the destination root, shared by every process that backs up
+    # there: the web app, its scheduler and the CLI. The kernel drops the lock when its holder
+    # exits, so a crashed run never leaves a stale lock behind. flock locks belong to the open
+    # file, so two threads of one process exclude each other as well.
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.path = root / LOCK_FILENAME
+        self._fd: Optional[int] = None
+
+    def acquire(self) -> None:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            holder = os.read(fd, 256).decode("utf-8", "replace").strip()
+            os.close(fd)
+            raise DestinationLockedError(self.root, holder) from None
+        # Record who holds the lock, for the error message other runs report.
+        os.ftruncate(fd, 0)
+        os.write(fd, f"pid {os.getpid()} on {socket.gethostname()} since {time.strftime('%Y-%m-%d %H:%M:%S')}".encode())
+        self._fd = fd
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        os.ftruncate(self._fd, 0)
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self) -> "DestinationLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
@@ -0,0 +1,348 @@
+import base64
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from .filesystem import InvalidCursorError
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s%(run_tag)s: %(message)s"
+DEFAULT_LIMIT = 200
+MAX_LIMIT = 2000
+READ_CHUNK = 64 * 1024
+# The offset index keeps one summary per block of roughly this many bytes.
+INDEX_BLOCK_SIZE = 64 * 1024
+
+_HEADER = re.compile(
+    rb"^(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)(?:,\d+)? \[(?P<level>[A-Z]+)\] "
+    rb"(?P<name>[^\s\[:]+)(?:\[(?P<run>[0-9a-f]+)\])?: (?P<message>.*)$"
+)
+_LEVELS = {name: logging.getLevelName(name) for name in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")}
+
+# --- Run id tagging ---------------------------------------------------------------------------
+
+_run_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("backup_run_id", default=None)
+
+
+def set_run_id(run_id: Optional[str]) -> contextvars.Token:
+    return _run_id.set(run_id)
+
+
+def reset_run_id(token: contextvars.Token) -> None:
+    _run_id.reset(token)
+
+
+def _enter_context(context: contextvars.Context) -> None:
+    for var, value in context.items():
+        var.set(value)
+
+
+def run_context() -> Dict:
+    # Keyword arguments for a ThreadPoolExecutor so its worker threads see the context of the
+    # run that created the pool: they tag their log lines with its run id and add to its
+    # profile.
+    return {"initializer": _enter_context, "initargs": (contextvars.copy_context(),)}
+
+
+class RunIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        run_id = _run_id.get()
+        record.run_tag = f"[{run_id}]" if run_id else ""
+        return True
+
+
+# --- Reading ----------------------------------------------------------------------------------
+
+
+@dataclass
+class LogEntry:
+    file: str
+    offset: int
+    text: str
+    timestamp: Optional[str] = None
+    level: Optional[str] = None
+    logger: Optional[str] = None
+    run_id: Optional[str] = None
+    message: str = ""
+
+    def to_dict(self) -> Dict:
+        return {
+            "timestamp": self.timestamp,
+            "level": self.level,
+            "logger": self.logger,
+            "run_id": self.run_id,
+            "message": self.message,
+            "text": self.text,
+        }
+
+
+@dataclass
+class LogQuery:
+    level: Optional[str] = None
+    run_id: Optional[str] = None
+    since: Optional[str] = None
+    until: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        if self.level is not None:
+            self.level = self.level.upper()
+            if self.level not in _LEVELS:
+                raise ValueError(f"Unknown log level {self.level!r}")
+        # Timestamps compare as text; accept ISO 8601 "T" separators.
+        self.since = self.since.replace("T", " ")[:19] if self.since else None
+        self.until = self.until.replace("T", " ")[:19] if self.until else None
+
+    @property
+    def filtered(self) -> bool:
+        return any((self.level, self.run_id, self.since, self.until))
+
+    def matches(self, entry: LogEntry) -> bool:
+        if self.level and (entry.level is None or _LEVELS.get(entry.level, 0) < _LEVELS[self.level]):
+            return False
+        if self.run_id and entry.run_id != self.run_id:
+            return False
+        if self.since and (entry.timestamp is None or entry.timestamp < self.since):
+            return False
+        if self.until and (entry.timestamp is None or entry.timestamp > self.until):
+            return False
+        return True
+
+    def may_match(self, block: "_Block") -> bool:
+        if self.level and not any(_LEVELS.get(level, 0) >= _LEVELS[self.level] for level in block.levels):
+            return False
+        if self.run_id and self.run_id not in block.runs:
+            return False
+        if self.since and block.last_time is not None and block.last_time < self.since:
+            return False
+        if self.until and block.first_time is not None and block.first_time > self.until:
+            return False
+        return True
+
+
+@dataclass
+class LogPage:
+    entries: List[LogEntry]
+    next_cursor: Optional[str]
+
+
+def log_files(log_file: Path, backup_count: int) -> List[Path]:
+    # Newest first, in RotatingFileHandler's naming: backup.log, backup.log.1, ...
+    candidates = [log_file] + [log_file.with_name(f"{log_file.name}.{i}") for i in range(1, backup_count + 1)]
+    return [path for path in candidates if path.exists()]
+
+
+def _parse(path: Path, offset: int, lines: List[bytes]) -> LogEntry:
+    text = b"\n".join(lines).decode("utf-8", "replace")
+    match = _HEADER.match(lines[0])
+    if match is None:
+        return LogEntry(file=path.name, offset=offset, text=text, message=text)
+    message = match["message"] + b"".join(b"\n" + line for line in lines[1:])
+    return LogEntry(
+        file=path.name,
+        offset=offset,
+        text=text,
+        timestamp=match["time"].decode("ascii"),
+        level=match["level"].decode("ascii"),
+        logger=match["name"].decode("utf-8", "replace"),
+        run_id=match["run"].decode("ascii") if match["run"] else None,
+        message=message.decode("utf-8", "replace"),
+    )
+
+
+def _lines_backward(handle, start: int, end: int) -> Iterator[Tuple[int, bytes]]:
+    # Yields (offset, line) from ``end`` back to ``start`` reading fixed-size chunks, so the
+    # cost depends on how far back the caller reads, not on the size of the file.
+    position = end
+    pending = b""
+    while position > start:
+        size = min(READ_CHUNK, position - start)
+        position -= size
+        handle.seek(position)
+        data = handle.read(size) + pending
+        lines = data.split(b"\n")
+        pending = lines.pop(0)
+        offset = position + len(pending) + 1
+        ends = []
+        for line in lines:
+            ends.append((offset, line))
+            offset += len(line) + 1
+        for item in reversed(ends):
+            if item[1]:
+                yield item
+    if pending:
+        yield start, pending
+
+
+def _entries_backward(path: Path, handle, start: int, end: int) -> Iterator[LogEntry]:
+    # Continuation lines (tracebacks) follow their header, so they are collected until the
+    # header that owns them is reached.
+    continuation: List[bytes] = []
+    for offset, line in _lines_backward(handle, start, end):
+        if _HEADER.match(line) is None and offset > start:
+            continuation.append(line)
+            continue
+        yield _parse(path, offset, [line] + continuation[::-1])
+        continuation = []
+
+
+@dataclass
+class _Block:
+    start: int
+    end: int
+    first_time: Optional[str] = None
+    last_time: Optional[str] = None
+    levels: Set[str] = field(default_factory=set)
+    runs: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class _OffsetIndex:
+    # Per-file summary of each ~64 KiB block: time range, levels and run ids present. Blocks
+    # always start at an entry header, so a filtered search only reads the blocks that may match.
+    blocks: List[_Block] = field(default_factory=list)
+    size: int = 0
+
+
+_index_lock = threading.Lock()
+_indexes: Dict[Tuple[int, int], _OffsetIndex] = {}
+
+
+def _update_index(path: Path, handle, stat: os.stat_result) -> _OffsetIndex:
+    # Keyed by inode, so rotation (a rename) keeps the index valid; a file only ever grows
+    # until it is rotated, so only the new tail is scanned.
+    key = (stat.st_dev, stat.st_ino)
+    with _index_lock:
+        index = _indexes.get(key)
+        if index is None or stat.st_size < index.size:
+            index = _indexes[key] = _OffsetIndex()
+        if stat.st_size == index.size:
+            return index
+        # Re-scan the last (possibly partial) block together with the new data.
+        position = index.blocks.pop().start if index.blocks else 0
+        handle.seek(position)
+        block = _Block(start=position, end=position)
+        for line in handle.read(stat.st_size - position).split(b"\n"):
+            match = _HEADER.match(line)
+            if match is not None:
+                if block.end - block.start >= INDEX_BLOCK_SIZE:
+                    index.blocks.append(block)
+                    block = _Block(start=block.end, end=block.end)
+                timestamp = match["time"].decode("ascii")
+                block.first_time = block.first_time or timestamp
+                block.last_time = timestamp
+                block.levels.add(match["level"].decode("ascii"))
+                if match["run"]:
+                    block.runs.add(match["run"].decode("ascii"))
+            block.end += len(line) + 1
+        block.end = min(block.end, stat.st_size)
+        index.blocks.append(block)
+        index.size = stat.st_size
+        # Drop indexes of files that have since been deleted by rotation.
+        if len(_indexes) > 16:
+            _indexes.clear()
+            _indexes[key] = index
+        return index
+
+
+def _encode_cursor(inode: int, offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([inode, offset]).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[int, int]:
+    try:
+        inode, offset = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return int(inode), int(offset)
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursorError(f"Invalid cursor {cursor!r}") from exc
+
+
+def read_logs(
+    log_file: Path,
+    backup_count: int,
+    limit: int = DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+    query: Optional[LogQuery] = None,
+) -> LogPage:
+    # Newest entries first. The cursor names the file by inode (which survives rotation) and
+    # the offset of the last entry returned, so pages stay stable while the log keeps growing.
+    limit = max(1, min(limit, MAX_LIMIT))
+    query = query or LogQuery()
+    after = _decode_cursor(cursor) if cursor else None
+    entries: List[LogEntry] = []
+    last_inode = None
+    for path in log_files(log_file, backup_count):
+        try:
+            handle = path.open("rb")
+        except OSError:
+            continue
+        with handle:
+            stat = os.fstat(handle.fileno())
+            end = stat.st_size
+            if after is not None:
+                if stat.st_ino != after[0]:
+                    continue  # newer than the page the cursor points into
+                end, after = after[1], None
+            if query.filtered:
+                index = _update_index(path, handle, stat)
+                ranges = [(b.start, min(b.end, end)) for b in reversed(index.blocks) if b.start < end and query.may_match(b)]
+            else:
+                ranges = [(0, end)]
+            for start, stop in ranges:
+                for entry in _entries_backward(path, handle, start, stop):
+                    if not query.matches(entry):
+                        continue
+                    entries.append(entry)
+                    last_inode = stat.st_ino
+                    if len(entries) == limit:
+                        return LogPage(entries, _encode_cursor(last_inode, entry.offset))
+    return LogPage(entries, None)
+
+
+def tail(log_file: Path, backup_count: int, count: int) -> List[LogEntry]:
+    return read_logs(log_file, backup_count, limit=count).entries
+
+
+def follow(
+    log_file: Path, poll_interval: float = 1.0, stop: Optional[threading.Event] = None
+) -> Iterator[Optional[LogEntry]]:
+    # Yields entries appended after the call, oldest first, and None after each idle poll so
+    # callers can send keep-alives or notice disconnects. A rotation is detected by the inode
+    # changing and reading restarts at the top of the new file.
+    position, inode = 0, None
+    if log_file.exists():
+        stat = log_file.stat()
+        position, inode = stat.st_size, stat.st_ino
+    pending = b""
+    while stop is None or not stop.is_set():
+        try:
+            stat = log_file.stat()
+        except FileNotFoundError:
+            stat = None
+        if stat is not None and (stat.st_ino != inode or stat.st_size < position):
+            position, inode, pending = 0, stat.st_ino, b""
+        if stat is not None and stat.st_size > position:
+            with log_file.open("rb") as handle:
+                handle.seek(position)
+                data = pending + handle.read(stat.st_size - position)
+            position = stat.st_size
+            lines = data.split(b"\n")
+            pending = lines.pop()
+            # Group continuation lines with their header before yielding.
+            group: List[bytes] = []
+            for line in lines:
+                if group and _HEADER.match(line) is not None:
+                    yield _parse(log_file, 0, group)
+                    group = []
+                if line:
+                    group.append(line)
+            if group:
+                yield _parse(log_file, 0, group)
+            continue
+        yield None
+        time.sleep(poll_interval)
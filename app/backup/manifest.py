@@ -0,0 +1,136 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+# Files the engine keeps at the top of a snapshot (manifest, checkpoint, markers) share this
+# prefix; they are never part of the backed-up data.
+ENGINE_FILE_PREFIX = ".pi-backup-"
+MANIFEST_NAME = ".pi-backup-manifest.jsonl"
+MANIFEST_VERSION = 1
+# Entries OrderedWriter holds back at most while an earlier one is still being worked on.
+REORDER_WINDOW = 10_000
+
+
+def manifest_path(snapshot: Path) -> Path:
+    return snapshot / MANIFEST_NAME
+
+
+class ManifestWriter:
+    # JSON-lines manifest: a header line followed by one object per stored file. It is written
+    # to a temporary name and only renamed into place by close(), so a manifest that exists
+    # always describes a finished snapshot. write() may be called from worker threads.
+
+    def __init__(self, snapshot: Path, snapshot_format: str) -> None:
+        self.path = manifest_path(snapshot)
+        self._tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self._lock = threading.Lock()
+        self._handle = self._tmp_path.open("w", encoding="utf-8")
+        self._write({"format": snapshot_format, "version": MANIFEST_VERSION})
+
+    def _write(self, record: Dict) -> None:
+        self._handle.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def write(self, entry: Dict) -> None:
+        with self._lock:
+            self._write(entry)
+
+    def close(self) -> None:
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._handle.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self) -> None:
+        self._handle.close()
+        self._tmp_path.unlink(missing_ok=True)
+
+
+def path_key(path: str) -> List[str]:
+    # The order of the engine's sorted walks: component by component, so a directory's files
+    # all come at its place ("a/z" before "a-b", unlike plain string order).
+    return path.split("/")
+
+
+class OrderedWriter:
+    # Writes entries to a ManifestWriter in the order their slots were reserved, however the
+    # worker threads filling them finish, so a manifest comes out in scan order. reserve()
+    # blocks while ``limit`` entries are waiting for an earlier one. Every reserved slot must
+    # be filled, with None for a file that got no entry.
+
+    def __init__(self, writer: ManifestWriter, limit: int = REORDER_WINDOW) -> None:
+        self._writer = writer
+        self._lock = threading.Lock()
+        self._room = threading.BoundedSemaphore(limit)
+        self._reserved = 0
+        self._written = 0
+        self._done: Dict[int, Optional[Dict]] = {}
+
+    def reserve(self) -> int:
+        self._room.acquire()
+        with self._lock:
+            slot = self._reserved
+            self._reserved += 1
+        return slot
+
+    def fill(self, slot: int, entry: Optional[Dict]) -> None:
+        with self._lock:
+            self._done[slot] = entry
+            while self._written in self._done:
+                ready = self._done.pop(self._written)
+                if ready is not None:
+                    self._writer.write(ready)
+                self._written += 1
+                self._room.release()
+
+    def write(self, entry: Dict) -> None:
+        self.fill(self.reserve(), entry)
+
+
+class ManifestCursor:
+    # Looks up the entries of a snapshot's manifest for paths asked for in walk order
+    # (path_key), reading the manifest alongside instead of loading it, so only one entry is
+    # in memory. Manifests the engines wrote in walk order (chunk snapshots, rsync hash
+    # manifests) match every unchanged file; one in any other order only matches fewer.
+
+    def __init__(self, snapshot: Optional[Path]) -> None:
+        self._entries = read_manifest(snapshot) if snapshot is not None else iter(())
+        self._entry = next(self._entries, None)
+
+    def get(self, path: str) -> Optional[Dict]:
+        key = path_key(path)
+        while self._entry is not None and path_key(self._entry["path"]) < key:
+            self._entry = next(self._entries, None)
+        if self._entry is not None and self._entry["path"] == path:
+            return self._entry
+        return None
+
+    def close(self) -> None:
+        close = getattr(self._entries, "close", None)
+        if close is not None:
+            close()
+
+
+def read_manifest_header(snapshot: Path) -> Optional[Dict]:
+    try:
+        with manifest_path(snapshot).open("r", encoding="utf-8") as f:
+            return json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+
+
+def read_manifest(snapshot: Path) -> Iterator[Dict]:
+    path = manifest_path(snapshot)
+    if not path.exists():
+        return
+    with path.open("r", encoding="utf-8") as f:
+        f.readline()
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def snapshot_format(snapshot: Path) -> str:
+    header = read_manifest_header(snapshot)
+    return header.get("format", "directory") if header else "directory"
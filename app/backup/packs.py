@@ -0,0 +1,316 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .fastcopy import Limiter
+from .profiling import active_profile
+from .progress import Progress
+
+logger = logging.getLogger(__name__)
+
+# Small files of a directory snapshot can be stored back to back in pack files instead of one
+# file each. Every packed file is a line in the pack index at the top of the snapshot.
+PACK_DIR = ".pi-backup-packs"
+PACK_INDEX_NAME = ".pi-backup-packs.jsonl"
+# Scratch lookup table of the previous snapshot's pack index, only there while a run packs.
+REUSE_DB_NAME = ".pi-backup-packs-reuse.sqlite"
+PACK_INDEX_VERSION = 1
+# A pack is closed and the next one started once it reaches this size.
+PACK_SIZE = 32 * 1024 * 1024
+# Bytes buffered before a write() to the pack, so many small files cost one syscall.
+WRITE_BUFFER_SIZE = 1024 * 1024
+# An incremental run hard-links a pack of the previous snapshot only while at least this
+# share of its bytes is still in use; otherwise the unchanged files are copied into a new pack.
+# So at most half of any pack is data no later snapshot refers to.
+MIN_LIVE_FRACTION = 0.5
+
+_KNOWN_SCHEMA = """
+CREATE TABLE known (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    pack TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    entry TEXT NOT NULL,
+    reused INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+def pack_index_path(snapshot: Path) -> Path:
+    return snapshot / PACK_INDEX_NAME
+
+
+def iter_pack_index(snapshot: Path) -> Iterator[Dict]:
+    # Index entries ({"path", "size", "mtime_ns", "mode", "pack", "offset", "sha256"}) in file
+    # order, which keeps the entries of each pack together (see PackWriter); nothing for a
+    # snapshot without packs.
+    path = pack_index_path(snapshot)
+    if not path.exists():
+        return
+    with path.open("r", encoding="utf-8") as f:
+        f.readline()
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_packs(snapshot: Path) -> Iterator[Tuple[str, List[Dict]]]:
+    # (pack, its entries) one pack at a time, so only one pack's entries are in memory.
+    for pack, entries in itertools.groupby(iter_pack_index(snapshot), key=lambda entry: entry["pack"]):
+        yield pack, list(entries)
+
+
+def read_pack_index(snapshot: Path) -> Dict[str, Dict]:
+    # Snapshot-relative path -> index entry, for lookups of a few selected paths.
+    return {entry["path"]: entry for entry in iter_pack_index(snapshot)}
+
+
+def packed_under(entries: Dict[str, Dict], rel: str) -> List[Dict]:
+    # Index entries for ``rel`` itself or anything below it.
+    if rel in entries:
+        return [entries[rel]]
+    prefix = rel + "/"
+    return [entry for path, entry in entries.items() if path.startswith(prefix)]
+
+
+def read_members(snapshot: Path, pack: str, entries: Iterable[Dict]) -> Iterator[Tuple[Dict, bytes]]:
+    # Reads the given files of one pack in offset order, so the pack is read front to back. A
+    # file cut short by a truncated pack comes back short. Raises OSError when the pack is gone.
+    fd = os.open(snapshot / PACK_DIR / pack, os.O_RDONLY)
+    try:
+        for entry in sorted(entries, key=lambda e: e["offset"]):
+            yield entry, os.pread(fd, entry["size"], entry["offset"]) if entry["size"] else b""
+    finally:
+        os.close(fd)
+
+
+def by_pack(entries: Iterable[Dict]) -> Dict[str, List[Dict]]:
+    grouped: Dict[str, List[Dict]] = defaultdict(list)
+    for entry in entries:
+        grouped[entry["pack"]].append(entry)
+    return grouped
+
+
+class PackWriter:
+    # Packs the small files of one snapshot. add() may be called from worker threads: each one
+    # reads its file, then appends it to the open pack under a lock. Files an incremental run
+    # finds unchanged are taken from the previous snapshot's packs (see reuse()), so they are
+    # not read from the source at all. The index is written to a temporary name and renamed
+    # into place by close(), with the entries of each pack together.
+    #
+    # The previous snapshot's index is looked up through a scratch SQLite table next to the
+    # packs rather than a dict, so memory does not grow with the number of small files. Its
+    # connection belongs to the thread that created the writer, which also calls reuse() and
+    # close() (the engine's scanning thread).
+
+    def __init__(self, snapshot: Path, threshold: int, previous: Optional[Path] = None) -> None:
+        self.snapshot = snapshot
+        self.threshold = threshold
+        self.directory = snapshot / PACK_DIR
+        # Packs of an interrupted run into the same snapshot are not in any checkpoint; their
+        # files are simply packed again.
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory.mkdir(parents=True)
+        self._previous = previous
+        self._known_path = snapshot / REUSE_DB_NAME
+        self._known: Optional[sqlite3.Connection] = None
+        if previous is not None and pack_index_path(previous).exists():
+            self._known = self._load_known(previous)
+        self._lock = threading.Lock()
+        self._pack: Optional[BinaryIO] = None
+        self._pack_name = ""
+        self._pack_count = 0
+        self._index_path = pack_index_path(snapshot)
+        self._index_tmp = self._index_path.with_name(self._index_path.name + ".tmp")
+        self._index = self._index_tmp.open("w", encoding="utf-8")
+        self._index.write(json.dumps({"version": PACK_INDEX_VERSION}) + "\n")
+
+    def _load_known(self, previous: Path) -> sqlite3.Connection:
+        self._known_path.unlink(missing_ok=True)
+        conn = sqlite3.connect(str(self._known_path))
+        # Scratch data, rebuilt by every run: nothing to recover after a crash.
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(_KNOWN_SCHEMA)
+        conn.executemany(
+            "INSERT OR REPLACE INTO known (path, size, mtime_ns, pack, offset, entry) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (e["path"], e["size"], e["mtime_ns"], e["pack"], e["offset"], json.dumps(e, separators=(",", ":")))
+                for e in iter_pack_index(previous)
+            ),
+        )
+        conn.execute("CREATE INDEX known_pack ON known (pack, offset)")
+        conn.commit()
+        return conn
+
+    def wants(self, size: int) -> bool:
+        return size < self.threshold
+
+    def reuse(self, relative: str, size: int, mtime_ns: int) -> Optional[Dict]:
+        # The previous snapshot's entry when the file is unchanged since (same size and mtime).
+        # Whether its pack is linked or its bytes copied is settled by close().
+        if self._known is None:
+            return None
+        row = self._known.execute(
+            "SELECT entry FROM known WHERE path = ? AND size = ? AND mtime_ns = ?", (relative, size, mtime_ns)
+        ).fetchone()
+        if row is None:
+            return None
+        self._known.execute("UPDATE known SET reused = 1 WHERE path = ?", (relative,))
+        return json.loads(row[0])
+
+    def add(
+        self, path: Path, relative: str, size: int, mtime_ns: int, limiter: Optional[Limiter] = None
+    ) -> Optional[Tuple[int, str]]:
+        # Packs one source file of ``size`` bytes as scanned; returns its size and sha256. A
+        # file that has grown since is not read beyond that size and returns None: it may no
+        # longer be small, so the caller stores it as a file of its own.
+        with open(path, "rb", buffering=0) as f:
+            mode = os.fstat(f.fileno()).st_mode & 0o7777
+            data = f.read(size + 1)
+        if limiter is not None:
+            limiter.consume(len(data))
+        if len(data) > size:
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+        self._append({"path": relative, "size": len(data), "mtime_ns": mtime_ns, "mode": mode, "sha256": digest}, data)
+        return len(data), digest
+
+    def _append(self, entry: Dict, data: bytes) -> None:
+        with self._lock:
+            if self._pack is None or (self._pack.tell() and self._pack.tell() + len(data) > PACK_SIZE):
+                self._next_pack()
+            entry["pack"] = self._pack_name
+            entry["offset"] = self._pack.tell()
+            self._pack.write(data)
+            self._write_index(entry)
+        active_profile().count("packs.bytes", len(data))
+
+    def _next_pack(self) -> None:
+        self._close_pack()
+        self._pack_count += 1
+        # Named after the snapshot, so a pack hard-linked into later snapshots keeps a unique name.
+        self._pack_name = f"{self.snapshot.name}-{self._pack_count:05d}.pack"
+        self._pack = (self.directory / self._pack_name).open("wb", buffering=WRITE_BUFFER_SIZE)
+        active_profile().count("packs.written")
+
+    def _close_pack(self) -> None:
+        if self._pack is not None:
+            self._pack.flush()
+            os.fsync(self._pack.fileno())
+            self._pack.close()
+            self._pack = None
+
+    def _write_index(self, entry: Dict) -> None:
+        self._index.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def close(self) -> int:
+        # Carries the reused files over, then finishes the last pack and the index. Returns
+        # the number of reused files that could not be carried over. Copied files continue the
+        # open pack, whose entries are the last in the index so far; the entries of linked
+        # packs follow, one pack after the other.
+        failed = 0
+        if self._known is not None:
+            live = self._known.execute("SELECT pack, SUM(size) FROM known WHERE reused GROUP BY pack ORDER BY pack")
+            linked = []
+            for pack, size in live.fetchall():
+                if self._link(pack, size):
+                    linked.append(pack)
+                else:
+                    failed += self._repack(pack, list(self._reused_entries(pack)))
+            for pack in linked:
+                for entry in self._reused_entries(pack):
+                    self._write_index(entry)
+            self._drop_known()
+        self._close_pack()
+        self._index.flush()
+        os.fsync(self._index.fileno())
+        self._index.close()
+        os.replace(self._index_tmp, self._index_path)
+        return failed
+
+    def _reused_entries(self, pack: str) -> Iterator[Dict]:
+        rows = self._known.execute("SELECT entry FROM known WHERE pack = ? AND reused ORDER BY offset", (pack,))
+        for (entry,) in rows:
+            yield json.loads(entry)
+
+    def _drop_known(self) -> None:
+        if self._known is not None:
+            self._known.close()
+            self._known = None
+        self._known_path.unlink(missing_ok=True)
+
+    def _link(self, pack: str, live: int) -> bool:
+        # ``live``: bytes of the pack this snapshot still uses.
+        source = self._previous / PACK_DIR / pack
+        try:
+            if live < MIN_LIVE_FRACTION * source.stat().st_size:
+                return False
+            os.link(source, self.directory / pack)
+        except OSError as exc:
+            # FAT and exFAT have no hard links; copying the files is the only option there.
+            logger.debug("Cannot link pack %s (%s); copying its unchanged files", source, exc)
+            return False
+        active_profile().count("packs.linked")
+        return True
+
+    def _repack(self, pack: str, entries: List[Dict]) -> int:
+        copied = 0
+        try:
+            for entry, data in read_members(self._previous, pack, entries):
+                self._append({key: entry[key] for key in ("path", "size", "mtime_ns", "mode", "sha256")}, data)
+                copied += 1
+        except OSError as exc:
+            logger.error("Cannot copy %d unchanged files from pack %s: %s", len(entries) - copied, pack, exc)
+        return len(entries) - copied
+
+    def abort(self) -> None:
+        self._drop_known()
+        self._close_pack()
+        self._index.close()
+        self._index_tmp.unlink(missing_ok=True)
+
+
+def restore_packed(
+    snapshot: Path, entries: Iterable[Dict], target: Path, progress: Optional[Progress] = None
+) -> Tuple[int, int]:
+    # Writes packed files out below ``target`` with their mode and mtime, reading each pack
+    # once. Returns (files restored, files that could not be restored).
+    restored = errors = 0
+    created = set()
+    for pack, members in by_pack(entries).items():
+        if progress is not None:
+            for entry in members:
+                progress.add_found(entry["size"])
+        handled = 0
+        try:
+            for entry, data in read_members(snapshot, pack, members):
+                out = target / entry["path"]
+                if out.parent not in created:
+                    out.parent.mkdir(parents=True, exist_ok=True)
+                    created.add(out.parent)
+                with out.open("wb") as f:
+                    f.write(data)
+                os.chmod(out, entry["mode"])
+                os.utime(out, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+                if len(data) != entry["size"]:
+                    logger.error("Restored %s incompletely: pack %s is truncated", entry["path"], pack)
+                    errors += 1
+                else:
+                    restored += 1
+                handled += 1
+                if progress is not None:
+                    progress.advance(entry["size"])
+        except OSError as exc:
+            logger.error("Cannot restore %d files from pack %s: %s", len(members) - handled, pack, exc)
+            errors += len(members) - handled
+    return restored, errors
@@ -0,0 +1,205 @@
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Default sampling period of SamplingProfiler, and how many functions a report lists.
+SAMPLE_INTERVAL = 0.005
+HOTSPOTS = 25
+# A thread whose innermost Python frame is in one of these files is waiting, not working.
+_IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+
+
+@dataclass
+class Span:
+    seconds: float = 0.0
+    calls: int = 0
+
+
+class RunProfile:
+    # Named timing spans and counters for one run. Spans are phases ("copy", "retention") or,
+    # with a dot, parts of one ("scan.filter"). Code adds to them per phase, per directory or
+    # per file, never per byte, so a profile is kept for every run.
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.spans: Dict[str, Span] = {}
+        self.counters: Counter = Counter()
+
+    def add_time(self, name: str, seconds: float, calls: int = 1) -> None:
+        with self._lock:
+            span = self.spans.setdefault(name, Span())
+            span.seconds += seconds
+            span.calls += calls
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def phases(self, names: Iterable[str]) -> Dict[str, float]:
+        with self._lock:
+            return {name: round(self.spans[name].seconds, 3) for name in names if name in self.spans}
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "spans": {name: {"seconds": round(s.seconds, 4), "calls": s.calls} for name, s in self.spans.items()},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+
+class _NullProfile(RunProfile):
+    # Stands in outside a run, so instrumented code never has to check for a profile.
+
+    def add_time(self, name: str, seconds: float, calls: int = 1) -> None:
+        pass
+
+    def count(self, name: str, value: int = 1) -> None:
+        pass
+
+
+_NULL_PROFILE = _NullProfile()
+# A context variable, so pool workers started through logreader.run_context() add to the
+# profile of the run that started them.
+_profile: contextvars.ContextVar[RunProfile] = contextvars.ContextVar("backup_profile", default=_NULL_PROFILE)
+
+
+def active_profile() -> RunProfile:
+    return _profile.get()
+
+
+def set_profile(profile: RunProfile) -> contextvars.Token:
+    return _profile.set(profile)
+
+
+def reset_profile(token: contextvars.Token) -> None:
+    _profile.reset(token)
+
+
+def _label(code: CodeType) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}:{code.co_name}"
+
+
+def _is_idle(code: CodeType) -> bool:
+    filename = code.co_filename
+    if filename.endswith(_IDLE_FILES):
+        return True
+    # A pool worker blocked on its work queue.
+    return code.co_name == "_worker" and filename.endswith(os.path.join("concurrent", "futures", "thread.py"))
+
+
+class SamplingProfiler:
+    # Samples the stack of every thread each ``interval`` seconds from a background thread.
+    # cProfile only sees the thread that enabled it, but a run's work happens on pool workers
+    # and in rsync; sampling covers every Python thread at a cost that does not grow with the
+    # number of calls. Threads waiting on a lock or queue are recorded but left out of the
+    # hotspot figures.
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="backup-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "SamplingProfiler":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self._stacks[self._stack(frame)] += 1
+            self.samples += 1
+
+    @staticmethod
+    def _stack(frame: Optional[FrameType]) -> Tuple[CodeType, ...]:
+        # Outermost frame first.
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        return tuple(codes)
+
+    def hotspots(self, limit: int = HOTSPOTS) -> List[Dict]:
+        # Functions by share of busy samples: "self" where the thread was in that function,
+        # "total" where it was anywhere below it. Sorted by self, then total.
+        own: Counter = Counter()
+        total: Counter = Counter()
+        busy = 0
+        for stack, count in self._stacks.items():
+            if not stack or _is_idle(stack[-1]):
+                continue
+            busy += count
+            own[stack[-1]] += count
+            for code in set(stack):
+                total[code] += count
+        if not busy:
+            return []
+        ranked = sorted(total, key=lambda code: (own[code], total[code]), reverse=True)[:limit]
+        return [
+            {"function": _label(code), "self": round(100 * own[code] / busy, 1), "total": round(100 * total[code] / busy, 1)}
+            for code in ranked
+        ]
+
+    def write_collapsed(self, path: Path) -> None:
+        # One "outer;...;inner count" line per distinct stack: the input format of
+        # flamegraph.pl and speedscope.
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(";".join(_label(code) for code in stack) + f" {count}\n")
+
+
+def format_report(profile: Dict) -> str:
+    # Human-readable breakdown of a run record's ``profile``.
+    spans = profile.get("spans", {})
+    total = spans.get("run", {}).get("seconds", 0.0)
+    lines = [f"Phases ({total:.3f}s in total):"]
+    for name, span in sorted(spans.items(), key=lambda item: -item[1]["seconds"]):
+        if name == "run":
+            continue
+        share = f"{100 * span['seconds'] / total:5.1f}%" if total else "     -"
+        calls = f"  ({span['calls']} calls)" if span["calls"] > 1 else ""
+        lines.append(f"  {name:<24} {span['seconds']:>9.3f}s {share}{calls}")
+    counters = profile.get("counters", {})
+    if counters:
+        lines.append("Counters:")
+        lines += [f"  {name:<24} {value:>12}" for name, value in counters.items()]
+    hotspots = profile.get("hotspots", [])
+    if hotspots:
+        lines.append("Hotspots (% of busy samples, self / total):")
+        lines += [f"  {h['self']:5.1f}% {h['total']:5.1f}%  {h['function']}" for h in hotspots]
+    return "\n".join(lines)
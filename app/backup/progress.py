@@ -0,0 +1,161 @@
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+
+@dataclass
+class ProgressEvent:
+    kind: str
+    bytes_transferred: Optional[int] = None
+    percent: Optional[int] = None
+    rate: Optional[float] = None
+    files_transferred: Optional[int] = None
+    files_to_check: Optional[int] = None
+    files_total: Optional[int] = None
+    file_list_complete: bool = False
+    path: Optional[str] = None
+
+
+class Progress:
+    # Live counters for one backup run. Engines report into it from any thread; the job API
+    # reads consistent snapshots of it while the run is in flight.
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.phase = "starting"
+        self.files_done = 0
+        self.files_total = 0
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.scan_complete = False
+        self.current: Optional[str] = None
+        self.expected_sources: Optional[int] = None
+        # Absolute counters reported by external tools (rsync), one entry per source.
+        self._sources: Dict[str, ProgressEvent] = {}
+
+    def set_phase(self, phase: str) -> None:
+        with self._lock:
+            self.phase = phase
+
+    def add_found(self, size: int) -> None:
+        with self._lock:
+            self.files_total += 1
+            self.bytes_total += size
+
+    def finish_scan(self) -> None:
+        with self._lock:
+            self.scan_complete = True
+
+    def advance(self, size: int, files: int = 1) -> None:
+        with self._lock:
+            self.files_done += files
+            self.bytes_done += size
+
+    def apply(self, source: str, event: ProgressEvent) -> None:
+        with self._lock:
+            if event.kind == "file":
+                self.current = event.path
+                return
+            state = self._sources.setdefault(source, ProgressEvent("progress"))
+            for name in ("bytes_transferred", "percent", "rate", "files_transferred", "files_to_check", "files_total"):
+                value = getattr(event, name)
+                if value is not None:
+                    setattr(state, name, value)
+            state.file_list_complete = state.file_list_complete or event.file_list_complete
+
+    def _external_totals(self) -> Dict:
+        totals = {"files_done": 0, "files_total": 0, "bytes_done": 0, "bytes_total": 0}
+        for state in self._sources.values():
+            bytes_done = state.bytes_transferred or 0
+            totals["bytes_done"] += bytes_done
+            if state.percent:
+                totals["bytes_total"] += bytes_done * 100 // state.percent
+            if state.files_total is not None:
+                totals["files_total"] += state.files_total
+                totals["files_done"] += state.files_total - (state.files_to_check or 0)
+        return totals
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            external = self._external_totals()
+            files_done = self.files_done + external["files_done"]
+            files_total = self.files_total + external["files_total"]
+            bytes_done = self.bytes_done + external["bytes_done"]
+            bytes_total = self.bytes_total + external["bytes_total"]
+            scan_complete = self.scan_complete or (
+                bool(self._sources)
+                and len(self._sources) == (self.expected_sources or len(self._sources))
+                and all(state.file_list_complete for state in self._sources.values())
+            )
+            elapsed = time.monotonic() - self.started
+            rate = bytes_done / elapsed if elapsed > 0 else 0.0
+            eta: Optional[float] = None
+            if scan_complete and rate > 0:
+                eta = max(0.0, (bytes_total - bytes_done) / rate)
+            return {
+                "phase": self.phase,
+                "files_done": files_done,
+                "files_total": files_total,
+                "bytes_done": bytes_done,
+                "bytes_total": bytes_total,
+                "percent": round(100 * bytes_done / bytes_total, 1) if bytes_total else None,
+                "current": self.current,
+                "scan_complete": scan_complete,
+                "elapsed_seconds": round(elapsed, 3),
+                "rate_bytes_per_second": round(rate, 1),
+                "eta_seconds": round(eta, 1) if eta is not None else None,
+            }
+
+
+_UNITS = {"B": 1, "kB": 1e3, "KB": 1e3, "MB": 1e6, "GB": 1e9, "TB": 1e12}
+_PROGRESS2 = re.compile(
+    r"^\s*(?P<bytes>[\d,.]+)\s+(?P<percent>\d+)%\s+(?P<rate>[\d.,]+)(?P<unit>[kKMGT]?B)/s\s+\S+"
+    r"(?:\s+\(xfr#(?P<xfr>\d+),\s*(?P<chk>ir|to)-chk=(?P<remaining>\d+)/(?P<total>\d+)\))?"
+)
+_ITEMIZE = re.compile(r"^(?P<flags>[<>ch.*][fdLDS][.+cstpoguaxn?]{7,9}) (?P<path>.+)$")
+_STATS = {
+    "Number of files": "files_total",
+    "Number of regular files transferred": "files_transferred",
+    "Total file size": "bytes_total",
+    "Total transferred file size": "bytes_transferred",
+}
+
+
+def _number(text: str) -> int:
+    return int(text.replace(",", "").replace(".", ""))
+
+
+class RsyncOutputParser:
+    # Turns rsync output produced with --info=progress2 --itemize-changes --stats into
+    # ProgressEvents. Lines it does not recognise yield None; --stats totals collect in .totals.
+
+    def __init__(self) -> None:
+        self.totals: Dict[str, int] = {}
+
+    def feed(self, line: str) -> Optional[ProgressEvent]:
+        match = _PROGRESS2.match(line)
+        if match:
+            event = ProgressEvent(
+                "progress",
+                bytes_transferred=_number(match["bytes"]),
+                percent=int(match["percent"]),
+                rate=float(match["rate"].replace(",", ".")) * _UNITS[match["unit"]],
+            )
+            if match["xfr"]:
+                event.files_transferred = int(match["xfr"])
+                event.files_to_check = int(match["remaining"])
+                event.files_total = int(match["total"])
+                event.file_list_complete = match["chk"] == "to"
+            return event
+        match = _ITEMIZE.match(line)
+        if match:
+            return ProgressEvent("file", path=match["path"], files_transferred=1 if match["flags"][0] in "<>" else 0)
+        label, _, value = line.partition(":")
+        key = _STATS.get(label.strip())
+        if key is not None and value.strip():
+            self.totals[key] = _number(value.split()[0])
+            return ProgressEvent("stats")
+        return None
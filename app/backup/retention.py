@@ -1,14 +1,36 @@
 import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Set
 
+from .checkpoint import INCOMPLETE_MARKER
 from .config import RetentionRules
+from .logreader import run_context
+from .manifest import snapshot_format
+from .profiling import active_profile
 
 logger = logging.getLogger(__name__)
 
+# Pruned snapshots are renamed in here first, so they stop counting as backups at once, and
+# deleted in the background afterwards. Whatever a crash leaves behind is deleted next time.
+TRASH_DIR = ".trash"
+# Deleting is bound by metadata I/O, which the kernel overlaps well across threads.
+DEFAULT_REMOVE_WORKERS = 8
+GIB = 1024**3
 
-def parse_timestamped_dirs(base: Path) -> List[Path]:
+_purge_lock = threading.Lock()
+_purgers: Dict[Path, threading.Thread] = {}
+_purge_requested: Set[Path] = set()
+
+
+def _timestamped_dirs(base: Path) -> List[Path]:
     if not base.exists():
         return []
     backups = []
@@ -24,15 +46,30 @@ def parse_timestamped_dirs(base: Path) -> List[Path]:
     return backups
 
 
+def parse_timestamped_dirs(base: Path) -> List[Path]:
+    # Finished snapshots, newest first. Snapshots of interrupted runs are not backups: they
+    # are never linked against, listed, verified or counted by retention.
+    return [path for path in _timestamped_dirs(base) if not (path / INCOMPLETE_MARKER).exists()]
+
+
+def incomplete_snapshots(base: Path) -> List[Path]:
+    return [path for path in _timestamped_dirs(base) if (path / INCOMPLETE_MARKER).exists()]
+
+
 def enforce_retention(base: Path, rules: RetentionRules) -> None:
-    backups = parse_timestamped_dirs(base)
-    if not backups:
-        return
+    # Runs under the destination lock once a run has finished, so any snapshot still marked
+    # incomplete belongs to an earlier, interrupted run that was not resumed.
+    doomed: List[Path] = []
+    for stale in incomplete_snapshots(base):
+        logger.info("Removing incomplete backup %s", stale)
+        doomed.append(stale)
 
+    backups = parse_timestamped_dirs(base)
+    expired: List[Path] = []
     if rules.keep_last is not None and rules.keep_last >= 0:
         for old in backups[rules.keep_last :]:
             logger.info("Removing old backup %s", old)
-            remove_path(old)
+            expired.append(old)
 
     if rules.max_age_days is not None and rules.max_age_days > 0:
         cutoff = datetime.now() - timedelta(days=rules.max_age_days)
@@ -41,15 +78,190 @@ def enforce_retention(base: Path, rules: RetentionRules) -> None:
                 stamp = datetime.strptime(path.name, "%Y-%m-%d_%H-%M-%S")
             except ValueError:
                 continue
-            if stamp < cutoff:
+            if stamp < cutoff and path not in expired:
                 logger.info("Removing backup older than %s: %s", cutoff, path)
-                remove_path(path)
+                expired.append(path)
+
+    if rules.min_free_gb is not None and rules.min_free_gb > 0:
+        kept = [path for path in backups if path not in expired]
+        expired += _free_space_victims(base, kept, expired, rules.min_free_gb)
+
+    doomed += expired
+    profile = active_profile()
+    profile.count("retention.pruned", len(doomed))
+    for path in doomed:
+        move_to_trash(base, path)
+
+    # Imported here because the chunk store builds on the copier, which imports this module.
+    from .chunkstore import CHUNK_DIR, collect_garbage
+
+    if doomed and (base / CHUNK_DIR).exists():
+        with profile.span("retention.chunk_gc"):
+            collect_garbage(base, parse_timestamped_dirs(base))
+    if (base / TRASH_DIR).exists():
+        purge_trash_in_background(base)
+
+
+def _free_space_victims(base: Path, kept: List[Path], expired: List[Path], min_free_gb: float) -> List[Path]:
+    # The oldest snapshots to delete, on top of ``expired``, so that at least ``min_free_gb``
+    # is free once the trash is emptied. The space each one frees comes from the snapshot
+    # catalog rather than a walk of its tree. The newest snapshot is always kept.
+    needed = min_free_gb * GIB - shutil.disk_usage(base).free
+    if needed <= 0:
+        return []
+    # Imported here because the catalog lists snapshots through this module.
+    from .catalog import SnapshotCatalog
+
+    victims: List[Path] = []
+    remaining = list(kept)
+    try:
+        with SnapshotCatalog.open(base) as catalog:
+            if remaining:
+                catalog.sync(base, completed=remaining[0].name)
+            names = [path.name for path in remaining]
+
+            def reclaimable(snapshot: Path) -> int:
+                if snapshot_format(snapshot) == "archive":
+                    return _archive_size(snapshot)
+                try:
+                    return catalog.reclaimable_bytes(snapshot.name, names)
+                except LookupError:
+                    return 0
+
+            for path in expired:
+                needed -= reclaimable(path)
+            while needed > 0 and len(remaining) > 1:
+                oldest = remaining.pop()
+                names.pop()
+                needed -= reclaimable(oldest)
+                logger.info("Removing backup %s to keep %.1f GB free", oldest, min_free_gb)
+                victims.append(oldest)
+    except (OSError, sqlite3.Error) as exc:
+        logger.warning("Could not estimate snapshot sizes, skipping min_free_gb: %s", exc)
+        return victims
+    if needed > 0:
+        logger.warning(
+            "Only %.1f GB will be free on %s after pruning; the newest backup is always kept",
+            (min_free_gb * GIB - needed) / GIB,
+            base,
+        )
+    return victims
 
 
-def remove_path(path: Path) -> None:
-    if path.is_dir():
-        for child in path.iterdir():
-            remove_path(child)
-        path.rmdir()
-    else:
+def _archive_size(snapshot: Path) -> int:
+    # An archive snapshot is a few large files at its top, shared with no other snapshot.
+    with os.scandir(snapshot) as it:
+        return sum(entry.stat().st_size for entry in it if entry.is_file(follow_symlinks=False))
+
+
+def move_to_trash(base: Path, path: Path) -> None:
+    trash = base / TRASH_DIR
+    try:
+        # Held so a purger of this process cannot remove the empty trash folder in between.
+        with _purge_lock:
+            trash.mkdir(exist_ok=True)
+            # Same filesystem, so this is one atomic rename however large the snapshot is.
+            os.rename(path, trash / f"{path.name}.{uuid.uuid4().hex[:8]}")
+    except OSError as exc:
+        logger.warning("Could not move %s to the trash (%s); deleting it now", path, exc)
+        remove_path(path)
+
+
+def purge_trash(base: Path, max_workers: int = DEFAULT_REMOVE_WORKERS) -> int:
+    trash = base / TRASH_DIR
+    removed = 0
+    try:
+        entries = sorted(trash.iterdir())
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        started = time.monotonic()
+        try:
+            remove_path(entry, max_workers)
+        except OSError as exc:
+            logger.warning("Could not delete %s from the trash: %s", entry, exc)
+            continue
+        removed += 1
+        logger.info("Deleted %s in %.1fs", entry.name, time.monotonic() - started)
+    try:
+        with _purge_lock:
+            trash.rmdir()
+    except OSError:
+        pass  # not empty: something failed, or a newer run trashed more meanwhile
+    return removed
+
+
+def purge_trash_in_background(base: Path) -> threading.Thread:
+    # One purger thread per destination; asking again while it runs makes it rescan the trash
+    # once it is done, so nothing trashed meanwhile is left behind.
+    with _purge_lock:
+        _purge_requested.add(base)
+        thread = _purgers.get(base)
+        if thread is not None and thread.is_alive():
+            return thread
+        thread = threading.Thread(target=_purge_loop, args=(base,), name="backup-trash", daemon=True)
+        _purgers[base] = thread
+        thread.start()
+        return thread
+
+
+def _purge_loop(base: Path) -> None:
+    while True:
+        with _purge_lock:
+            if base not in _purge_requested:
+                del _purgers[base]
+                return
+            _purge_requested.discard(base)
+        purge_trash(base)
+
+
+def wait_for_trash(timeout: Optional[float] = None) -> bool:
+    # Blocks until every background purge has finished; False if ``timeout`` ran out first.
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while True:
+        with _purge_lock:
+            running = [thread for thread in _purgers.values() if thread.is_alive()]
+        if not running:
+            return True
+        remaining = deadline - time.monotonic() if deadline is not None else None
+        if remaining is not None and remaining <= 0:
+            return False
+        running[0].join(remaining)
+
+
+def _clear_dir(path: str) -> List[str]:
+    # Unlinks the files of one directory and returns its subdirectories.
+    subdirs = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+                continue
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+    return subdirs
+
+
+def remove_path(path: Path, max_workers: int = DEFAULT_REMOVE_WORKERS) -> None:
+    # Deletes a tree on a thread pool: each task scans one directory with os.scandir and unlinks
+    # its files, and the directories are removed deepest first once they are empty.
+    if path.is_symlink() or not path.is_dir():
         path.unlink(missing_ok=True)
+        return
+    dirs = [str(path)]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="backup-remove", **run_context()) as pool:
+        pending = {pool.submit(_clear_dir, dirs[0])}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for subdir in future.result():
+                    dirs.append(subdir)
+                    pending.add(pool.submit(_clear_dir, subdir))
+    # Every directory is listed after its parent, so reversed order empties children first.
+    for directory in reversed(dirs):
+        try:
+            os.rmdir(directory)
+        except FileNotFoundError:
+            pass
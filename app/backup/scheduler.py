@@ -0,0 +1,210 @@
+import json
+import logging
+import random
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, Optional
+
+from .config import BackupConfig, load_config
+from .jobs import JobBusyError
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_STATE_FILENAME = "schedule_state.json"
+POLL_INTERVAL = 60.0
+# A slot whose time passed longer ago than this (the Pi was off, the app was down) counts as
+# missed and is only run if the schedule asks for catch-up.
+MISSED_GRACE = timedelta(minutes=5)
+
+_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+}
+
+
+def _parse_field(text: str, low: int, high: int) -> FrozenSet[int]:
+    values = set()
+    for part in text.split(","):
+        body, _, step_text = part.partition("/")
+        step = int(step_text) if step_text else 1
+        if body == "*":
+            start, end = low, high
+        elif "-" in body:
+            first, last = body.split("-", 1)
+            start, end = int(first), int(last)
+        else:
+            start = int(body)
+            end = high if step_text else start
+        if step < 1 or not low <= start <= end <= high:
+            raise ValueError(f"Cron field {text!r} is out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronSpec:
+    # Standard five-field cron: minute hour day-of-month month day-of-week, with "*", lists,
+    # ranges, steps and the @daily style aliases. As in cron, when both day fields are
+    # restricted a day matching either of them is enough.
+
+    def __init__(self, text: str) -> None:
+        fields = _ALIASES.get(text.strip(), text).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron spec {text!r} must have five fields")
+        try:
+            self.minutes = _parse_field(fields[0], 0, 59)
+            self.hours = _parse_field(fields[1], 0, 23)
+            self.days = _parse_field(fields[2], 1, 31)
+            self.months = _parse_field(fields[3], 1, 12)
+            self.weekdays = frozenset(day % 7 for day in _parse_field(fields[4], 0, 7))
+        except ValueError as exc:
+            raise ValueError(f"Invalid cron spec {text!r}: {exc}") from exc
+        self.text = text
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays  # cron counts from Sunday
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment: datetime) -> datetime:
+        # Skips whole months, days and hours that cannot match, so even sparse specs take a
+        # few hundred steps at most.
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                candidate = (candidate.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron spec {self.text!r} never matches")
+
+
+class Scheduler:
+    # Background thread inside the web app that starts backups on the configured schedule.
+    # The last slot it handled is kept in a state file, so after a reboot it knows which runs
+    # were missed. Runs go through the job manager like manual ones, and the destination lock
+    # in the engine keeps them from overlapping with a CLI or cron run.
+
+    def __init__(
+        self,
+        state_path: Path,
+        submit: Callable[[BackupConfig], Any],
+        load: Callable[[], BackupConfig] = load_config,
+        clock: Callable[[], datetime] = datetime.now,
+    ) -> None:
+        self.state_path = state_path
+        self._submit = submit
+        self._load = load
+        self._clock = clock
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # The slot whose run found another job holding the destination; it is retried every
+        # poll until it starts.
+        self._deferred: Optional[datetime] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="backup-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                delay = self.tick()
+            except Exception:  # noqa: BLE001
+                logger.exception("Scheduler check failed")
+                delay = POLL_INTERVAL
+            self._stop.wait(delay)
+
+    def _read_state(self) -> Dict:
+        try:
+            with self.state_path.open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_state(self, cron: str, last_slot: datetime) -> None:
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"cron": cron, "last_slot": last_slot.isoformat()}), encoding="utf-8")
+        tmp_path.replace(self.state_path)
+
+    @staticmethod
+    def _jitter(slot: datetime, jitter_seconds: int) -> timedelta:
+        # Derived from the slot so every check agrees on when this slot fires.
+        if jitter_seconds <= 0:
+            return timedelta()
+        return timedelta(seconds=random.Random(int(slot.timestamp())).uniform(0, jitter_seconds))
+
+    def tick(self) -> float:
+        # One scheduling decision; returns how long to sleep before the next one. The config
+        # is re-read every time, so schedule edits apply within a poll interval.
+        config = self._load()
+        rules = config.schedule
+        if not rules.cron:
+            return POLL_INTERVAL
+        try:
+            spec = CronSpec(rules.cron)
+        except ValueError as exc:
+            logger.error("Backup schedule disabled: %s", exc)
+            return POLL_INTERVAL
+
+        now = self._clock()
+        state = self._read_state()
+        if state.get("cron") != rules.cron or "last_slot" not in state:
+            # A new or changed schedule starts counting from now; nothing before it was missed.
+            self._write_state(rules.cron, now)
+            last_slot = now
+        else:
+            last_slot = datetime.fromisoformat(state["last_slot"])
+
+        slot = spec.next_after(last_slot)
+        fire_at = slot + self._jitter(slot, rules.jitter_seconds)
+        if now < fire_at:
+            return min(POLL_INTERVAL, (fire_at - now).total_seconds())
+
+        late = now - fire_at > MISSED_GRACE
+        # A slot put off by a running job was not missed, however long that job takes.
+        missed = late and slot != self._deferred
+        if missed and not rules.catch_up:
+            logger.warning("Skipping scheduled backup missed at %s (catch_up is off)", slot)
+        else:
+            if missed:
+                logger.info("Catching up on scheduled backup missed at %s", slot)
+            elif slot != self._deferred:
+                logger.info("Starting scheduled backup for %s", slot)
+            try:
+                self._submit(config)
+            except JobBusyError as exc:
+                # The slot stays unhandled in the state file, so the next poll tries again.
+                if slot != self._deferred:
+                    logger.warning("Scheduled backup for %s waits for the running job: %s", slot, exc)
+                self._deferred = slot
+                return POLL_INTERVAL
+        self._deferred = None
+        # Several missed slots collapse into the single catch-up run above.
+        self._write_state(rules.cron, now if late else slot)
+        return 0.0
@@ -0,0 +1,284 @@
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+from .config import ThrottleRules
+
+logger = logging.getLogger(__name__)
+
+IONICE_CLASSES = {"best-effort": 2, "idle": 3}
+# How often the adaptive mode samples the system, and how far it may slow a run down.
+ADAPT_INTERVAL = 2.0
+MIN_FACTOR = 0.05
+BACKOFF = 0.5
+SPEEDUP = 1.25
+# A paused rsync is stopped and continued within periods this long (see pace_process).
+PACE_PERIOD = 1.0
+
+
+def check_throttle(rules: ThrottleRules) -> None:
+    if rules.bwlimit_kib is not None and rules.bwlimit_kib <= 0:
+        raise ValueError("throttle.bwlimit_kib must be a positive number of KiB/s")
+    if rules.nice is not None and not 0 <= rules.nice <= 19:
+        raise ValueError("throttle.nice must be between 0 and 19")
+    if rules.ionice_class is not None and rules.ionice_class not in IONICE_CLASSES:
+        raise ValueError(f"throttle.ionice_class must be one of {', '.join(IONICE_CLASSES)}")
+    if rules.ionice_level is not None and not 0 <= rules.ionice_level <= 7:
+        raise ValueError("throttle.ionice_level must be between 0 and 7")
+    # Zero or negative limits would keep the adaptive mode busy forever (never idle again),
+    # and an I/O wait above 100% is never reached.
+    if not 0 < rules.max_iowait_percent <= 100:
+        raise ValueError("throttle.max_iowait_percent must be above 0 and at most 100")
+    if not rules.max_load_per_cpu > 0:
+        raise ValueError("throttle.max_load_per_cpu must be a positive number")
+
+
+class TokenBucket:
+    # Shared byte budget for every copy worker of a run. Callers report what they moved after
+    # the fact; a worker that overdraws the bucket sleeps off its share of the debt, so the
+    # workers together stay at ``rate`` bytes/s with bursts of at most ``burst`` bytes.
+    # A rate of None means unlimited.
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None) -> None:
+        self._lock = threading.Lock()
+        self._rate = rate
+        self._burst = burst
+        self._tokens = self._capacity()
+        self._stamp = time.monotonic()
+        self.consumed = 0
+
+    def _capacity(self) -> float:
+        if self._rate is None:
+            return 0.0
+        # One second's worth by default: smooth enough for the SD card, coarse enough that
+        # workers are not woken for every buffer.
+        return self._burst if self._burst is not None else self._rate
+
+    @property
+    def rate(self) -> Optional[float]:
+        return self._rate
+
+    @property
+    def limited(self) -> bool:
+        return self._rate is not None
+
+    def set_rate(self, rate: Optional[float]) -> None:
+        with self._lock:
+            self._refill()
+            self._rate = rate
+            self._tokens = min(self._tokens, self._capacity())
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self._rate is not None:
+            self._tokens = min(self._capacity(), self._tokens + (now - self._stamp) * self._rate)
+        self._stamp = now
+
+    def consume(self, size: int) -> None:
+        with self._lock:
+            self.consumed += size
+            if self._rate is None:
+                return
+            self._refill()
+            self._tokens -= size
+            delay = -self._tokens / self._rate if self._tokens < 0 else 0.0
+        if delay > 0:
+            time.sleep(delay)
+
+
+@dataclass
+class LoadSample:
+    # Share of CPU time spent waiting for I/O since the previous sample (0-1), and the
+    # 1-minute load average per CPU core.
+    iowait: float
+    load: float
+
+
+def _cpu_times() -> Optional[Tuple[int, int]]:
+    # (iowait, total) jiffies from the aggregate "cpu" line of /proc/stat.
+    try:
+        with open("/proc/stat", "r", encoding="ascii") as f:
+            fields = f.readline().split()
+    except OSError:
+        return None
+    if len(fields) < 6 or fields[0] != "cpu":
+        return None
+    values = [int(value) for value in fields[1:]]
+    return values[4], sum(values)
+
+
+class LoadMonitor:
+    def __init__(self) -> None:
+        self._last = _cpu_times()
+
+    def sample(self) -> LoadSample:
+        current = _cpu_times()
+        iowait = 0.0
+        if current is not None and self._last is not None and current[1] > self._last[1]:
+            iowait = (current[0] - self._last[0]) / (current[1] - self._last[1])
+        self._last = current
+        try:
+            load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        except OSError:
+            load = 0.0
+        return LoadSample(iowait, load)
+
+
+class Throttle:
+    # Everything that keeps a run from starving the Pi's other services: the bandwidth cap
+    # shared by the copy workers, the process priority, and the adaptive mode, which scales
+    # the cap down while I/O wait or load is above the configured limits and back up once
+    # the system is idle again. Without a cap the adaptive mode throttles relative to the
+    # fastest rate the run has reached.
+
+    def __init__(self, rules: ThrottleRules, monitor: Optional[LoadMonitor] = None) -> None:
+        self.rules = rules
+        self.base_rate = rules.bwlimit_kib * 1024 if rules.bwlimit_kib else None
+        self.bucket = TokenBucket(self.base_rate)
+        self.factor = 1.0
+        self._monitor = monitor
+        self._peak = 0.0
+        self._last_consumed = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def limiter(self) -> Optional[TokenBucket]:
+        # What the Python engines charge their bytes to. Without a cap or the adaptive mode
+        # (which needs the byte count) there is nothing to charge, and passing None keeps
+        # kernel copies in KERNEL_CHUNK pieces and off the bucket's lock.
+        return self.bucket if self.bucket.limited or self.rules.adaptive else None
+
+    @property
+    def rsync_args(self) -> List[str]:
+        # rsync's --bwlimit unit is KiB/s, the same as the config's.
+        return [f"--bwlimit={self.rules.bwlimit_kib}"] if self.rules.bwlimit_kib else []
+
+    def apply_priority(self) -> None:
+        # Applied to the calling thread only, which is the run's own (a job thread, or the
+        # CLI's main thread): worker threads and rsync processes it starts afterwards inherit
+        # both the nice value and the I/O priority, while the web server keeps its own.
+        tid = threading.get_native_id()
+        if self.rules.nice is not None and hasattr(os, "setpriority"):
+            try:
+                current = os.getpriority(os.PRIO_PROCESS, tid)
+                # Lowering niceness again needs privileges, so never try.
+                if self.rules.nice > current:
+                    os.setpriority(os.PRIO_PROCESS, tid, self.rules.nice)
+            except OSError as exc:
+                logger.warning("Could not set the backup's nice value: %s", exc)
+        if self.rules.ionice_class is not None:
+            self._apply_ionice(tid)
+
+    def _apply_ionice(self, tid: int) -> None:
+        # Python has no ioprio_set(), and its syscall number differs per architecture, so
+        # util-linux's ionice does it; on Linux -p accepts a thread id.
+        ionice = shutil.which("ionice")
+        if ionice is None:
+            logger.warning("ionice is not installed; backup I/O priority left unchanged")
+            return
+        cmd = [ionice, "-c", str(IONICE_CLASSES[self.rules.ionice_class])]
+        if self.rules.ionice_class == "best-effort" and self.rules.ionice_level is not None:
+            cmd += ["-n", str(self.rules.ionice_level)]
+        cmd += ["-p", str(tid)]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            logger.warning("Could not set the backup's I/O priority: %s", result.stderr.strip())
+
+    def adjust(self, sample: LoadSample, elapsed: float) -> None:
+        # One step of the adaptive mode; ``elapsed`` is the time since the previous step.
+        consumed = self.bucket.consumed
+        if elapsed > 0:
+            self._peak = max(self._peak, (consumed - self._last_consumed) / elapsed)
+        self._last_consumed = consumed
+        busy = sample.iowait * 100 > self.rules.max_iowait_percent or sample.load > self.rules.max_load_per_cpu
+        idle = sample.iowait * 100 < self.rules.max_iowait_percent / 2 and sample.load < self.rules.max_load_per_cpu * 0.75
+        factor = self.factor
+        if busy:
+            factor = max(MIN_FACTOR, factor * BACKOFF)
+        elif idle:
+            factor = min(1.0, factor * SPEEDUP)
+        if factor == self.factor:
+            return
+        logger.info(
+            "System %s (I/O wait %.0f%%, load %.2f per CPU): backup speed now %.0f%%",
+            "busy" if busy else "idle",
+            sample.iowait * 100,
+            sample.load,
+            factor * 100,
+        )
+        self.factor = factor
+        base = self.base_rate if self.base_rate is not None else self._peak
+        if factor >= 1.0:
+            self.bucket.set_rate(self.base_rate)
+        elif base > 0:
+            self.bucket.set_rate(base * factor)
+
+    def _adapt(self) -> None:
+        monitor = self._monitor or LoadMonitor()
+        last = time.monotonic()
+        while not self._stop.wait(ADAPT_INTERVAL):
+            now = time.monotonic()
+            self.adjust(monitor.sample(), now - last)
+            last = now
+
+    @contextmanager
+    def running(self) -> Iterator["Throttle"]:
+        if self.rules.adaptive:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._adapt, name="backup-throttle", daemon=True)
+            self._thread.start()
+        try:
+            yield self
+        finally:
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join(timeout=5)
+                self._thread = None
+
+    @contextmanager
+    def pace_process(self, proc: subprocess.Popen) -> Iterator[None]:
+        # rsync's --bwlimit is fixed for the whole run, so the adaptive mode slows it down by
+        # stopping and continuing it: within every PACE_PERIOD it runs for ``factor`` of it.
+        # The caller must leave this block before it waits for ``proc``: the pacer only signals
+        # a process it has just seen running, and no one else may reap it in between, or the
+        # signal could hit an unrelated process that got the PID.
+        if not self.rules.adaptive:
+            yield
+            return
+        done = threading.Event()
+        lock = threading.Lock()
+
+        def signal_running(sig: int) -> bool:
+            with lock:
+                if proc.poll() is not None:
+                    return False
+                proc.send_signal(sig)
+                return True
+
+        def pace() -> None:
+            while not done.is_set():
+                if self.factor >= 1.0:
+                    done.wait(PACE_PERIOD)
+                    continue
+                if not signal_running(signal.SIGSTOP):
+                    return
+                done.wait(PACE_PERIOD * (1.0 - self.factor))
+                signal_running(signal.SIGCONT)
+                done.wait(PACE_PERIOD * self.factor)
+
+        thread = threading.Thread(target=pace, name="rsync-pacer", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            # Without a timeout: the pacer must be done with ``proc`` before it is waited for.
+            thread.join()
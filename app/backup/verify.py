@@ -0,0 +1,408 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .archive import SNAPSHOT_FORMAT as ARCHIVE_FORMAT, ArchiveReader, CorruptArchiveError
+from .chunkstore import CHUNK_DIR, SNAPSHOT_FORMAT as CHUNK_FORMAT, ChunkStore
+from .copier import QUEUE_DEPTH_PER_WORKER
+from .fastcopy import hash_file
+from .logreader import run_context
+from .manifest import (
+    ENGINE_FILE_PREFIX,
+    ManifestCursor,
+    ManifestWriter,
+    OrderedWriter,
+    read_manifest,
+    read_manifest_header,
+)
+from .packs import iter_packs, read_members
+from .progress import Progress
+
+logger = logging.getLogger(__name__)
+
+HASH_ALGORITHM = "sha256"
+# Hashing is CPU-bound and hashlib releases the GIL on large buffers, so threads use every core.
+DEFAULT_VERIFY_WORKERS = os.cpu_count() or 1
+# Problems listed by name in a report; the counters keep counting past it.
+MAX_REPORTED_PROBLEMS = 100
+
+# (st_dev, st_ino, size, mtime_ns) -> sha256 of files already hashed in this verification,
+# so a file hard-linked into many snapshots is only read once.
+InodeCache = Dict[Tuple[int, int, int, int], str]
+
+
+class _Pool:
+    # Thread pool with a bounded backlog: at most workers * QUEUE_DEPTH_PER_WORKER files are
+    # queued or in flight, each hashed through one fixed-size buffer, so memory stays flat
+    # however large the snapshot is.
+
+    # Workers handle the OSErrors they expect; any other exception is logged and counted in
+    # ``errors``, since nothing else reads the futures.
+
+    def __init__(self, workers: int, name: str) -> None:
+        workers = max(1, workers)
+        self._slots = threading.BoundedSemaphore(workers * QUEUE_DEPTH_PER_WORKER)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name, **run_context())
+        self._lock = threading.Lock()
+        self.errors = 0
+
+    def submit(self, fn: Callable, *args) -> None:
+        self._slots.acquire()
+        self._executor.submit(fn, *args).add_done_callback(lambda future: self._done(future, args))
+
+    def _done(self, future: Future, args: Tuple) -> None:
+        self._slots.release()
+        exc = future.exception()
+        if exc is not None:
+            logger.error("Failed to check %s: %r", args[0], exc, exc_info=exc)
+            with self._lock:
+                self.errors += 1
+
+    def __enter__(self) -> "_Pool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._executor.shutdown(wait=True)
+
+
+def iter_snapshot_files(snapshot: Path) -> Iterator[Tuple[str, os.stat_result]]:
+    # Regular files under the snapshot as ("<source name>/<relative path>", lstat), skipping
+    # the engine's own files at the top. In path order (manifest.path_key), like the engine's
+    # source walk.
+    pending = [("", _sorted_entries(str(snapshot)))]
+    while pending:
+        rel_root, entries = pending[-1]
+        entry = next(entries, None)
+        if entry is None:
+            pending.pop()
+            continue
+        if not rel_root and entry.name.startswith(ENGINE_FILE_PREFIX):
+            continue
+        rel = f"{rel_root}/{entry.name}" if rel_root else entry.name
+        if entry.is_dir(follow_symlinks=False):
+            pending.append((rel, _sorted_entries(entry.path)))
+        elif entry.is_file(follow_symlinks=False):
+            yield rel, entry.stat(follow_symlinks=False)
+
+
+def _sorted_entries(dir_path: str) -> Iterator[os.DirEntry]:
+    with os.scandir(dir_path) as it:
+        return iter(sorted(it, key=lambda entry: entry.name))
+
+
+def build_manifest(
+    snapshot: Path,
+    previous: Optional[Path] = None,
+    max_workers: int = DEFAULT_VERIFY_WORKERS,
+    progress: Optional[Progress] = None,
+) -> Tuple[int, int, int]:
+    # Hash manifest for a snapshot written by an engine that cannot hash while it copies
+    # (rsync). Files hard-linked from ``previous`` (same inode, size and mtime) take their hash
+    # from its manifest, merge-walked alongside the sorted walk; only the rest is read. The
+    # manifest is written in walk order too, for the next run. Returns (files hashed, hashes
+    # reused, files that could not be hashed and so are missing from the manifest).
+    writer = ManifestWriter(snapshot, "directory")
+    ordered = OrderedWriter(writer)
+    previous_entries = ManifestCursor(previous)
+    counts = {"hashed": 0, "reused": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def hash_and_record(slot: int, rel: str, stat: os.stat_result) -> None:
+        entry = None
+        try:
+            entry = _entry(rel, stat, hash_file(snapshot / rel))
+        except OSError as exc:
+            logger.error("Cannot hash %s: %s", snapshot / rel, exc)
+            with lock:
+                counts["failed"] += 1
+            return
+        finally:
+            # Filled whatever happens, or every later entry would wait for this one.
+            ordered.fill(slot, entry)
+        with lock:
+            counts["hashed"] += 1
+        if progress is not None:
+            progress.advance(stat.st_size)
+
+    try:
+        with _Pool(max_workers, "backup-hash") as pool:
+            for rel, stat in iter_snapshot_files(snapshot):
+                if progress is not None:
+                    progress.add_found(stat.st_size)
+                entry = previous_entries.get(rel)
+                if entry is not None and entry.get(HASH_ALGORITHM) and _same_file(entry, stat, previous / rel):
+                    ordered.write(_entry(rel, stat, entry[HASH_ALGORITHM]))
+                    counts["reused"] += 1
+                    if progress is not None:
+                        progress.advance(stat.st_size)
+                    continue
+                pool.submit(hash_and_record, ordered.reserve(), rel, stat)
+            if progress is not None:
+                progress.finish_scan()
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        previous_entries.close()
+    writer.close()
+    return counts["hashed"], counts["reused"], counts["failed"] + pool.errors
+
+
+def _entry(rel: str, stat: os.stat_result, digest: str) -> Dict:
+    return {"path": rel, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino, "sha256": digest}
+
+
+def _same_file(entry: Dict, stat: os.stat_result, previous_path: Path) -> bool:
+    if entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+        return False
+    inode = entry.get("inode")
+    if inode is None:
+        # Manifests written by the Python engine do not record the inode.
+        try:
+            inode = previous_path.stat().st_ino
+        except OSError:
+            return False
+    return inode == stat.st_ino
+
+
+@dataclass
+class VerifyReport:
+    snapshot: str
+    files_checked: int = 0
+    files_cached: int = 0
+    bytes_hashed: int = 0
+    missing: List[str] = field(default_factory=list)
+    corrupt: List[str] = field(default_factory=list)
+    missing_count: int = 0
+    corrupt_count: int = 0
+    # Files or chunks left unchecked because a worker failed unexpectedly (see the log).
+    errors: int = 0
+    elapsed: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @property
+    def ok(self) -> bool:
+        return not self.missing_count and not self.corrupt_count and not self.errors
+
+    def _problem(self, kind: str, path: str) -> None:
+        with self._lock:
+            if kind == "missing":
+                self.missing_count += 1
+                problems = self.missing
+            else:
+                self.corrupt_count += 1
+                problems = self.corrupt
+            if len(problems) < MAX_REPORTED_PROBLEMS:
+                problems.append(path)
+
+    def to_dict(self) -> Dict:
+        return {
+            "snapshot": self.snapshot,
+            "ok": self.ok,
+            "files_checked": self.files_checked,
+            "files_cached": self.files_cached,
+            "bytes_hashed": self.bytes_hashed,
+            "missing_count": self.missing_count,
+            "corrupt_count": self.corrupt_count,
+            "errors": self.errors,
+            "missing": self.missing,
+            "corrupt": self.corrupt,
+            "elapsed": round(self.elapsed, 3),
+        }
+
+    def __str__(self) -> str:
+        if self.ok:
+            return f"{self.snapshot}: {self.files_checked} files verified"
+        text = f"{self.snapshot}: {self.corrupt_count} corrupt and {self.missing_count} missing of {self.files_checked} files"
+        return text + (f", {self.errors} not checked" if self.errors else "")
+
+
+def verify_snapshot(
+    snapshot: Path,
+    max_workers: int = DEFAULT_VERIFY_WORKERS,
+    progress: Optional[Progress] = None,
+    cache: Optional[InodeCache] = None,
+) -> VerifyReport:
+    # Re-reads a snapshot and compares it against its manifest. Directory snapshots are checked
+    # file by file, reading each pack once for packed files; chunk snapshots by re-hashing
+    # every chunk they reference; archive snapshots by decompressing the archive (blocks in
+    # parallel) and hashing each member. Pass the same
+    # ``cache`` when verifying several snapshots so shared hard links are read only once.
+    header = read_manifest_header(snapshot)
+    if header is None:
+        raise ValueError(f"Snapshot {snapshot.name} has no manifest to verify against")
+    report = VerifyReport(snapshot=snapshot.name)
+    started = time.monotonic()
+    if header.get("format") == CHUNK_FORMAT:
+        _verify_chunks(snapshot, max_workers, progress, report)
+    elif header.get("format") == ARCHIVE_FORMAT:
+        _verify_archive(snapshot, max_workers, progress, report)
+    else:
+        _verify_files(snapshot, max_workers, progress, report, cache if cache is not None else {})
+    if progress is not None:
+        progress.finish_scan()
+    report.elapsed = time.monotonic() - started
+    if report.ok:
+        logger.info("Verified %s: %d files OK in %.1fs", snapshot, report.files_checked, report.elapsed)
+    else:
+        logger.error(
+            "Verification of %s failed: %d corrupt (%s), %d missing (%s), %d not checked",
+            snapshot,
+            report.corrupt_count,
+            ", ".join(report.corrupt[:10]),
+            report.missing_count,
+            ", ".join(report.missing[:10]),
+            report.errors,
+        )
+    return report
+
+
+def _verify_files(
+    snapshot: Path, max_workers: int, progress: Optional[Progress], report: VerifyReport, cache: InodeCache
+) -> None:
+    lock = threading.Lock()
+
+    def check(rel: str, expected: str, key: Tuple[int, int, int, int]) -> None:
+        try:
+            digest = hash_file(snapshot / rel)
+        except OSError as exc:
+            logger.error("Cannot read %s: %s", snapshot / rel, exc)
+            report._problem("corrupt", rel)
+            return
+        with lock:
+            report.bytes_hashed += key[2]
+            cache[key] = digest
+        if digest != expected:
+            report._problem("corrupt", rel)
+        if progress is not None:
+            progress.advance(key[2])
+
+    def check_pack(pack: str, members: List[Dict]) -> None:
+        members.sort(key=lambda entry: entry["offset"])
+        checked = 0
+        try:
+            for entry, data in read_members(snapshot, pack, members):
+                checked += 1
+                with lock:
+                    report.bytes_hashed += len(data)
+                if len(data) != entry["size"] or hashlib.sha256(data).hexdigest() != entry[HASH_ALGORITHM]:
+                    report._problem("corrupt", entry["path"])
+                if progress is not None:
+                    progress.advance(entry["size"])
+        except OSError as exc:
+            logger.error("Cannot read pack %s: %s", pack, exc)
+            for entry in members[checked:]:
+                report._problem("missing", entry["path"])
+
+    # Packed files are checked against the pack index, which carries the same hashes as the
+    # manifest: streamed one pack at a time, so memory does not grow with their number.
+    packed = indexed = 0
+    with _Pool(max_workers, "backup-verify") as pool:
+        for entry in read_manifest(snapshot):
+            rel = entry["path"]
+            report.files_checked += 1
+            if progress is not None:
+                progress.add_found(entry["size"])
+            if entry.get("packed"):
+                packed += 1
+                continue
+            try:
+                stat = os.stat(snapshot / rel)
+            except OSError:
+                report._problem("missing", rel)
+                continue
+            if stat.st_size != entry["size"]:
+                report._problem("corrupt", rel)
+                continue
+            key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            with lock:
+                digest = cache.get(key)
+            if digest is not None:
+                report.files_cached += 1
+                if digest != entry[HASH_ALGORITHM]:
+                    report._problem("corrupt", rel)
+                if progress is not None:
+                    progress.advance(stat.st_size)
+                continue
+            pool.submit(check, rel, entry[HASH_ALGORITHM], key)
+        for pack, members in iter_packs(snapshot):
+            indexed += len(members)
+            pool.submit(check_pack, pack, members)
+    report.errors += pool.errors
+    if indexed < packed:
+        # Which ones cannot be told without holding every packed path; the count still fails
+        # the verification.
+        logger.error("%d packed files of %s are missing from its pack index", packed - indexed, snapshot)
+        report.errors += packed - indexed
+
+
+def _verify_chunks(snapshot: Path, max_workers: int, progress: Optional[Progress], report: VerifyReport) -> None:
+    store = ChunkStore(snapshot.parent / CHUNK_DIR)
+    digests = set()
+    for entry in read_manifest(snapshot):
+        digests.update(entry["chunks"])
+    bad = set()
+    lock = threading.Lock()
+
+    def check(digest: str) -> None:
+        path = store.chunk_path(digest)
+        try:
+            actual = hash_file(path)
+            size = path.stat().st_size
+        except OSError:
+            actual, size = None, 0
+        with lock:
+            report.bytes_hashed += size
+            if actual != digest:
+                bad.add(digest)
+        if progress is not None:
+            progress.advance(size)
+
+    with _Pool(max_workers, "backup-verify") as pool:
+        for digest in digests:
+            if progress is not None:
+                progress.add_found(0)
+            pool.submit(check, digest)
+    report.errors += pool.errors
+
+    for entry in read_manifest(snapshot):
+        report.files_checked += 1
+        damaged = [d for d in entry["chunks"] if d in bad]
+        if damaged:
+            kind = "missing" if not all(store.chunk_path(d).exists() for d in damaged) else "corrupt"
+            report._problem(kind, entry["path"])
+
+
+def _verify_archive(snapshot: Path, max_workers: int, progress: Optional[Progress], report: VerifyReport) -> None:
+    try:
+        reader = ArchiveReader(snapshot, read_ahead=max(1, max_workers))
+    except OSError:
+        for entry in read_manifest(snapshot):
+            report.files_checked += 1
+            report._problem("missing", entry["path"])
+        return
+    with reader:
+        # Members are in archive order, so the read-ahead decompresses each block once.
+        for entry in read_manifest(snapshot):
+            report.files_checked += 1
+            if progress is not None:
+                progress.add_found(entry["size"])
+            hasher = hashlib.sha256()
+            try:
+                for piece in reader.read(entry["offset"], entry["size"]):
+                    hasher.update(piece)
+            except CorruptArchiveError as exc:
+                logger.error("Cannot read %s from %s: %s", entry["path"], snapshot, exc)
+                report._problem("corrupt", entry["path"])
+                continue
+            report.bytes_hashed += entry["size"]
+            if hasher.hexdigest() != entry[HASH_ALGORITHM]:
+                report._problem("corrupt", entry["path"])
+            if progress is not None:
+                progress.advance(entry["size"])
@@ -0,0 +1,272 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import sqlite3
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .config import load_config
+from .filesystem import normalize_selection
+from .journal import HEARTBEAT_TIMEOUT, ChangeJournal
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+)
+_EVENT_HEADER = struct.Struct("iIII")
+# Changes are batched into one journal transaction at most this often, and the watcher
+# checks the config and writes its heartbeat on this period.
+FLUSH_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = HEARTBEAT_TIMEOUT / 3
+# Pause before watching starts over after the watcher failed (e.g. the journal was locked).
+RESTART_DELAY = 5.0
+
+
+class WatchError(OSError):
+    pass
+
+
+class Inotify:
+    # Thin ctypes binding to the Linux inotify API: one watch per directory, events read as
+    # packed inotify_event structs.
+
+    def __init__(self) -> None:
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        try:
+            self._libc = ctypes.CDLL(libc_name, use_errno=True)
+            init = self._libc.inotify_init1
+        except (OSError, AttributeError) as exc:
+            raise WatchError(errno.ENOSYS, "inotify is not available on this system") from exc
+        self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise WatchError(error, os.strerror(error))
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise WatchError(error, f"{os.strerror(error)}: {path}")
+        return wd
+
+    def read(self, timeout: float) -> List[Tuple[int, int, str]]:
+        # Returns (wd, mask, name) tuples, waiting up to ``timeout`` seconds for the first one.
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class ChangeWatcher:
+    # Watches every directory under the selected paths and records changed paths in the
+    # change journal. Directories created or moved in are recorded as a whole (the next run
+    # walks them) and watched from then on. Anything that may lose events invalidates the
+    # journal instead: a kernel queue overflow, running out of watches, the sources changing.
+
+    def __init__(
+        self,
+        journal_path: Optional[Path] = None,
+        sources: Optional[Callable[[], List[str]]] = None,
+    ) -> None:
+        self.journal_path = journal_path
+        self._sources = sources or (lambda: normalize_selection(load_config().selected_paths))
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._paths: Dict[int, str] = {}
+        self._pending: Set[str] = set()
+        self._degraded = False
+        # Set once every directory is watched and the journal knows it; cleared while
+        # watching (re)starts.
+        self.ready = threading.Event()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="change-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _watch_tree(self, inotify: Inotify, root: str, recursive: bool = True) -> bool:
+        # Returns False when the watch limit was hit (fs.inotify.max_user_watches).
+        pending = [root]
+        while pending:
+            path = pending.pop()
+            try:
+                self._paths[inotify.add_watch(path)] = path
+            except WatchError as exc:
+                if exc.errno == errno.ENOSPC:
+                    logger.error("Out of inotify watches at %s; raise fs.inotify.max_user_watches", path)
+                    return False
+                continue  # vanished or unreadable; a later event on its parent covers it
+            if not recursive:
+                continue
+            try:
+                with os.scandir(path) as it:
+                    pending.extend(e.path for e in it if e.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+        return True
+
+    def _handle(self, inotify: Inotify, journal: ChangeJournal, wd: int, mask: int, name: str) -> None:
+        if mask & IN_Q_OVERFLOW:
+            journal.invalidate("inotify event queue overflowed")
+            return
+        if mask & IN_IGNORED:
+            self._paths.pop(wd, None)
+            return
+        parent = self._paths.get(wd)
+        if parent is None:
+            return
+        path = f"{parent}/{name}" if name else parent
+        self._pending.add(path)
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            if not self._watch_tree(inotify, path) and not self._degraded:
+                self._degraded = True
+                journal.invalidate("ran out of inotify watches", degraded=True)
+
+    def run(self) -> None:
+        journal = ChangeJournal.open(self.journal_path) if self.journal_path else ChangeJournal.open()
+        if journal is None:
+            return
+        try:
+            restart = True
+            while restart and not self._stop.is_set():
+                try:
+                    inotify = Inotify()
+                except WatchError as exc:
+                    logger.error("Change watcher not started: %s", exc)
+                    return
+                try:
+                    restart = self._watch_loop(inotify, journal)
+                except Exception as exc:  # noqa: BLE001
+                    # Dying here would leave a journal that looks healthy but records
+                    # nothing, and runs trusting it would skip changed files.
+                    logger.exception("Change watcher failed; restarting it")
+                    self._fail(journal, exc)
+                    restart = not self._stop.wait(RESTART_DELAY)
+                finally:
+                    inotify.close()
+        finally:
+            self.ready.clear()
+            journal.close()
+
+    def _fail(self, journal: ChangeJournal, exc: Exception) -> None:
+        # Until watching has started over, the journal is not trusted; starting over bumps the
+        # epoch, so the next run does a full scan either way. If the journal cannot even be
+        # written now, its heartbeat stops, which has the same effect.
+        self.ready.clear()
+        try:
+            journal.invalidate(f"the change watcher failed: {exc}", degraded=True)
+        except sqlite3.Error as error:
+            logger.error("Cannot mark the change journal degraded: %s", error)
+
+    def _watch_loop(self, inotify: Inotify, journal: ChangeJournal) -> bool:
+        # Returns True when the selected paths changed and watching has to start over.
+        self.ready.clear()
+        self._paths.clear()
+        self._pending.clear()
+        self._degraded = False
+        sources = sorted(self._sources())
+        for src in sources:
+            if os.path.isdir(src):
+                complete = self._watch_tree(inotify, src)
+            else:
+                # A single selected file: watch its directory; unrelated siblings are ignored
+                # by the engine since they are outside the sources.
+                complete = self._watch_tree(inotify, os.path.dirname(src), recursive=False)
+            if not complete:
+                self._degraded = True
+                break
+        # Whatever happened while no watcher was running is unknown.
+        journal.invalidate(
+            f"change watcher started on {len(sources)} path(s), {len(self._paths)} directories", degraded=self._degraded
+        )
+        self.ready.set()
+        last_flush = last_heartbeat = time.monotonic()
+        while not self._stop.is_set():
+            for wd, mask, name in inotify.read(FLUSH_INTERVAL):
+                self._handle(inotify, journal, wd, mask, name)
+            now = time.monotonic()
+            if self._pending and now - last_flush >= FLUSH_INTERVAL:
+                journal.record(sorted(self._pending))
+                self._pending.clear()
+                last_flush = last_heartbeat = now
+            if now - last_heartbeat >= HEARTBEAT_INTERVAL:
+                if sorted(self._sources()) != sources:
+                    logger.info("Selected paths changed; restarting the change watcher")
+                    return True
+                journal.heartbeat()
+                last_heartbeat = now
+        if self._pending:
+            journal.record(sorted(self._pending))
+        return False
+
+
+def main() -> None:
+    from .engine import configure_logging
+
+    configure_logging()
+    watcher = ChangeWatcher()
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,14 @@ from pathlib import Path
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 
-from .api import api_router
+from .api import api_router, metrics_router
 from .views import view_router, templates
-from .backup.config import get_config_dir, ensure_default_config
-from .backup.engine import LOG_DIR, configure_logging
+from .backup.config import get_config_dir, ensure_default_config, load_config
+from .backup.dirsizes import DirSizeIndexer
+from .backup.engine import LOG_DIR, configure_logging, run_backup
+from .backup.jobs import job_manager
+from .backup.scheduler import SCHEDULE_STATE_FILENAME, Scheduler
+from .backup.watcher import ChangeWatcher
 
 
 configure_logging()
@@ -22,12 +26,35 @@ app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
 app.include_router(view_router)
 app.include_router(api_router, prefix="/api")
+app.include_router(metrics_router)
+
+
+def _start_scheduled_backup(config):
+    return job_manager.submit("backup", config.destination, lambda progress: run_backup(config, progress=progress))
+
+
+scheduler = Scheduler(LOG_DIR / SCHEDULE_STATE_FILENAME, _start_scheduled_backup)
+watcher = ChangeWatcher()
+size_indexer = DirSizeIndexer()
 
 
 @app.on_event("startup")
 async def startup_event() -> None:
     logging.getLogger(__name__).info("Pi Backup Manager started. Config dir: %s", get_config_dir())
     LOG_DIR.mkdir(parents=True, exist_ok=True)
+    if os.environ.get("PI_BACKUP_SCHEDULER", "1") != "0":
+        scheduler.start()
+    if load_config().watch_changes:
+        watcher.start()
+    if os.environ.get("PI_BACKUP_SIZE_INDEXER", "1") != "0":
+        size_indexer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event() -> None:
+    scheduler.stop()
+    watcher.stop()
+    size_indexer.stop()
 
 
 if __name__ == "__main__":
@@ -1,14 +1,24 @@
 import json
 import logging
 from pathlib import Path
+from typing import Literal, Optional
 
 from fastapi import APIRouter, Form, Request
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 
 from .backup.config import BackupConfig, load_config, save_config
-from .backup.engine import LOG_FILE, LOG_DIR, run_backup
-from .backup.filesystem import list_directory, normalize_selection, UnsafePathError
+from .backup.dirsizes import selection_total
+from .backup.engine import LOG_BACKUP_COUNT, LOG_FILE, LOG_DIR, run_backup
+from .backup.filesystem import (
+    DEFAULT_PAGE_SIZE,
+    InvalidCursorError,
+    UnsafePathError,
+    browse_directory,
+    normalize_selection,
+)
+from .backup.jobs import JobBusyError, job_manager
+from .backup.logreader import LogQuery, read_logs
 
 BASE_PATH = Path(__file__).parent
 TEMPLATE_DIR = BASE_PATH / "templates"
@@ -22,18 +32,30 @@ logger = logging.getLogger(__name__)
 async def index(request: Request) -> HTMLResponse:
     config = load_config()
     return templates.TemplateResponse(
-        "index.html", {"request": request, "config": config}
+        "index.html", {"request": request, "config": config, "job": job_manager.active()}
     )
 
 
 @view_router.get("/browse", response_class=HTMLResponse)
-async def browse(request: Request, path: str | None = None, error: str | None = None) -> HTMLResponse:
+def browse(
+    request: Request,
+    path: str | None = None,
+    error: str | None = None,
+    cursor: str | None = None,
+    sort: Literal["name", "size", "mtime"] = "name",
+    order: Literal["asc", "desc"] = "asc",
+    pattern: str | None = None,
+) -> HTMLResponse:
+    # Plain ``def`` so FastAPI runs the directory scan in its threadpool, off the event loop.
     config = load_config()
     root = Path(path) if path else Path(config.allowed_roots[0])
+    next_cursor = None
     try:
-        entries = list_directory(root)
+        page = browse_directory(root, cursor, DEFAULT_PAGE_SIZE, sort, order == "desc", pattern)
+        entries = page.entries
+        next_cursor = page.next_cursor
         current_path = root.resolve()
-    except UnsafePathError as exc:
+    except (UnsafePathError, InvalidCursorError) as exc:
         entries = []
         current_path = Path(config.allowed_roots[0])
         error = str(exc)
@@ -45,6 +67,11 @@ async def browse(request: Request, path: str | None = None, error: str | None =
             "current_path": str(current_path),
             "config": config,
             "error": error,
+            "next_cursor": next_cursor,
+            "sort": sort,
+            "order": order,
+            "pattern": pattern or "",
+            "selection": selection_total(config.selected_paths),
         },
     )
 
@@ -64,22 +91,26 @@ async def save_selection(request: Request, selections: str = Form(default="")) -
 
 @view_router.post("/run", response_class=HTMLResponse)
 async def run_backup_now() -> RedirectResponse:
+    config = load_config()
     try:
-        run_backup()
-    except Exception:  # noqa: BLE001
-        logger.exception("Backup run failed")
-    return RedirectResponse(url="/logs", status_code=303)
+        job_manager.submit("backup", config.destination, lambda progress: run_backup(config, progress=progress))
+    except JobBusyError as exc:
+        logger.warning("Backup not started: %s", exc)
+    return RedirectResponse(url="/", status_code=303)
+
+
+LOG_PAGE_LINES = 500
 
 
 @view_router.get("/logs", response_class=HTMLResponse)
-async def show_logs(request: Request) -> HTMLResponse:
+def show_logs(request: Request, level: Optional[str] = None, run_id: Optional[str] = None) -> HTMLResponse:
     LOG_DIR.mkdir(parents=True, exist_ok=True)
-    if LOG_FILE.exists():
-        with LOG_FILE.open("r", encoding="utf-8") as f:
-            lines = f.readlines()
-    else:
-        lines = []
+    try:
+        query = LogQuery(level=level or None, run_id=run_id or None)
+    except ValueError:
+        query = LogQuery()
+    page = read_logs(LOG_FILE, LOG_BACKUP_COUNT, limit=LOG_PAGE_LINES, query=query)
     return templates.TemplateResponse(
         "logs.html",
-        {"request": request, "logs": reversed(lines[-500:])},
+        {"request": request, "logs": page.entries, "level": query.level or "", "run_id": query.run_id or ""},
     )
@@ -0,0 +1,166 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .compare import DEFAULT_THRESHOLD, compare_results
+from .scenarios import ENGINES, SCENARIOS, Options, Result, available_engines, combine, run_isolated
+from .synthetic import SIZE_PROFILES, TreeSpec, generate_tree
+
+RESULTS_VERSION = 1
+
+
+def _parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description="Time the backup engines on a synthetic source tree."
+    )
+    tree = parser.add_argument_group("source tree")
+    tree.add_argument("--files", type=int, default=TreeSpec.files, help="number of files (default: %(default)s)")
+    tree.add_argument("--depth", type=int, default=TreeSpec.depth, help="directory levels (default: %(default)s)")
+    tree.add_argument("--fanout", type=int, default=TreeSpec.fanout, help="subdirectories per directory (default: %(default)s)")
+    tree.add_argument("--sizes", choices=sorted(SIZE_PROFILES), default=TreeSpec.sizes, help="file size profile (default: %(default)s)")
+    tree.add_argument(
+        "--random-fraction",
+        type=float,
+        default=TreeSpec.random_fraction,
+        help="share of incompressible files (default: %(default)s)",
+    )
+    tree.add_argument("--seed", type=int, default=TreeSpec.seed, help="random seed (default: %(default)s)")
+    tree.add_argument("--patterns", type=int, default=0, help="exclude patterns in the config (default: %(default)s)")
+
+    runs = parser.add_argument_group("runs")
+    runs.add_argument("--engines", default=",".join(ENGINES), help="comma-separated engines (default: %(default)s)")
+    runs.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated scenarios (default: %(default)s)")
+    runs.add_argument("--repeat", type=int, default=1, help="runs per scenario; the median is reported (default: %(default)s)")
+    runs.add_argument("--change-fraction", type=float, default=0.1, help="files changed before an incremental run (default: %(default)s)")
+    runs.add_argument("--snapshots", type=int, default=3, help="snapshots built before pruning (default: %(default)s)")
+    runs.add_argument("--browse-entries", type=int, default=10_000, help="entries in the browsed directory (default: %(default)s)")
+    runs.add_argument("--max-workers", type=int, default=4, help="copy threads of the Python engines (default: %(default)s)")
+    runs.add_argument("--workdir", type=Path, help="where to build trees and snapshots (default: a temporary directory)")
+    runs.add_argument("--keep", action="store_true", help="keep the work directory afterwards")
+
+    output = parser.add_argument_group("output")
+    output.add_argument("--output", type=Path, help="write the results as JSON to this file")
+    output.add_argument("--baseline", type=Path, help="compare against a results file from an earlier run")
+    output.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="slowdown that counts as a regression (default: %(default)s)",
+    )
+    return parser.parse_args(argv)
+
+
+def _selection(value: str, known: Tuple[str, ...], what: str) -> List[str]:
+    chosen = [item.strip() for item in value.split(",") if item.strip()]
+    unknown = [item for item in chosen if item not in known]
+    if unknown:
+        raise SystemExit(f"Unknown {what}: {', '.join(unknown)} (choose from {', '.join(known)})")
+    return chosen
+
+
+def _plan(scenarios: List[str], engines: List[str]) -> List[Tuple[str, str]]:
+    # Browse and chunking do not involve an engine. Incremental runs change the shared source
+    # tree, so they go last; archives are never incremental.
+    order = ["browse", "chunking", "full", "retention", "incremental"]
+    plan = []
+    for scenario in sorted(scenarios, key=order.index):
+        if scenario in ("browse", "chunking"):
+            plan.append((scenario, "-"))
+            continue
+        plan += [(scenario, engine) for engine in engines if not (scenario == "incremental" and engine == "archive")]
+    return plan
+
+
+def _format_table(results: List[Result]) -> str:
+    lines = [f"{'scenario':<12} {'engine':<8} {'seconds':>9} {'files/s':>10} {'MB/s':>8} {'peak RSS':>10}"]
+    for result in results:
+        rss = f"{result.peak_rss_kib / 1024:.1f} MiB" if result.peak_rss_kib else "-"
+        lines.append(
+            f"{result.scenario:<12} {result.engine:<8} {result.seconds:>9.3f} "
+            f"{result.files_per_sec:>10.0f} {result.mb_per_sec:>8.1f} {rss:>10}"
+        )
+    return "\n".join(lines)
+
+
+def run(args: argparse.Namespace) -> Dict:
+    engines = _selection(args.engines, ENGINES, "engines")
+    scenarios = _selection(args.scenarios, SCENARIOS, "scenarios")
+    missing = [engine for engine in engines if engine not in available_engines()]
+    for engine in missing:
+        print(f"Skipping {engine}: not installed", file=sys.stderr)
+    engines = [engine for engine in engines if engine not in missing]
+
+    spec = TreeSpec(args.files, args.depth, args.fanout, args.sizes, args.random_fraction, args.seed)
+    options = Options(spec, args.patterns, args.change_fraction, args.snapshots, args.browse_entries, args.max_workers)
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="pi-backup-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    source = workdir / "source"
+    results: List[Result] = []
+    try:
+        started = time.perf_counter()
+        tree = generate_tree(source, spec)
+        print(
+            f"Generated {tree.files} files ({tree.bytes / 1e6:.1f} MB) in {tree.dirs} directories "
+            f"in {time.perf_counter() - started:.1f}s",
+            file=sys.stderr,
+        )
+        # A fresh process per run: peak RSS then belongs to that run, and no state (caches,
+        # thread pools, the config cache) leaks from one scenario into the next.
+        context = multiprocessing.get_context("spawn")
+        for scenario, engine in _plan(scenarios, engines):
+            runs = []
+            for _ in range(max(1, args.repeat)):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    data = pool.submit(run_isolated, scenario, engine, source, workdir, options).result()
+                runs.append(Result.from_dict(data))
+            result = combine(runs)
+            print(f"{result.key}: {result.seconds:.3f}s", file=sys.stderr)
+            results.append(result)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "tree": tree.to_dict(),
+        "options": options.to_dict(),
+        "results": [result.to_dict() for result in results],
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = _parse_args(argv)
+    report = run(args)
+    results = [Result.from_dict(data) for data in report["results"]]
+    print(_format_table(results))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        comparisons = compare_results(results, baseline, args.threshold)
+        print(f"\nAgainst {args.baseline}:")
+        for comparison in comparisons:
+            print(comparison)
+        if any(comparison.regression for comparison in comparisons):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from .scenarios import Result
+
+# A scenario more than this much slower than the baseline counts as a regression.
+DEFAULT_THRESHOLD = 0.10
+
+
+@dataclass
+class Comparison:
+    key: str
+    baseline_seconds: float
+    seconds: float
+    baseline_rss_kib: Optional[int]
+    rss_kib: Optional[int]
+    regression: bool
+
+    @property
+    def change(self) -> float:
+        # Relative change in time; negative is faster.
+        return self.seconds / self.baseline_seconds - 1.0 if self.baseline_seconds > 0 else 0.0
+
+    def __str__(self) -> str:
+        rss = ""
+        if self.baseline_rss_kib and self.rss_kib:
+            rss = f", peak RSS {self.rss_kib / self.baseline_rss_kib - 1.0:+.0%}"
+        flag = "  REGRESSION" if self.regression else ""
+        return f"{self.key}: {self.baseline_seconds:.3f}s -> {self.seconds:.3f}s ({self.change:+.1%}{rss}){flag}"
+
+
+def compare_results(current: List[Result], baseline: Dict, threshold: float = DEFAULT_THRESHOLD) -> List[Comparison]:
+    # Matches scenarios by "<scenario>/<engine>"; ones missing from either side are skipped,
+    # so a baseline from a machine without rsync still compares the rest.
+    previous = {result.key: result for result in map(Result.from_dict, baseline.get("results", []))}
+    comparisons = []
+    for result in current:
+        old = previous.get(result.key)
+        if old is None:
+            continue
+        comparisons.append(
+            Comparison(
+                result.key,
+                old.seconds,
+                result.seconds,
+                old.peak_rss_kib,
+                result.peak_rss_kib,
+                regression=old.seconds > 0 and result.seconds > old.seconds * (1.0 + threshold),
+            )
+        )
+    return comparisons
@@ -0,0 +1,240 @@
+import io
+import random
+import resource
+import shutil
+import statistics
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+from app.backup import config, dirsizes, engine, journal, retention
+from app.backup.chunkstore import iter_chunks
+from app.backup.copier import CopyStats, iter_source_files
+from app.backup.filesystem import browse_directory
+from app.backup.filters import PathFilter
+
+from .synthetic import TreeSpec, TreeStats, exclude_patterns, flat_directory, modify_tree
+
+ENGINES = ("python", "rsync", "chunks", "archive", "packed")
+SCENARIOS = ("full", "incremental", "browse", "retention", "chunking")
+FORMATS = {"python": "directory", "rsync": "directory", "chunks": "chunks", "archive": "archive", "packed": "directory"}
+# pack_below_kib of the "packed" engine: the Python engine with small files in pack files.
+PACK_BELOW_KIB = 64
+BROWSE_PAGE = 200
+# Incompressible data split into chunks by the "chunking" scenario.
+CHUNKING_BYTES = 32 * 1024 * 1024
+
+
+@dataclass
+class Options:
+    spec: TreeSpec = field(default_factory=TreeSpec)
+    patterns: int = 0
+    change_fraction: float = 0.1
+    snapshots: int = 3
+    browse_entries: int = 10_000
+    max_workers: int = 4
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+@dataclass
+class Result:
+    scenario: str
+    engine: str
+    seconds: float
+    files: int
+    bytes: int
+    peak_rss_kib: Optional[int] = None
+    runs: List[float] = field(default_factory=list)
+
+    @property
+    def key(self) -> str:
+        return f"{self.scenario}/{self.engine}"
+
+    @property
+    def files_per_sec(self) -> float:
+        return self.files / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def mb_per_sec(self) -> float:
+        return self.bytes / 1e6 / self.seconds if self.seconds > 0 else 0.0
+
+    def to_dict(self) -> Dict:
+        data = asdict(self)
+        data["files_per_sec"] = round(self.files_per_sec, 1)
+        data["mb_per_sec"] = round(self.mb_per_sec, 2)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Result":
+        known = {name: data[name] for name in cls.__dataclass_fields__ if name in data}
+        return cls(**known)
+
+
+def available_engines() -> List[str]:
+    return [name for name in ENGINES if name != "rsync" or shutil.which("rsync")]
+
+
+def isolate(workdir: Path) -> None:
+    # Points the app's config, indexes and run history into ``workdir``, so a benchmark never
+    # touches the real backup_config.json or logs. Only for the benchmark's own processes.
+    config_dir = workdir / "config"
+    config_dir.mkdir(parents=True, exist_ok=True)
+    for module in (config, dirsizes, journal):
+        module.get_config_dir = lambda: config_dir
+    engine.LOG_DIR = workdir / "logs"
+    engine.LOG_FILE = engine.LOG_DIR / "backup.log"
+
+
+@contextmanager
+def _engine_choice(name: str) -> Iterator[None]:
+    # The Python engine only runs when rsync is missing, so hide rsync for it.
+    original = engine.has_rsync
+    if name == "python":
+        engine.has_rsync = lambda: False
+    elif name == "rsync" and not shutil.which("rsync"):
+        raise RuntimeError("rsync is not installed")
+    try:
+        yield
+    finally:
+        engine.has_rsync = original
+
+
+def _backup_config(source: Path, destination: Path, name: str, options: Options) -> config.BackupConfig:
+    cfg = config.BackupConfig(
+        destination=str(destination),
+        selected_paths=[str(source)],
+        allowed_roots=[str(source.parent)],
+        exclude_patterns=exclude_patterns(options.patterns),
+        retention=config.RetentionRules(keep_last=None),
+        incremental=FORMATS[name] == "directory",
+        max_workers=options.max_workers,
+        destination_format=FORMATS[name],
+        pack_below_kib=PACK_BELOW_KIB if name == "packed" else None,
+    )
+    # The engine checks the selection against the saved allowed roots.
+    config.save_config(cfg)
+    return cfg
+
+
+def _selected(cfg: config.BackupConfig) -> TreeStats:
+    # What the run backs up once the config's patterns are applied, found the engine's way.
+    selected = TreeStats()
+    path_filter = PathFilter(cfg.include_patterns, cfg.exclude_patterns)
+    for item in iter_source_files(cfg.selected_paths, path_filter, CopyStats()):
+        selected.files += 1
+        selected.bytes += item.stat.st_size
+    return selected
+
+
+def _next_second() -> None:
+    # Snapshot folders are named to the second; two runs in one second would share a folder.
+    time.sleep(1.0 - time.time() % 1.0 + 0.01)
+
+
+def _timed(fn: Callable[[], None]) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def run_scenario(scenario: str, name: str, source: Path, workdir: Path, options: Options) -> Result:
+    # One measurement in the current process. Setup (earlier snapshots, test directories) is
+    # not timed. The source tree is shared by all scenarios; only "incremental" changes it.
+    # Throughput counts the files and bytes the config selects.
+    if scenario == "browse":
+        return _browse(workdir, options)
+    if scenario == "chunking":
+        return _chunking(options)
+    destination = workdir / f"dest-{scenario}-{name}"
+    with _engine_choice(name):
+        cfg = _backup_config(source, destination, name, options)
+        tree = _selected(cfg)
+        if scenario == "full":
+            seconds = _timed(lambda: engine.run_backup(cfg))
+            return Result(scenario, name, seconds, tree.files, tree.bytes)
+        if scenario == "incremental":
+            engine.run_backup(cfg)
+            modify_tree(source, options.change_fraction)
+            _next_second()
+            seconds = _timed(lambda: engine.run_backup(cfg))
+            return Result(scenario, name, seconds, tree.files, tree.bytes)
+        if scenario == "retention":
+            for i in range(max(2, options.snapshots)):
+                if i:
+                    _next_second()
+                engine.run_backup(cfg)
+            pruned = len(retention.parse_timestamped_dirs(destination)) - 1
+            rules = config.RetentionRules(keep_last=1)
+
+            def prune() -> None:
+                retention.enforce_retention(destination, rules)
+                retention.wait_for_trash()
+
+            seconds = _timed(prune)
+            return Result(scenario, name, seconds, tree.files * pruned, tree.bytes * pruned)
+    raise ValueError(f"Unknown scenario {scenario!r}")
+
+
+def _browse(workdir: Path, options: Options) -> Result:
+    # First page of a huge directory by name, by size (which stats every entry) and filtered.
+    directory = workdir / "browse" / "huge"
+    if not directory.exists():
+        flat_directory(directory, options.browse_entries)
+    config.save_config(config.BackupConfig(allowed_roots=[str(directory.parent)]))
+
+    def browse() -> None:
+        browse_directory(directory, limit=BROWSE_PAGE)
+        browse_directory(directory, limit=BROWSE_PAGE, sort="size", descending=True)
+        browse_directory(directory, limit=BROWSE_PAGE, pattern="*.log")
+
+    seconds = _timed(browse)
+    return Result("browse", "-", seconds, options.browse_entries * 3, 0)
+
+
+def _chunking(options: Options) -> Result:
+    # Content-defined chunking alone, in memory: the CPU-bound part of a chunk store run.
+    data = random.Random(options.spec.seed).randbytes(CHUNKING_BYTES)
+    chunks = 0
+
+    def split() -> None:
+        nonlocal chunks
+        chunks = sum(1 for _ in iter_chunks(io.BytesIO(data)))
+
+    seconds = _timed(split)
+    return Result("chunking", "-", seconds, chunks, len(data))
+
+
+def peak_rss_kib() -> int:
+    # ru_maxrss is in KiB on Linux; rsync runs as child processes.
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children)
+
+
+def run_isolated(scenario: str, name: str, source: Path, workdir: Path, options: Options) -> Dict:
+    # Entry point of a fresh benchmark process, so peak RSS belongs to this scenario alone.
+    isolate(workdir)
+    result = run_scenario(scenario, name, source, workdir, options)
+    result.peak_rss_kib = peak_rss_kib()
+    shutil.rmtree(workdir / f"dest-{scenario}-{name}", ignore_errors=True)
+    return result.to_dict()
+
+
+def combine(results: List[Result]) -> Result:
+    # Repeated runs of one scenario: the median time and the highest peak RSS.
+    first = results[0]
+    runs = [r.seconds for r in results]
+    rss = [r.peak_rss_kib for r in results if r.peak_rss_kib is not None]
+    return Result(
+        first.scenario,
+        first.engine,
+        statistics.median(runs),
+        first.files,
+        first.bytes,
+        max(rss) if rss else None,
+        [round(seconds, 4) for seconds in runs],
+    )
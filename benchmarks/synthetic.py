@@ -0,0 +1,126 @@
+import os
+import random
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+KIB = 1024
+MIB = 1024 * KIB
+
+# (weight, smallest, largest) buckets per profile; sizes are drawn log-uniformly in a bucket,
+# so a profile keeps its shape whatever the file count.
+SIZE_PROFILES: Dict[str, List[Tuple[float, int, int]]] = {
+    "small": [(1.0, 512, 16 * KIB)],
+    "mixed": [(0.80, 512, 64 * KIB), (0.18, 64 * KIB, 2 * MIB), (0.02, 2 * MIB, 32 * MIB)],
+    "large": [(1.0, 1 * MIB, 16 * MIB)],
+}
+# Extensions the generated files cycle through, so include/exclude patterns have something to
+# match.
+EXTENSIONS = (".txt", ".jpg", ".log", ".dat", ".tmp")
+_TEXT = b"The quick brown fox jumps over the lazy dog while the backup runs. " * 64
+_WRITE_STEP = 4 * MIB
+
+
+@dataclass
+class TreeSpec:
+    files: int = 2000
+    depth: int = 3
+    fanout: int = 4
+    sizes: str = "mixed"
+    # Share of files filled with random (incompressible) bytes; the rest repeat a line of
+    # text, which compresses and chunks very differently.
+    random_fraction: float = 0.5
+    seed: int = 1
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+@dataclass
+class TreeStats:
+    files: int = 0
+    bytes: int = 0
+    dirs: int = 0
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+def _directories(root: Path, depth: int, fanout: int) -> List[Path]:
+    dirs = [root]
+    level = [root]
+    for d in range(depth):
+        level = [parent / f"dir{d}-{i}" for parent in level for i in range(fanout)]
+        dirs.extend(level)
+    return dirs
+
+
+def _size(rng: random.Random, profile: List[Tuple[float, int, int]]) -> int:
+    pick = rng.random() * sum(weight for weight, _, _ in profile)
+    for weight, low, high in profile:
+        pick -= weight
+        if pick <= 0:
+            break
+    return int(round(low * (high / low) ** rng.random()))
+
+
+def _write(path: Path, size: int, rng: random.Random, incompressible: bool) -> None:
+    with path.open("wb") as f:
+        left = size
+        while left > 0:
+            step = min(left, _WRITE_STEP)
+            if incompressible:
+                f.write(rng.randbytes(step))
+            else:
+                f.write((_TEXT * (step // len(_TEXT) + 1))[:step])
+            left -= step
+
+
+def generate_tree(root: Path, spec: TreeSpec) -> TreeStats:
+    # Same spec and seed, same tree: names, sizes and contents are all drawn from one RNG.
+    if spec.sizes not in SIZE_PROFILES:
+        raise ValueError(f"Unknown size profile {spec.sizes!r}; expected one of {', '.join(SIZE_PROFILES)}")
+    rng = random.Random(spec.seed)
+    profile = SIZE_PROFILES[spec.sizes]
+    dirs = _directories(root, spec.depth, spec.fanout)
+    for directory in dirs:
+        directory.mkdir(parents=True, exist_ok=True)
+    stats = TreeStats(dirs=len(dirs))
+    for i in range(spec.files):
+        path = rng.choice(dirs) / f"file{i:06d}{EXTENSIONS[i % len(EXTENSIONS)]}"
+        size = _size(rng, profile)
+        _write(path, size, rng, rng.random() < spec.random_fraction)
+        stats.files += 1
+        stats.bytes += size
+    return stats
+
+
+def modify_tree(root: Path, fraction: float, seed: int = 2) -> TreeStats:
+    # Appends to a ``fraction`` of the files and moves their mtime forward, as an incremental
+    # run would find them after a day of use.
+    rng = random.Random(seed)
+    files = sorted(path for path in root.rglob("*") if path.is_file())
+    changed = TreeStats()
+    for path in rng.sample(files, int(len(files) * fraction)):
+        with path.open("ab") as f:
+            f.write(rng.randbytes(KIB))
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        changed.files += 1
+        changed.bytes += stat.st_size
+    return changed
+
+
+def flat_directory(root: Path, entries: int) -> None:
+    # One directory with ``entries`` empty files, for the browse page.
+    root.mkdir(parents=True, exist_ok=True)
+    for i in range(entries):
+        (root / f"entry{i:07d}{EXTENSIONS[i % len(EXTENSIONS)]}").touch()
+
+
+def exclude_patterns(count: int) -> List[str]:
+    # ``count`` exclude patterns for a pattern-heavy config: a few that match generated files
+    # and the rest never, but every path is still tested against all of them.
+    patterns = ["*.tmp", "cache/", "**/node_modules/***"]
+    patterns += [f"/nomatch-{i}/**" if i % 2 else f"*.ext{i}" for i in range(max(0, count - len(patterns)))]
+    return patterns[:count]
@@ -1,5 +1,9 @@
 import importlib
+import logging
+import shutil
 import sys
+import tempfile
+from logging.handlers import RotatingFileHandler
 from pathlib import Path
 
 import pytest
@@ -8,6 +12,26 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
+# Test modules import app.main while they are collected, before the sandbox fixture runs, and
+# that configures logging. Point it away from the repository's logs/ folder until then.
+import app.backup.engine as _engine  # noqa: E402
+
+_COLLECTION_LOG_DIR = Path(tempfile.mkdtemp(prefix="pi-backup-test-logs-"))
+_engine.LOG_DIR = _COLLECTION_LOG_DIR
+_engine.LOG_FILE = _COLLECTION_LOG_DIR / "backup.log"
+
+
+def pytest_sessionfinish(session, exitstatus) -> None:
+    _drop_log_handlers()
+    shutil.rmtree(_COLLECTION_LOG_DIR, ignore_errors=True)
+
+
+def _drop_log_handlers() -> None:
+    root = logging.getLogger()
+    for handler in [h for h in root.handlers if isinstance(h, RotatingFileHandler)]:
+        root.removeHandler(handler)
+        handler.close()
+
 
 def reload_modules(config_dir: Path, log_dir: Path, monkeypatch: pytest.MonkeyPatch) -> None:
     # Reload and patch configuration so all modules point to the temporary directory.
@@ -17,11 +41,17 @@ def reload_modules(config_dir: Path, log_dir: Path, monkeypatch: pytest.MonkeyPa
     monkeypatch.setattr(config, "get_config_dir", lambda: config_dir)
 
     # Reload dependent modules to pick up the patched configuration.
+    import app.backup.dirsizes as dirsizes
     import app.backup.filesystem as filesystem
+    import app.backup.journal as journal
+    import app.backup.logreader as logreader
     import app.backup.retention as retention
     import app.backup.engine as engine
 
+    importlib.reload(dirsizes)
     importlib.reload(filesystem)
+    importlib.reload(journal)
+    importlib.reload(logreader)
     importlib.reload(retention)
     engine = importlib.reload(engine)
 
@@ -29,7 +59,16 @@ def reload_modules(config_dir: Path, log_dir: Path, monkeypatch: pytest.MonkeyPa
     monkeypatch.setattr(engine, "LOG_DIR", log_dir)
     monkeypatch.setattr(engine, "LOG_FILE", log_dir / "backup.log")
 
+    # Fresh job registry per test so background jobs never leak between tests.
+    import app.backup.jobs as jobs
+
+    importlib.reload(jobs)
+
     # Reload FastAPI layers so they import the patched engine/config values.
+    import app.backup.watcher as watcher
+
+    importlib.reload(watcher)
+
     import app.api as api
     import app.views as views
     import app.main as main
@@ -46,5 +85,9 @@ def sandbox(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
     config_dir.mkdir(parents=True, exist_ok=True)
     log_dir.mkdir(parents=True, exist_ok=True)
 
+    # configure_logging() installs one handler for the process; drop the previous test's so
+    # this test's log lines land in its own log_dir.
+    _drop_log_handlers()
     reload_modules(config_dir, log_dir, monkeypatch)
     yield
+    _drop_log_handlers()
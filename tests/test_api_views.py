@@ -1,9 +1,12 @@
+import json
+import threading
 from pathlib import Path
 
 import pytest
 from fastapi.testclient import TestClient
 
 import app.backup.config as config
+import app.backup.jobs as jobs
 import app.main as main
 
 
@@ -37,6 +40,11 @@ def test_api_config_endpoints(client: TestClient, tmp_path: Path):
         str((tmp_path / "forbidden").resolve()),
     ]
 
+    resp = client.post("/api/config", json={**update_payload, "schedule": {"cron": "every night"}})
+    assert resp.status_code == 400
+    resp = client.post("/api/config", json={**update_payload, "schedule": {"cron": "30 2 * * *", "jitter_seconds": 300}})
+    assert resp.json()["schedule"] == {"cron": "30 2 * * *", "jitter_seconds": 300, "catch_up": True}
+
 
 def test_api_browse_and_error(client: TestClient, tmp_path: Path):
     target = tmp_path / "root"
@@ -52,19 +60,93 @@ def test_api_browse_and_error(client: TestClient, tmp_path: Path):
     assert resp.status_code == 400
 
 
+def test_api_browse_pagination_and_stream(client: TestClient, tmp_path: Path):
+    target = tmp_path / "root"
+    for name in ["a.txt", "b.txt", "c.log"]:
+        (target / name).write_text(name)
+
+    resp = client.get("/api/browse", params={"path": str(target), "limit": 2})
+    payload = resp.json()
+    assert [e["name"] for e in payload["entries"]] == ["a.txt", "b.txt"]
+    assert payload["total"] == 3
+    resp = client.get("/api/browse", params={"path": str(target), "limit": 2, "cursor": payload["next_cursor"]})
+    assert [e["name"] for e in resp.json()["entries"]] == ["c.log"]
+    assert resp.json()["next_cursor"] is None
+
+    resp = client.get("/api/browse", params={"path": str(target), "stream": True, "pattern": "*.txt"})
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    assert sorted(json.loads(line)["name"] for line in resp.text.splitlines()) == ["a.txt", "b.txt"]
+
+    assert client.get("/api/browse", params={"path": str(target), "cursor": "bogus"}).status_code == 400
+    resp = client.get("/api/browse", params={"path": str(target), "sort": "size", "cursor": payload["next_cursor"]})
+    assert resp.status_code == 400
+
+
 def test_api_run_backup_success_and_failure(client: TestClient, monkeypatch: pytest.MonkeyPatch):
     destination = Path("/tmp/result")
-    monkeypatch.setattr("app.api.run_backup", lambda: destination)
+    monkeypatch.setattr("app.api.run_backup", lambda *args, **kwargs: destination)
     resp = client.post("/api/run")
+    assert resp.status_code == 202
+    job_id = resp.json()["job_id"]
+    assert jobs.job_manager.get(job_id).wait(5)
+    resp = client.get(f"/api/jobs/{job_id}")
     assert resp.status_code == 200
-    assert resp.json()["destination"] == str(destination)
+    assert resp.json()["status"] == "succeeded"
+    assert resp.json()["result"] == str(destination)
 
-    def boom():
+    def boom(*args, **kwargs):
         raise RuntimeError("fail")
 
     monkeypatch.setattr("app.api.run_backup", boom)
     resp = client.post("/api/run")
-    assert resp.status_code == 500
+    job = jobs.job_manager.get(resp.json()["job_id"])
+    assert job.wait(5)
+    assert client.get(f"/api/jobs/{job.id}").json()["error"] == "fail"
+    assert client.get("/api/jobs/unknown").status_code == 404
+
+
+def test_api_run_rejects_overlapping_jobs_and_streams_events(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    release = threading.Event()
+
+    def slow_backup(config, progress):
+        progress.add_found(10)
+        progress.finish_scan()
+        release.wait(5)
+        progress.advance(10)
+        return Path(config.destination)
+
+    monkeypatch.setattr("app.api.run_backup", slow_backup)
+    first = client.post("/api/run")
+    assert first.status_code == 202
+    second = client.post("/api/run")
+    assert second.status_code == 409
+    assert second.json()["detail"]["job_id"] == first.json()["job_id"]
+
+    release.set()
+    resp = client.get(f"/api/jobs/{first.json()['job_id']}/events")
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    assert "event: done" in resp.text
+    assert '"bytes_total": 10' in resp.text
+
+
+def test_api_runs_and_metrics(client: TestClient):
+    from app.backup import engine
+    from app.backup.history import RunRecord
+
+    record = RunRecord(engine="python", files_copied=3, bytes_copied=42, phases={"copy": 1.5})
+    record.finish("succeeded")
+    engine.run_history().append(record)
+
+    resp = client.get("/api/runs")
+    assert resp.json()["runs"][0]["run_id"] == record.run_id
+    assert client.get(f"/api/runs/{record.run_id}").json()["bytes_copied"] == 42
+    assert client.get("/api/runs/missing").status_code == 404
+
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    assert "pi_backup_last_run_bytes_copied 42" in resp.text
+    assert 'pi_backup_last_run_phase_seconds{phase="copy"} 1.5' in resp.text
 
 
 def test_views_flow(client: TestClient, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
@@ -80,10 +162,13 @@ def test_views_flow(client: TestClient, tmp_path: Path, monkeypatch: pytest.Monk
     resp = client.post("/browse", data={"selections": "not-json"}, allow_redirects=False)
     assert resp.status_code == 303
 
-    # Run backup captures errors and redirects
-    monkeypatch.setattr("app.views.run_backup", lambda: (_ for _ in ()).throw(RuntimeError("boom")))
+    # Run backup starts a background job, records its errors and redirects
+    monkeypatch.setattr("app.views.run_backup", lambda *args, **kwargs: (_ for _ in ()).throw(RuntimeError("boom")))
     resp = client.post("/run", allow_redirects=False)
     assert resp.status_code == 303
+    for job in jobs.job_manager.list():
+        assert job.wait(5)
+        assert job.status == "failed"
 
     # Logs page reads existing file
     from app.backup import engine
@@ -94,3 +179,48 @@ def test_views_flow(client: TestClient, tmp_path: Path, monkeypatch: pytest.Monk
     resp = client.get("/logs")
     assert resp.status_code == 200
     assert "line1" in resp.text
+
+
+def test_api_logs_paginates_and_filters(client: TestClient):
+    from app.backup import engine
+
+    log_file = Path(engine.LOG_FILE)
+    log_file.parent.mkdir(parents=True, exist_ok=True)
+    log_file.write_text(
+        "2026-01-01 00:00:01,000 [INFO] backup[abc123]: Run abc123: starting backup\n"
+        "2026-01-01 00:00:02,000 [ERROR] backup[abc123]: Failed to copy /a\n"
+        "2026-01-01 00:00:03,000 [INFO] app.main: unrelated\n"
+    )
+    resp = client.get("/api/logs", params={"limit": 2})
+    body = resp.json()
+    assert [entry["message"] for entry in body["entries"]] == ["unrelated", "Failed to copy /a"]
+    older = client.get("/api/logs", params={"limit": 2, "cursor": body["next_cursor"]}).json()
+    assert [entry["message"] for entry in older["entries"]] == ["Run abc123: starting backup"]
+    assert older["next_cursor"] is None
+
+    errors = client.get("/api/logs", params={"level": "error", "run_id": "abc123"}).json()["entries"]
+    assert [entry["level"] for entry in errors] == ["ERROR"]
+    assert client.get("/api/logs", params={"level": "loud"}).status_code == 400
+    assert client.get("/api/logs", params={"cursor": "nope"}).status_code == 400
+    assert "Failed to copy /a" not in client.get("/logs", params={"level": "INFO", "run_id": "zzz"}).text
+
+
+def test_api_verify_snapshot_runs_as_job(client: TestClient, tmp_path: Path):
+    from app.backup.verify import build_manifest
+
+    snapshot = tmp_path / "dest" / "2000-01-01_00-00-00"
+    (snapshot / "root").mkdir(parents=True)
+    (snapshot / "root" / "file.txt").write_text("data")
+    build_manifest(snapshot)
+
+    assert client.post("/api/snapshots/1999-01-01_00-00-00/verify").status_code == 404
+    resp = client.post(f"/api/snapshots/{snapshot.name}/verify")
+    assert resp.status_code == 202
+    job = jobs.job_manager.get(resp.json()["job_id"])
+    assert job.wait(5)
+    assert (job.kind, job.status, job.result) == ("verify", "succeeded", f"{snapshot.name}: 1 files verified")
+
+    (snapshot / "root" / "file.txt").write_text("rot!")
+    job = jobs.job_manager.get(client.post(f"/api/snapshots/{snapshot.name}/verify").json()["job_id"])
+    assert job.wait(5)
+    assert job.status == "failed" and "1 corrupt" in job.error
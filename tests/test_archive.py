@@ -0,0 +1,163 @@
+import os
+import tarfile
+from pathlib import Path
+
+import pytest
+
+import app.backup.archive as archive
+import app.backup.config as config
+import app.backup.engine as engine
+from app.backup.catalog import restore_paths
+from app.backup.filters import PathFilter
+from app.backup.manifest import read_manifest, read_manifest_header
+from app.backup.retention import enforce_retention, parse_timestamped_dirs
+from app.backup.verify import verify_snapshot
+from tests.test_engine import freeze_time
+
+
+def make_source(root: Path) -> Path:
+    source = root / "src"
+    (source / "sub").mkdir(parents=True)
+    (source / "small.txt").write_text("hello")
+    (source / "sub" / "random.bin").write_bytes(os.urandom(300_000))
+    (source / "sub" / "zeros.bin").write_bytes(b"\0" * 200_000)
+    (source / "last.txt").write_text("the end")
+    return source
+
+
+def test_archive_is_a_plain_tarball_with_a_member_index(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(archive, "BLOCK_SIZE", 64 * 1024)
+    source = make_source(tmp_path)
+    snapshot = tmp_path / "dest" / "2000-01-01_00-00-00"
+    stats = archive.backup_to_archive([str(source)], snapshot, PathFilter(), "gzip", max_workers=3)
+    assert stats.files_copied == 4 and stats.errors == 0
+    assert read_manifest_header(snapshot)["format"] == "archive"
+
+    # Independently compressed blocks still make one ordinary .tar.gz.
+    with tarfile.open(snapshot / "archive.tar.gz", "r:gz") as tar:
+        names = tar.getnames()
+        assert tar.extractfile("src/sub/random.bin").read() == (source / "sub" / "random.bin").read_bytes()
+    assert sorted(names) == ["src/last.txt", "src/small.txt", "src/sub/random.bin", "src/sub/zeros.bin"]
+
+    reader = archive.ArchiveReader(snapshot)
+    with reader:
+        for entry in read_manifest(snapshot):
+            data = b"".join(reader.read(entry["offset"], entry["size"]))
+            assert data == (tmp_path / entry["path"]).read_bytes()
+    assert verify_snapshot(snapshot).ok
+
+
+def test_files_that_shrink_while_archived_are_errors_not_copies(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    source = make_source(tmp_path)
+    scan = archive.iter_source_files
+
+    def shrinking(*args, **kwargs):
+        for item in scan(*args, **kwargs):
+            if item.path.name == "random.bin":
+                item.path.write_bytes(b"short")
+            yield item
+
+    monkeypatch.setattr(archive, "iter_source_files", shrinking)
+    snapshot = tmp_path / "dest" / "2000-01-01_00-00-00"
+    stats = archive.backup_to_archive([str(source)], snapshot, PathFilter(), "gzip")
+    assert (stats.files_copied, stats.errors) == (3, 1)
+    # The padded member has no manifest entry, so verify cannot pass it under the zeros' hash.
+    assert "src/sub/random.bin" not in {entry["path"] for entry in read_manifest(snapshot)}
+    assert verify_snapshot(snapshot).ok
+
+
+def test_single_file_restore_decompresses_only_its_blocks(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(archive, "BLOCK_SIZE", 16 * 1024)
+    source = make_source(tmp_path)
+    snapshot = tmp_path / "dest" / "2000-01-01_00-00-00"
+    archive.backup_to_archive([str(source)], snapshot, PathFilter(), "gzip")
+    with archive.ArchiveReader(snapshot) as reader:
+        total = len(reader._blocks)
+        entry = next(e for e in read_manifest(snapshot) if e["path"] == "src/last.txt")
+        assert bytes(b"".join(reader.read(entry["offset"], entry["size"]))) == b"the end"
+        assert reader.blocks_read == 1 < total
+
+    target = tmp_path / "restore"
+    assert restore_paths(snapshot, ["src/sub/zeros.bin"], target) == 1
+    assert [p.name for p in target.rglob("*") if p.is_file()] == ["zeros.bin"]
+    assert (target / "src" / "sub" / "zeros.bin").read_bytes() == b"\0" * 200_000
+
+
+def test_verify_reports_files_in_a_damaged_block(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(archive, "BLOCK_SIZE", 16 * 1024)
+    source = make_source(tmp_path)
+    snapshot = tmp_path / "dest" / "2000-01-01_00-00-00"
+    archive.backup_to_archive([str(source)], snapshot, PathFilter(), "gzip")
+    path = snapshot / "archive.tar.gz"
+    # Damage a block from the middle of random.bin; the other files are in other blocks.
+    entry = next(e for e in read_manifest(snapshot) if e["path"] == "src/sub/random.bin")
+    with archive.ArchiveReader(snapshot) as reader:
+        index = max(i for i, block in enumerate(reader._blocks) if block[0] <= entry["offset"] + 100_000)
+        _, offset, length = reader._blocks[index]
+    data = bytearray(path.read_bytes())
+    data[offset + length // 2] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+    report = verify_snapshot(snapshot)
+    assert report.corrupt == ["src/sub/random.bin"]
+    assert report.files_checked == 4
+
+    (snapshot / archive.BLOCK_INDEX_NAME).unlink()
+    assert verify_snapshot(snapshot).missing_count == 4
+
+
+def test_engine_writes_archive_snapshots_that_retention_prunes(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    source = make_source(tmp_path)
+    cfg = config.BackupConfig(
+        destination=str(tmp_path / "dest"),
+        selected_paths=[str(source)],
+        allowed_roots=[str(tmp_path)],
+        destination_format="archive",
+        archive_compression="gzip",
+    )
+    config.save_config(cfg)
+    assert config.load_config().archive_compression == "gzip"
+    snapshots = []
+    for stamp in ["2000-01-01_00-00-00", "2000-01-02_00-00-00", "2000-01-03_00-00-00"]:
+        freeze_time(monkeypatch, stamp)
+        snapshots.append(engine.run_backup(cfg))
+    assert sorted(parse_timestamped_dirs(tmp_path / "dest")) == snapshots
+    assert (snapshots[-1] / "archive.tar.gz").is_file()
+    assert engine.run_history().records()[0].engine == "archive"
+
+    enforce_retention(tmp_path / "dest", config.RetentionRules(keep_last=1))
+    assert parse_timestamped_dirs(tmp_path / "dest") == snapshots[-1:]
+    assert not snapshots[0].exists()
+
+
+def test_unknown_or_unavailable_compression_is_rejected(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    with pytest.raises(ValueError):
+        archive.resolve_compression("bzip2")
+    monkeypatch.setattr(archive, "zstandard", None)
+    assert archive.resolve_compression("auto").name == "gzip"
+    with pytest.raises(ValueError):
+        archive.resolve_compression("zstd")
+
+    source = make_source(tmp_path)
+    cfg = config.BackupConfig(
+        destination=str(tmp_path / "dest"),
+        selected_paths=[str(source)],
+        allowed_roots=[str(tmp_path)],
+        destination_format="archive",
+        archive_compression="zstd",
+    )
+    with pytest.raises(ValueError):
+        engine.run_backup(cfg)
+    assert not (tmp_path / "dest").exists() or not any((tmp_path / "dest").iterdir())
+
+
+def test_zstd_archives_roundtrip(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    pytest.importorskip("zstandard")
+    monkeypatch.setattr(archive, "BLOCK_SIZE", 64 * 1024)
+    source = make_source(tmp_path)
+    snapshot = tmp_path / "dest" / "2000-01-01_00-00-00"
+    archive.backup_to_archive([str(source)], snapshot, PathFilter(), "auto")
+    assert (snapshot / "archive.tar.zst").is_file()
+    assert verify_snapshot(snapshot).ok
+    assert restore_paths(snapshot, ["src/small.txt"], tmp_path / "restore") == 1
+    assert (tmp_path / "restore" / "src" / "small.txt").read_text() == "hello"
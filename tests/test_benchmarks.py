@@ -0,0 +1,60 @@
+from pathlib import Path
+
+import pytest
+
+from benchmarks import scenarios, synthetic
+from benchmarks.compare import compare_results
+
+
+def test_generated_trees_are_reproducible(tmp_path: Path):
+    spec = synthetic.TreeSpec(files=40, depth=2, fanout=3, sizes="small", seed=7)
+    first = synthetic.generate_tree(tmp_path / "a", spec)
+    second = synthetic.generate_tree(tmp_path / "b", spec)
+    assert (first.files, first.dirs) == (40, 13)
+    assert first == second
+    for path in (tmp_path / "a").rglob("*"):
+        twin = tmp_path / "b" / path.relative_to(tmp_path / "a")
+        assert path.is_dir() or path.read_bytes() == twin.read_bytes()
+
+    changed = synthetic.modify_tree(tmp_path / "a", 0.25)
+    assert changed.files == 10
+    with pytest.raises(ValueError):
+        synthetic.generate_tree(tmp_path / "c", synthetic.TreeSpec(sizes="huge"))
+
+
+@pytest.mark.parametrize("engine", ["python", "chunks", "archive"])
+def test_scenarios_run_in_process(tmp_path: Path, engine: str):
+    options = scenarios.Options(spec=synthetic.TreeSpec(files=30, sizes="small"), patterns=20, browse_entries=50)
+    source = tmp_path / "bench" / "source"
+    synthetic.generate_tree(source, options.spec)
+    full = scenarios.run_scenario("full", engine, source, tmp_path / "bench", options)
+    # "*.tmp" is among the exclude patterns: every fifth file is not backed up.
+    assert (full.key, full.files) == (f"full/{engine}", 24)
+    assert full.seconds > 0 and full.mb_per_sec > 0
+
+    browse = scenarios.run_scenario("browse", "-", source, tmp_path / "bench", options)
+    assert browse.files == 150
+
+
+def test_chunking_scenario(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(scenarios, "CHUNKING_BYTES", 1 << 20)
+    result = scenarios.run_scenario("chunking", "-", tmp_path / "source", tmp_path / "bench", scenarios.Options())
+    assert (result.key, result.bytes) == ("chunking/-", 1 << 20)
+    assert result.files >= 1 and result.mb_per_sec > 0
+
+
+def test_baseline_comparison_flags_slowdowns():
+    baseline = {
+        "results": [
+            scenarios.Result("full", "python", 1.0, 100, 10**6, 20_000).to_dict(),
+            scenarios.Result("full", "rsync", 1.0, 100, 10**6).to_dict(),
+        ]
+    }
+    current = [
+        scenarios.Result("full", "python", 1.25, 100, 10**6, 30_000),
+        scenarios.Result("full", "chunks", 9.0, 100, 10**6),
+    ]
+    [comparison] = compare_results(current, baseline, threshold=0.1)
+    assert comparison.regression and round(comparison.change, 2) == 0.25
+    assert "REGRESSION" in str(comparison) and "+50%" in str(comparison)
+    assert not compare_results(current, baseline, threshold=0.5)[0].regression
@@ -0,0 +1,124 @@
+import shutil
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.backup.config as config
+import app.backup.jobs as jobs
+import app.main as main
+from app.backup.catalog import SnapshotCatalog, UnknownSnapshotError, check_restore_paths, restore_paths
+from app.backup.chunkstore import backup_to_chunks
+from app.backup.filters import PathFilter
+from app.backup.verify import build_manifest
+
+
+def make_snapshot(root: Path, name: str, files: dict, manifest: bool = True) -> Path:
+    snapshot = root / name
+    for rel, text in files.items():
+        path = snapshot / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+    if manifest:
+        build_manifest(snapshot)
+    return snapshot
+
+
+@pytest.fixture
+def destination(tmp_path: Path) -> Path:
+    root = tmp_path / "dest"
+    make_snapshot(root, "2000-01-01_00-00-00", {"src/a.txt": "one", "src/docs/b.txt": "bee"})
+    make_snapshot(root, "2000-01-02_00-00-00", {"src/a.txt": "one", "src/docs/b.txt": "BEE!"})
+    make_snapshot(root, "2000-01-03_00-00-00", {"src/a.txt": "two", "src/docs/b.txt": "BEE!"})
+    return root
+
+
+def test_catalog_lists_trees_and_versions(destination: Path):
+    with SnapshotCatalog.open(destination) as catalog:
+        assert catalog.sync(destination) == 3
+        assert catalog.sync(destination) == 0
+        assert [(s.name, s.files, s.bytes) for s in catalog.snapshots()] == [
+            ("2000-01-03_00-00-00", 2, 7),
+            ("2000-01-02_00-00-00", 2, 7),
+            ("2000-01-01_00-00-00", 2, 6),
+        ]
+
+        entries, cursor = catalog.tree("2000-01-01_00-00-00", "src")
+        assert [(e["name"], e["type"], e["size"]) for e in entries] == [("a.txt", "file", 3), ("docs", "dir", 3)]
+        assert cursor is None
+        entries, cursor = catalog.tree("2000-01-01_00-00-00", "src", limit=1)
+        assert [e["name"] for e in entries] == ["a.txt"]
+        assert [e["name"] for e in catalog.tree("2000-01-01_00-00-00", "src", cursor, limit=1)[0]] == ["docs"]
+        with pytest.raises(UnknownSnapshotError):
+            catalog.tree("1999-01-01_00-00-00")
+
+        versions = catalog.versions("src/docs/b.txt")
+        assert [(v["snapshot"], v["changed"]) for v in versions] == [
+            ("2000-01-03_00-00-00", False),
+            ("2000-01-02_00-00-00", True),
+            ("2000-01-01_00-00-00", True),
+        ]
+        assert catalog.versions("src/missing.txt") == []
+
+        shutil.rmtree(destination / "2000-01-01_00-00-00")
+        assert catalog.sync(destination) == 0
+        assert len(catalog.versions("src/a.txt")) == 2
+
+
+def test_catalog_waits_for_the_newest_snapshot_to_finish(tmp_path: Path):
+    root = tmp_path / "dest"
+    make_snapshot(root, "2000-01-01_00-00-00", {"src/a.txt": "one"}, manifest=False)
+    with SnapshotCatalog.open(root) as catalog:
+        assert catalog.sync(root) == 0
+        assert catalog.sync(root, completed="2000-01-01_00-00-00") == 1
+        assert [e["name"] for e in catalog.tree("2000-01-01_00-00-00")[0]] == ["src"]
+
+
+def test_restore_paths_from_directory_and_chunk_snapshots(destination: Path, tmp_path: Path):
+    target = tmp_path / "restore"
+    assert restore_paths(destination / "2000-01-01_00-00-00", ["src/docs", "src/a.txt"], target, max_workers=2) == 2
+    assert (target / "src" / "docs" / "b.txt").read_text() == "bee"
+    assert (target / "src" / "a.txt").read_text() == "one"
+    with pytest.raises(FileNotFoundError):
+        restore_paths(destination / "2000-01-01_00-00-00", ["src/nope"], target)
+    for bad in [["../etc"], ["/etc"], []]:
+        with pytest.raises(ValueError):
+            check_restore_paths(bad)
+
+    source = tmp_path / "chunksrc"
+    (source / "sub").mkdir(parents=True)
+    for i in range(5):
+        (source / "sub" / f"{i}.bin").write_bytes(bytes([i]) * 1000)
+    chunk_snapshot = tmp_path / "chunks" / "2000-01-01_00-00-00"
+    backup_to_chunks([str(source)], chunk_snapshot, PathFilter())
+    assert restore_paths(chunk_snapshot, ["chunksrc/sub"], tmp_path / "chunk-restore", max_workers=3) == 5
+    assert (tmp_path / "chunk-restore" / "chunksrc" / "sub" / "4.bin").read_bytes() == b"\x04" * 1000
+
+
+def test_snapshot_api(destination: Path, tmp_path: Path):
+    config.save_config(
+        config.BackupConfig(destination=str(destination), selected_paths=[], allowed_roots=[str(tmp_path)])
+    )
+    client = TestClient(main.app)
+
+    resp = client.get("/api/snapshots")
+    assert [s["id"] for s in resp.json()["snapshots"]][0] == "2000-01-03_00-00-00"
+    resp = client.get("/api/snapshots/2000-01-03_00-00-00/tree", params={"path": "src/docs"})
+    assert [e["path"] for e in resp.json()["entries"]] == ["src/docs/b.txt"]
+    assert client.get("/api/snapshots/1999-01-01_00-00-00/tree").status_code == 404
+    resp = client.get("/api/versions", params={"path": "src/a.txt"})
+    assert [v["snapshot"] for v in resp.json()["versions"] if v["changed"]] == [
+        "2000-01-03_00-00-00",
+        "2000-01-01_00-00-00",
+    ]
+
+    url = "/api/snapshots/2000-01-01_00-00-00/restore"
+    assert client.post(url, json={"paths": ["src/a.txt"], "target": "/etc"}).status_code == 400
+    assert client.post(url, json={"paths": ["src/a.txt"], "target": str(destination / "x")}).status_code == 400
+    assert client.post(url, json={"paths": ["../x"], "target": str(tmp_path / "out")}).status_code == 400
+    resp = client.post(url, json={"paths": ["src/a.txt"], "target": str(tmp_path / "out")})
+    assert resp.status_code == 202
+    job = jobs.job_manager.get(resp.json()["job_id"])
+    assert job.wait(5)
+    assert job.status == "succeeded", job.error
+    assert (tmp_path / "out" / "src" / "a.txt").read_text() == "one"
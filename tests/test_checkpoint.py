@@ -0,0 +1,144 @@
+import os
+from pathlib import Path
+
+import pytest
+
+import app.backup.checkpoint as checkpoint
+import app.backup.config as config
+import app.backup.copier as copier
+import app.backup.engine as engine
+from app.backup.manifest import read_manifest
+from app.backup.retention import enforce_retention, parse_timestamped_dirs, wait_for_trash
+from app.backup.verify import verify_snapshot
+from tests.test_engine import freeze_time
+
+
+def interrupt_before_completion(monkeypatch: pytest.MonkeyPatch) -> None:
+    def power_cut(snapshot: Path) -> None:
+        raise RuntimeError("power cut")
+
+    monkeypatch.setattr(engine, "mark_complete", power_cut)
+
+
+def test_interrupted_run_is_resumed_into_the_same_snapshot(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    source = tmp_path / "src"
+    source.mkdir()
+    for name in ["keep.txt", "change.txt", "gone.txt"]:
+        (source / name).write_text(name)
+    cfg = config.BackupConfig(
+        destination=str(tmp_path / "dest"), selected_paths=[str(source)], allowed_roots=[str(tmp_path)]
+    )
+    config.save_config(cfg)
+    monkeypatch.setattr(engine, "has_rsync", lambda: False)
+    monkeypatch.setattr(checkpoint, "CHECKPOINT_INTERVAL", 0.0)
+
+    freeze_time(monkeypatch, "2000-01-01_00-00-00")
+    interrupt_before_completion(monkeypatch)
+    with pytest.raises(RuntimeError):
+        engine.run_backup(cfg)
+    snapshot = tmp_path / "dest" / "2000-01-01_00-00-00"
+    assert (snapshot / checkpoint.INCOMPLETE_MARKER).exists()
+    assert parse_timestamped_dirs(tmp_path / "dest") == []
+    completed, position = checkpoint.load_checkpoint(snapshot)
+    assert set(completed) == {"src/keep.txt", "src/change.txt", "src/gone.txt"}
+    assert position is not None
+
+    (source / "change.txt").write_text("changed!")
+    (source / "gone.txt").unlink()
+    (source / "new.txt").write_text("new")
+    # A file the interrupted run wrote but never checkpointed is not trusted.
+    (snapshot / "src" / "stray.txt").write_text("half")
+
+    monkeypatch.setattr(engine, "mark_complete", checkpoint.mark_complete)
+    freeze_time(monkeypatch, "2000-01-02_00-00-00")
+    copied: list = []
+    real_copy = copier.copy_file
+    monkeypatch.setattr(copier, "copy_file", lambda src, dst, hasher=None, limiter=None: copied.append(src.name) or real_copy(src, dst, hasher, limiter))
+    assert engine.run_backup(cfg) == snapshot
+
+    assert sorted(copied) == ["change.txt", "new.txt"]
+    assert sorted(p.name for p in (snapshot / "src").iterdir()) == ["change.txt", "keep.txt", "new.txt"]
+    assert (snapshot / "src" / "change.txt").read_text() == "changed!"
+    assert not (snapshot / checkpoint.INCOMPLETE_MARKER).exists()
+    assert not (snapshot / checkpoint.CHECKPOINT_NAME).exists()
+    assert {e["path"] for e in read_manifest(snapshot)} == {"src/keep.txt", "src/change.txt", "src/new.txt"}
+    assert verify_snapshot(snapshot).ok
+    assert parse_timestamped_dirs(tmp_path / "dest") == [snapshot]
+
+    record = engine.run_history().records()[0]
+    assert record.resumed and record.snapshot == snapshot.name
+    assert (record.files_resumed, record.files_copied) == (1, 2)
+
+
+def test_resume_discards_unverified_links_into_older_snapshots(tmp_path: Path):
+    older = tmp_path / "dest" / "2000-01-01_00-00-00" / "src"
+    older.mkdir(parents=True)
+    (older / "a.txt").write_text("old")
+    snapshot = tmp_path / "dest" / "2000-01-02_00-00-00"
+    (snapshot / "src").mkdir(parents=True)
+    os.link(older / "a.txt", snapshot / "src" / "a.txt")
+    checkpoint.mark_incomplete(snapshot, "run", "directory")
+
+    source = tmp_path / "src"
+    source.mkdir()
+    (source / "a.txt").write_text("new content")
+    stats = copier.copy_files(
+        [str(source)], snapshot, copier.PathFilter(), checkpoint=checkpoint.Checkpoint(snapshot, {})
+    )
+    assert stats.files_copied == 1
+    assert (older / "a.txt").read_text() == "old"
+    assert (snapshot / "src" / "a.txt").read_text() == "new content"
+
+
+def test_retention_removes_stale_incomplete_snapshots(tmp_path: Path):
+    root = tmp_path / "dest"
+    for name in ["2000-01-01_00-00-00", "2000-01-02_00-00-00", "2000-01-03_00-00-00"]:
+        (root / name).mkdir(parents=True)
+    checkpoint.mark_incomplete(root / "2000-01-01_00-00-00", "run", "directory")
+    checkpoint.mark_incomplete(root / "2000-01-03_00-00-00", "run", "chunks")
+    assert [p.name for p in parse_timestamped_dirs(root)] == ["2000-01-02_00-00-00"]
+    # Newest interrupted snapshot, but of another format: a new run starts from scratch.
+    assert engine._resumable_snapshot(root, "directory") is None
+    assert engine._resumable_snapshot(root, "chunks") == root / "2000-01-03_00-00-00"
+
+    enforce_retention(root, config.RetentionRules(keep_last=5))
+    assert wait_for_trash(timeout=10)
+    assert sorted(p.name for p in root.iterdir()) == ["2000-01-02_00-00-00"]
+
+
+def test_load_checkpoint_skips_a_torn_last_line(tmp_path: Path):
+    snapshot = tmp_path / "2000-01-01_00-00-00"
+    snapshot.mkdir()
+    writer = checkpoint.Checkpoint(snapshot, interval=0)
+    writer.record([{"path": "src/a", "size": 1, "mtime_ns": 2, "sha256": "x"}], "src/a")
+    writer.close()
+    with (snapshot / checkpoint.CHECKPOINT_NAME).open("a") as f:
+        f.write('{"path": "src/b", "si')
+    writer = checkpoint.Checkpoint(snapshot, interval=0)
+    writer.record([{"path": "src/c", "size": 3, "mtime_ns": 4, "sha256": None}])
+    writer.close()
+    completed, position = checkpoint.load_checkpoint(snapshot)
+    assert completed == {"src/a": (1, 2, "x"), "src/c": (3, 4, None)}
+    assert position == "src/a"
+
+
+def test_checkpoints_sync_only_the_destination_filesystem(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    source = tmp_path / "src"
+    source.mkdir()
+    (source / "a.txt").write_text("a")
+    cfg = config.BackupConfig(
+        destination=str(tmp_path / "dest"), selected_paths=[str(source)], allowed_roots=[str(tmp_path)]
+    )
+    config.save_config(cfg)
+    monkeypatch.setattr(engine, "has_rsync", lambda: False)
+    monkeypatch.setattr(checkpoint, "CHECKPOINT_INTERVAL", 0.0)
+    monkeypatch.setattr(checkpoint.os, "sync", lambda: pytest.fail("os.sync() flushes every mounted filesystem"))
+    synced = []
+    monkeypatch.setattr(checkpoint, "_syncfs", lambda fd: synced.append(os.fstat(fd).st_dev) or 0)
+
+    engine.run_backup(cfg)
+    assert synced and set(synced) == {(tmp_path / "dest").stat().st_dev}
+
+    monkeypatch.setattr(checkpoint, "_syncfs", lambda fd: -1)
+    with pytest.raises(OSError):
+        checkpoint.sync_filesystem(tmp_path)
@@ -0,0 +1,169 @@
+import io
+import random
+import time
+from pathlib import Path
+
+import pytest
+
+import app.backup.chunkstore as chunkstore
+import app.backup.config as config
+import app.backup.engine as engine
+import app.backup.retention as retention
+from app.backup.filters import PathFilter
+from app.backup.manifest import path_key, read_manifest, snapshot_format
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(chunkstore, "MIN_CHUNK_SIZE", 1024)
+    monkeypatch.setattr(chunkstore, "MAX_CHUNK_SIZE", 16 * 1024)
+    monkeypatch.setattr(chunkstore, "CHUNK_MASK", 0xFFF00000)
+
+
+def random_bytes(size: int, seed: int) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+def test_chunk_boundaries_follow_content():
+    data = random_bytes(200_000, 1)
+    original = list(chunkstore.iter_chunks(io.BytesIO(data)))
+    edited = list(chunkstore.iter_chunks(io.BytesIO(b"inserted" + data)))
+
+    assert b"".join(original) == data
+    assert all(len(chunk) <= 16 * 1024 for chunk in original)
+    shared = set(original) & set(edited)
+    assert len(shared) >= len(original) - 2
+
+
+def reference_boundary(data: bytes, start: int, end: int, mask: int) -> int:
+    # The gear hash byte by byte, as the boundary search used to do it.
+    h = 0
+    for i in range(start, end):
+        h = ((h << 1) + chunkstore._GEAR[data[i]]) & 0xFFFFFFFF
+        if not h & mask:
+            return i + 1
+    return end
+
+
+BOUNDARY_SEARCHES = [
+    pytest.param(
+        "_find_boundary_numpy",
+        marks=pytest.mark.skipif(chunkstore.numpy is None, reason="numpy is not installed"),
+    ),
+    "_find_boundary_int",
+]
+
+
+@pytest.mark.parametrize("search", BOUNDARY_SEARCHES)
+def test_boundary_search_matches_byte_by_byte_hash(search: str, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(chunkstore, "SCAN_BLOCK", 1000)
+    find = getattr(chunkstore, search)
+    data = bytearray(random_bytes(60_000, 3))
+    for mask in (0xF0000000, 0xFFF00000, 0xFFFF0000, chunkstore.CHUNK_MASK):
+        for start in (0, 1, 31, 999, 1000, 4321):
+            assert find(data, start, len(data), mask) == reference_boundary(data, start, len(data), mask)
+    zeros = bytearray(5000)
+    assert find(zeros, 7, len(zeros), 0xFFF00000) == reference_boundary(zeros, 7, len(zeros), 0xFFF00000)
+
+
+@pytest.mark.parametrize("search,speedup", [("_find_boundary_int", 2), ("_find_boundary_numpy", 10)])
+def test_boundary_search_throughput(search: str, speedup: int):
+    # Relative to the byte-by-byte hash on the same machine, so slow runners do not fail it.
+    if search == "_find_boundary_numpy" and chunkstore.numpy is None:
+        pytest.skip("numpy is not installed")
+    find = getattr(chunkstore, search)
+    data = bytearray(random_bytes(1 << 20, 4))
+    # Never satisfied, so the whole buffer is scanned.
+    mask = 0xFFFFFFFF
+    started = time.perf_counter()
+    reference_boundary(data, 0, len(data) // 8, mask)
+    reference = 8 * (time.perf_counter() - started)
+    started = time.perf_counter()
+    assert find(data, 0, len(data), mask) == len(data)
+    assert time.perf_counter() - started < reference / speedup
+
+
+def test_chunk_snapshots_dedupe_restore_and_collect_garbage(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    source = tmp_path / "src"
+    source.mkdir()
+    image = random_bytes(300_000, 2)
+    (source / "disk.img").write_bytes(image)
+    (source / "copy.img").write_bytes(image)
+    destination_root = tmp_path / "dest"
+    cfg = config.BackupConfig(
+        destination=str(destination_root),
+        selected_paths=[str(source)],
+        allowed_roots=[str(tmp_path)],
+        destination_format="chunks",
+        retention=config.RetentionRules(keep_last=None),
+    )
+    config.save_config(cfg)
+
+    first = engine.run_backup(cfg)
+    first = first.rename(destination_root / "2000-01-01_00-00-00")
+    assert snapshot_format(first) == "chunks"
+    store = chunkstore.ChunkStore(destination_root / chunkstore.CHUNK_DIR)
+    initial_chunks = {p.name for p in store.iter_digests()}
+    assert sum(len(chunk) for chunk in map(store.get, initial_chunks)) == len(image)
+
+    edited = bytearray(image)
+    edited[150_000:150_010] = b"0123456789"
+    (source / "disk.img").write_bytes(bytes(edited))
+    second = engine.run_backup(cfg)
+    new_chunks = {p.name for p in store.iter_digests()} - initial_chunks
+    assert 0 < len(new_chunks) <= 3
+
+    restored = tmp_path / "restored"
+    assert chunkstore.restore_snapshot(second, restored, ["src/disk.img"]) == 1
+    assert (restored / "src" / "disk.img").read_bytes() == bytes(edited)
+    assert not (restored / "src" / "copy.img").exists()
+
+    retention.enforce_retention(destination_root, config.RetentionRules(keep_last=1))
+    live = chunkstore.chunk_references(retention.parse_timestamped_dirs(destination_root))
+    assert {p.name for p in store.iter_digests()} == set(live)
+    assert all(entry["chunks"] for entry in read_manifest(second))
+
+
+def test_unchanged_files_reuse_chunks_by_merge_walk(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    source = tmp_path / "src"
+    for i, rel in enumerate(["a-b", "a/z", "a/b/c", "b", "0"]):
+        (source / rel).parent.mkdir(parents=True, exist_ok=True)
+        (source / rel).write_bytes(random_bytes(3000, 10 + i))
+    first = tmp_path / "dest" / "2000-01-01_00-00-00"
+    chunkstore.backup_to_chunks([str(source)], first, PathFilter())
+    paths = [entry["path"] for entry in read_manifest(first)]
+    assert paths == sorted(paths, key=path_key) and len(paths) == 5
+
+    (source / "a" / "z").write_bytes(b"changed")
+    stored: list = []
+    real_store = chunkstore._store_file
+
+    def store_file(item, *args):
+        stored.append(item.relative.as_posix())
+        return real_store(item, *args)
+
+    monkeypatch.setattr(chunkstore, "_store_file", store_file)
+    second = tmp_path / "dest" / "2000-01-02_00-00-00"
+    stats = chunkstore.backup_to_chunks([str(source)], second, PathFilter(), previous=first)
+    assert stored == ["src/a/z"] and stats.files_linked == 4
+    assert [entry["path"] for entry in read_manifest(second)] == paths
+
+
+def test_unexpected_store_errors_are_counted(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    source = tmp_path / "src"
+    source.mkdir()
+    (source / "good.bin").write_bytes(random_bytes(5000, 5))
+    (source / "bad.bin").write_bytes(random_bytes(5000, 6))
+    real_put = chunkstore.ChunkStore.put
+    bad_chunk = next(chunkstore.iter_chunks(io.BytesIO((source / "bad.bin").read_bytes())))
+
+    def put(self, data: bytes):
+        if data == bad_chunk:
+            raise RuntimeError("index is corrupt")
+        return real_put(self, data)
+
+    monkeypatch.setattr(chunkstore.ChunkStore, "put", put)
+    snapshot = tmp_path / "dest" / "2000-01-01_00-00-00"
+    stats = chunkstore.backup_to_chunks([str(source)], snapshot, PathFilter())
+    assert (stats.errors, stats.files_copied) == (1, 1)
+    assert [entry["path"] for entry in read_manifest(snapshot)] == ["src/good.bin"]
@@ -37,3 +37,37 @@ def test_ensure_default_config_creates_file(tmp_path: Path):
 
     config.ensure_default_config()
     assert cfg_file.exists()
+
+
+def test_load_config_is_cached_until_file_changes(tmp_path: Path, monkeypatch):
+    config.save_config(config.BackupConfig(destination=str(tmp_path / "one")))
+    first = config.load_config()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("cached config should not be re-parsed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(config.json, "load", fail)
+        second = config.load_config()
+        assert second.destination == first.destination
+        second.selected_paths.append("/mutated")
+        assert "/mutated" not in config.load_config().selected_paths
+
+    # An edit made behind the app's back (different size) is picked up.
+    config.get_config_path().write_text('{"destination": "/elsewhere/longer/path"}')
+    assert config.load_config().destination == "/elsewhere/longer/path"
+
+
+def test_allowed_roots_table(tmp_path: Path):
+    root = tmp_path / "root"
+    (root / "child").mkdir(parents=True)
+    link = tmp_path / "link"
+    link.symlink_to(root)
+
+    roots = config.get_allowed_roots([str(link), str(tmp_path / "missing")])
+    assert roots is config.get_allowed_roots([str(link), str(tmp_path / "missing")])
+    assert roots.contains(root.resolve())
+    assert roots.contains((root / "child" / "file").resolve())
+    assert not roots.contains(tmp_path.resolve())
+    assert not roots.contains(Path(str(root) + "-sibling"))
+    assert config.AllowedRoots(["/"]).contains(Path("/anything"))
@@ -0,0 +1,74 @@
+from pathlib import Path
+
+import pytest
+
+import app.backup.copier as copier
+from app.backup.filters import PathFilter
+
+
+def build_tree(root: Path, count: int) -> None:
+    for index in range(count):
+        path = root / f"dir{index % 3}" / f"file{index}.txt"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"payload {index}")
+
+
+def test_copy_files_copies_tree_with_worker_pool(tmp_path: Path):
+    source = tmp_path / "src"
+    build_tree(source, 25)
+    (source / "skip.log").write_text("ignored")
+
+    stats = copier.copy_files(
+        [str(source)], tmp_path / "dest", PathFilter(exclude_patterns=["*.log"]), max_workers=3
+    )
+
+    copied = sorted(p.relative_to(tmp_path / "dest" / "src") for p in (tmp_path / "dest").rglob("*.txt"))
+    assert len(copied) == 25
+    assert not (tmp_path / "dest" / "src" / "skip.log").exists()
+    assert stats.files_scanned == 25
+    assert stats.files_copied == 25
+    assert stats.bytes_copied == sum((source / p).stat().st_size for p in copied)
+    assert stats.errors == 0
+
+
+def test_copy_files_continues_after_file_error(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    source = tmp_path / "src"
+    build_tree(source, 6)
+    real_copy = copier.copy_file
+
+    def flaky_copy(src, dst, hasher=None, limiter=None):
+        if Path(src).name == "file2.txt":
+            raise PermissionError("denied")
+        return real_copy(src, dst, hasher)
+
+    monkeypatch.setattr(copier, "copy_file", flaky_copy)
+    stats = copier.copy_files([str(source)], tmp_path / "dest", PathFilter(), max_workers=2)
+
+    assert stats.errors == 1
+    assert stats.files_copied == 5
+    assert not (tmp_path / "dest" / "src" / "dir2" / "file2.txt").exists()
+
+
+def test_copy_files_counts_unexpected_worker_errors(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    source = tmp_path / "src"
+    build_tree(source, 6)
+    real_copy = copier.copy_file
+
+    def broken_copy(src, dst, hasher=None, limiter=None):
+        if Path(src).name == "file3.txt":
+            raise ValueError("surrogates not allowed")
+        return real_copy(src, dst, hasher)
+
+    monkeypatch.setattr(copier, "copy_file", broken_copy)
+    stats = copier.copy_files([str(source)], tmp_path / "dest", PathFilter(), max_workers=2)
+    assert (stats.errors, stats.files_copied) == (1, 5)
+
+
+def test_copy_files_prunes_excluded_directories(tmp_path: Path):
+    source = tmp_path / "src"
+    build_tree(source, 6)
+
+    stats = copier.copy_files([str(source)], tmp_path / "dest", PathFilter(exclude_patterns=["/src/dir1/"]))
+
+    assert stats.files_copied == 4
+    assert not (tmp_path / "dest" / "src" / "dir1").exists()
@@ -0,0 +1,98 @@
+import os
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.backup.config as config
+import app.backup.dirsizes as dirsizes
+import app.main as main
+from app.backup.filesystem import browse_directory
+
+
+def make_tree(root: Path) -> None:
+    (root / "a" / "deep").mkdir(parents=True)
+    (root / "b").mkdir()
+    (root / "top.txt").write_bytes(b"x" * 10)
+    (root / "a" / "one.txt").write_bytes(b"x" * 100)
+    (root / "a" / "deep" / "two.txt").write_bytes(b"x" * 1000)
+    (root / "b" / "three.txt").write_bytes(b"x" * 5)
+
+
+def count_scandirs(monkeypatch: pytest.MonkeyPatch) -> list:
+    listed: list = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(dirsizes.os, "scandir", lambda path: listed.append(path) or real_scandir(path))
+    return listed
+
+
+def test_refresh_only_rereads_changed_directories(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    root = tmp_path / "root"
+    make_tree(root)
+    with dirsizes.DirSizeIndex(tmp_path / "sizes.sqlite") as index:
+        assert index.refresh(str(root)) == (4, 4)
+        sizes = index.lookup([str(root), str(root / "a"), str(root / "b")])
+        assert sizes[str(root)] == dirsizes.DirSize(files=4, bytes=1115)
+        assert sizes[str(root / "a")] == dirsizes.DirSize(files=2, bytes=1100)
+
+        listed = count_scandirs(monkeypatch)
+        writes = index._conn.total_changes
+        assert index.refresh(str(root)) == (4, 0)
+        assert listed == []
+        assert index._conn.total_changes == writes
+
+        # A new file changes only its directory's mtime; the ancestors' totals still follow,
+        # and the untouched sibling's row is not rewritten.
+        (root / "a" / "deep" / "new.txt").write_bytes(b"x" * 50)
+        assert index.refresh(str(root)) == (4, 1)
+        assert listed == [str(root / "a" / "deep")]
+        assert index._conn.total_changes == writes + 3
+        assert index.lookup([str(root)])[str(root)] == dirsizes.DirSize(files=5, bytes=1165)
+
+        for child in (root / "b").iterdir():
+            child.unlink()
+        (root / "b").rmdir()
+        index.refresh(str(root))
+        assert str(root / "b") not in index.lookup([str(root / "b")])
+        assert index.lookup([str(root)])[str(root)] == dirsizes.DirSize(files=4, bytes=1160)
+
+
+def test_refresh_drops_removed_subtrees(tmp_path: Path):
+    root = tmp_path / "root"
+    make_tree(root)
+    (root / "a" / "deep" / "deeper").mkdir()
+    with dirsizes.DirSizeIndex(tmp_path / "sizes.sqlite") as index:
+        assert index.refresh(str(root)) == (5, 5)
+        (root / "a").rename(root / "moved")
+        # The moved directories are new paths and are read; the old rows go with the parent.
+        assert index.refresh(str(root)) == (5, 4)
+        gone = [str(root / "a"), str(root / "a" / "deep"), str(root / "a" / "deep" / "deeper")]
+        assert index.lookup(gone) == {}
+        assert index.lookup([str(root / "moved" / "deep")])[str(root / "moved" / "deep")] == dirsizes.DirSize(1, 1000)
+        assert index.lookup([str(root)])[str(root)] == dirsizes.DirSize(files=4, bytes=1115)
+
+
+def test_selection_total_counts_nested_paths_once(tmp_path: Path):
+    root = tmp_path / "root"
+    make_tree(root)
+    (root / "c").mkdir()
+    with dirsizes.DirSizeIndex(tmp_path / "sizes.sqlite") as index:
+        index.refresh(str(root / "a"))
+        total = index.selection_total([str(root / "a"), str(root / "a" / "deep"), str(root / "top.txt"), str(root / "c")])
+    assert total.to_dict() == {"files": 3, "bytes": 1110, "pending": 1}
+
+
+def test_browse_includes_cached_totals(tmp_path: Path):
+    root = tmp_path / "root"
+    make_tree(root)
+    config.save_config(config.BackupConfig(selected_paths=[str(root / "a")], allowed_roots=[str(tmp_path)]))
+    dirsizes.DirSizeIndexer(interval=0).refresh_all()
+
+    entries = {e["name"]: e for e in browse_directory(root).entries}
+    assert (entries["a"]["total_files"], entries["a"]["total_size"]) == (2, 1100)
+    assert "total_size" not in entries["top.txt"]
+
+    client = TestClient(main.app)
+    resp = client.get("/api/browse", params={"path": str(root)})
+    assert resp.json()["selection"] == {"files": 2, "bytes": 1100, "pending": 0}
+    assert "1.1 kB" in client.get("/browse", params={"path": str(root)}).text
@@ -1,11 +1,21 @@
+import io
 import logging
+import os
+import threading
+from datetime import datetime
 from pathlib import Path
 from typing import List
+from unittest import mock
 
 import pytest
 
 import app.backup.config as config
 import app.backup.engine as engine
+import app.backup.retention as retention
+import app.backup.verify as verify
+from app.backup.locking import DestinationLock, DestinationLockedError
+from app.backup.manifest import read_manifest
+from app.backup.progress import Progress, RsyncOutputParser
 
 
 @pytest.fixture
@@ -61,6 +71,35 @@ def test_run_backup_with_shutil_copy(tmp_path: Path, monkeypatch: pytest.MonkeyP
     assert "skip.log" not in names
 
 
+class FakePopen:
+    # Stands in for subprocess.Popen: records each rsync command and replays canned output.
+    def __init__(self, output: bytes = b"", returncode=lambda cmd: 0) -> None:
+        self.output = output
+        self.returncode = returncode
+        self.calls: list[list[str]] = []
+
+    def __call__(self, cmd, stdout=None, stderr=None):
+        self.calls.append(cmd)
+        code = self.returncode(cmd)
+        process = mock.MagicMock()
+        process.__enter__.return_value = process
+        process.stdout = io.BytesIO(self.output)
+        process.wait.return_value = code
+        return process
+
+
+RSYNC_OUTPUT = (
+    b"sending incremental file list\n"
+    b">f+++++++++ src/include.txt\n"
+    b"          7  50%    1.00kB/s    0:00:00 (xfr#1, ir-chk=1/3)\r"
+    b"         14 100%    2.50MB/s    0:00:00 (xfr#2, to-chk=0/3)\n"
+    b"\nNumber of files: 3 (reg: 2, dir: 1)\n"
+    b"Number of regular files transferred: 2\n"
+    b"Total file size: 20 bytes\n"
+    b"Total transferred file size: 14 bytes\n"
+)
+
+
 def test_run_backup_with_rsync(monkeypatch: pytest.MonkeyPatch, source_setup, tmp_path: Path):
     source_root, _ = source_setup
     destination_root = tmp_path / "dest"
@@ -74,23 +113,203 @@ def test_run_backup_with_rsync(monkeypatch: pytest.MonkeyPatch, source_setup, tm
     config.save_config(cfg)
 
     monkeypatch.setattr(engine, "has_rsync", lambda: True)
-    calls: list[list[str]] = []
-
-    def fake_run(cmd, check):  # type: ignore[override]
-        calls.append(cmd)
+    fake = FakePopen(RSYNC_OUTPUT)
+    monkeypatch.setattr(engine.subprocess, "Popen", fake)
 
-    monkeypatch.setattr(engine.subprocess, "run", fake_run)
-
-    destination = engine.run_backup()
+    progress = Progress()
+    destination = engine.run_backup(progress=progress)
     assert destination_root.exists()
-    assert calls, "rsync should be invoked"
-    cmd = calls[0]
+    assert fake.calls, "rsync should be invoked"
+    cmd = fake.calls[0]
     assert "--include" in cmd and "--exclude" in cmd
+    assert "--itemize-changes" in cmd and "--stats" in cmd
+
+    snapshot = progress.snapshot()
+    assert snapshot["bytes_done"] == 14
+    assert snapshot["files_done"] == 3 and snapshot["files_total"] == 3
+    assert snapshot["scan_complete"] is True
+    assert snapshot["current"] == "src/include.txt"
+    record = engine.run_history().records()[0]
+    assert record.engine == "rsync"
+    assert (record.files_scanned, record.files_copied) == (3, 2)
+    assert (record.bytes_copied, record.bytes_skipped) == (14, 6)
+
+
+def test_rsync_hash_errors_make_the_run_partial(monkeypatch: pytest.MonkeyPatch, source_setup, tmp_path: Path):
+    source_root, _ = source_setup
+    cfg = config.BackupConfig(
+        destination=str(tmp_path / "dest"), selected_paths=[str(source_root)], allowed_roots=[str(tmp_path)]
+    )
+    config.save_config(cfg)
+    monkeypatch.setattr(engine, "has_rsync", lambda: True)
+    fake = FakePopen(RSYNC_OUTPUT)
+
+    def copying(cmd, stdout=None, stderr=None):
+        # What rsync would have written into the snapshot.
+        for name in ["ok.txt", "unreadable.txt"]:
+            (Path(cmd[-1]) / "src" / name).parent.mkdir(parents=True, exist_ok=True)
+            (Path(cmd[-1]) / "src" / name).write_text(name)
+        return fake(cmd, stdout, stderr)
+
+    monkeypatch.setattr(engine.subprocess, "Popen", copying)
+    real_hash = verify.hash_file
+
+    def hash_file(path: Path) -> str:
+        if path.name == "unreadable.txt":
+            raise PermissionError(13, "Permission denied", str(path))
+        return real_hash(path)
+
+    monkeypatch.setattr(verify, "hash_file", hash_file)
+    snapshot = engine.run_backup()
+    record = engine.run_history().records()[0]
+    assert (record.engine, record.status, record.errors) == ("rsync", "partial", 1)
+    assert record.profile["counters"]["hash.files"] == 1
+    assert [entry["path"] for entry in read_manifest(snapshot)] == ["src/ok.txt"]
+
+
+def test_rsync_output_parser():
+    parser = RsyncOutputParser()
+    event = parser.feed("  1,234,567  45%   12.34MB/s    0:00:10 (xfr#12, ir-chk=100/200)")
+    assert event is not None and event.kind == "progress"
+    assert (event.bytes_transferred, event.percent, event.rate) == (1234567, 45, 12.34e6)
+    assert (event.files_transferred, event.files_to_check, event.files_total) == (12, 100, 200)
+    assert event.file_list_complete is False
+    assert parser.feed("    999 100%    0.00kB/s    0:00:00  ").files_total is None
+    itemized = parser.feed(">f.st...... home/notes.txt")
+    assert itemized.kind == "file" and itemized.path == "home/notes.txt"
+    assert parser.feed("rsync: some warning") is None
+    parser.feed("Total file size: 1,024 bytes")
+    assert parser.totals == {"bytes_total": 1024}
+
+
+def freeze_time(monkeypatch: pytest.MonkeyPatch, stamp: str) -> None:
+    frozen = datetime.strptime(stamp, "%Y-%m-%d_%H-%M-%S")
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):  # type: ignore[override]
+            return frozen
+
+    monkeypatch.setattr(engine, "datetime", FrozenDatetime)
+
+
+@pytest.fixture
+def incremental_config(tmp_path: Path, source_setup) -> config.BackupConfig:
+    source_root, _ = source_setup
+    cfg = config.BackupConfig(
+        destination=str(tmp_path / "dest"),
+        selected_paths=[str(source_root)],
+        allowed_roots=[str(tmp_path)],
+        incremental=True,
+        retention=config.RetentionRules(keep_last=None),
+    )
+    config.save_config(cfg)
+    return cfg
+
+
+def test_incremental_retention_keeps_linked_files(
+    monkeypatch: pytest.MonkeyPatch, source_setup, incremental_config: config.BackupConfig
+):
+    source_root, _ = source_setup
+    monkeypatch.setattr(engine, "has_rsync", lambda: False)
+    freeze_time(monkeypatch, "2000-01-01_00-00-00")
+    previous = engine.run_backup(incremental_config)
+    (source_root / "include.txt").write_text("changed contents")
+
+    freeze_time(monkeypatch, "2000-01-02_00-00-00")
+    incremental_config.retention = config.RetentionRules(keep_last=1)
+    latest = engine.run_backup(incremental_config)
+
+    unchanged = latest / source_root.name / "nested" / "keep.me"
+    changed = latest / source_root.name / "include.txt"
+    assert not previous.exists(), "retention should prune the older snapshot"
+    assert retention.wait_for_trash(timeout=10)
+    assert unchanged.read_text() == "nested/keep.me"
+    assert unchanged.stat().st_nlink == 1
+    assert changed.read_text() == "changed contents"
+
+
+def test_incremental_shutil_reuses_previous_inode(
+    monkeypatch: pytest.MonkeyPatch, source_setup, incremental_config: config.BackupConfig
+):
+    source_root, _ = source_setup
+    monkeypatch.setattr(engine, "has_rsync", lambda: False)
+    freeze_time(monkeypatch, "2000-01-01_00-00-00")
+    previous = engine.run_backup(incremental_config)
+    (source_root / "include.txt").write_text("changed contents")
+
+    freeze_time(monkeypatch, "2000-01-02_00-00-00")
+    latest = engine.run_backup(incremental_config)
+    old_file = previous / source_root.name / "nested" / "keep.me"
+    new_file = latest / source_root.name / "nested" / "keep.me"
+    assert new_file.stat().st_ino == old_file.stat().st_ino
+    assert (latest / source_root.name / "include.txt").stat().st_ino != (
+        previous / source_root.name / "include.txt"
+    ).stat().st_ino
+
+
+def test_incremental_rsync_passes_link_dest(monkeypatch: pytest.MonkeyPatch, incremental_config: config.BackupConfig):
+    previous = Path(incremental_config.destination) / "2000-01-01_00-00-00"
+    previous.mkdir(parents=True)
+    monkeypatch.setattr(engine, "has_rsync", lambda: True)
+    fake = FakePopen()
+    monkeypatch.setattr(engine.subprocess, "Popen", fake)
+
+    engine.run_backup(incremental_config)
+    assert f"--link-dest={previous.resolve()}" in fake.calls[0]
+
+
+def fs_groups(paths, devices):
+    groups: dict[str, list[str]] = {}
+    for path in paths:
+        groups.setdefault(devices[path], []).append(path)
+    return list(groups.values())
+
+
+def test_parallel_rsync_runs_device_lanes_concurrently(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    sources = [str(tmp_path / name) for name in ["sd", "ssd", "ssd2"]]
+    devices = {sources[0]: "mmcblk0", sources[1]: "sda", sources[2]: "sda"}
+    monkeypatch.setattr(engine, "group_by_device", lambda paths: fs_groups(paths, devices))
+    barrier = threading.Barrier(2, timeout=5)
+
+    def exit_status(cmd):
+        if cmd[-2] in (sources[0], sources[1]):
+            barrier.wait()  # only returns if both lanes are running at the same time
+        return 23 if cmd[-2] == sources[2] else 0
+
+    fake = FakePopen(returncode=exit_status)
+    monkeypatch.setattr(engine.subprocess, "Popen", fake)
+    with pytest.raises(engine.subprocess.CalledProcessError) as excinfo:
+        engine._run_rsync(sources, tmp_path / "dest", [], [], concurrency=2)
+    assert excinfo.value.returncode == 23
+    calls = [cmd[-2] for cmd in fake.calls]
+    assert sorted(calls) == sorted(sources)
+    assert calls.index(sources[1]) < calls.index(sources[2])
+
+
+def test_run_backup_refuses_locked_destination(
+    monkeypatch: pytest.MonkeyPatch, incremental_config: config.BackupConfig, capsys
+):
+    monkeypatch.setattr(engine, "has_rsync", lambda: False)
+    destination_root = Path(incremental_config.destination)
+    destination_root.mkdir(parents=True)
+    with DestinationLock(destination_root):
+        with pytest.raises(DestinationLockedError, match=f"pid {os.getpid()}"):
+            engine.run_backup(incremental_config)
+        with pytest.raises(SystemExit) as excinfo:
+            engine.main([])
+    assert excinfo.value.code == 75
+    assert "already running" in capsys.readouterr().out
+    assert engine.run_history().records()[0].status == "skipped"
+    assert engine.parse_timestamped_dirs(destination_root) == []
+
+    # Released on exit, so the next run goes ahead.
+    assert engine.run_backup(incremental_config).exists()
 
 
 def test_engine_main_outputs(capsys, monkeypatch: pytest.MonkeyPatch):
     expected_path = Path("/tmp/destination")
-    monkeypatch.setattr(engine, "run_backup", lambda: expected_path)
-    engine.main()
+    monkeypatch.setattr(engine, "run_backup", lambda sampler=None: expected_path)
+    engine.main([])
     captured = capsys.readouterr()
     assert str(expected_path) in captured.out
@@ -0,0 +1,134 @@
+import errno
+import os
+from pathlib import Path
+
+import pytest
+
+import app.backup.fastcopy as fastcopy
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    fastcopy.reset_fallback_cache()
+    yield
+    fastcopy.reset_fallback_cache()
+
+
+@pytest.fixture
+def source(tmp_path: Path) -> Path:
+    path = tmp_path / "source.bin"
+    path.write_bytes(os.urandom(300_000) + b"tail")
+    path.chmod(0o640)
+    os.utime(path, ns=(1_600_000_000_123_456_789, 1_600_000_000_123_456_789))
+    return path
+
+
+def assert_copied(src: Path, dst: Path) -> None:
+    assert dst.read_bytes() == src.read_bytes()
+    assert dst.stat().st_mode == src.stat().st_mode
+    assert dst.stat().st_mtime_ns == src.stat().st_mtime_ns
+
+
+@pytest.mark.parametrize("method", ["copy_file_range", "sendfile", "buffered"])
+def test_each_method_copies_data_and_metadata(
+    tmp_path: Path, source: Path, monkeypatch: pytest.MonkeyPatch, method: str
+):
+    if method == "copy_file_range" and not hasattr(os, "copy_file_range"):
+        pytest.skip("copy_file_range not available")
+    monkeypatch.setattr(fastcopy, "KERNEL_CHUNK", 65_536)  # several calls per file
+    monkeypatch.setattr(fastcopy, "COPY_BUFFER_SIZE", 65_536)
+    monkeypatch.setattr(fastcopy, "TIERS", [t for t in fastcopy.TIERS if t[0] == method])
+    dst = tmp_path / "copy.bin"
+    assert fastcopy.copy_file(source, dst) == method
+    assert_copied(source, dst)
+
+
+def test_falls_back_and_remembers_unsupported_methods(
+    tmp_path: Path, source: Path, monkeypatch: pytest.MonkeyPatch
+):
+    calls: list[str] = []
+
+    def unsupported(name):
+        def transfer(src_fd, dst_fd, size, hasher=None, limiter=None):
+            calls.append(name)
+            os.write(dst_fd, b"partial")  # must not leak into the final copy
+            raise fastcopy._Unsupported(OSError(errno.EXDEV, "cross-device"))
+
+        return transfer
+
+    monkeypatch.setattr(
+        fastcopy,
+        "TIERS",
+        [("reflink", unsupported("reflink")), ("copy_file_range", unsupported("copy_file_range"))]
+        + fastcopy.TIERS[2:],
+    )
+    assert fastcopy.copy_file(source, tmp_path / "one") == "sendfile"
+    assert fastcopy.copy_file(source, tmp_path / "two") == "sendfile"
+    assert calls == ["reflink", "copy_file_range"]
+    assert_copied(source, tmp_path / "two")
+
+
+def test_per_file_errors_do_not_demote_later_files(tmp_path: Path, source: Path, monkeypatch: pytest.MonkeyPatch):
+    if not hasattr(os, "copy_file_range"):
+        pytest.skip("copy_file_range not available")
+    refused = []
+    real_copy_range = os.copy_file_range
+
+    def copy_range(src_fd, dst_fd, count):
+        # One file the kernel refuses, e.g. an append-only or immutable one.
+        if not refused:
+            refused.append(count)
+            raise OSError(errno.EPERM, "Operation not permitted")
+        return real_copy_range(src_fd, dst_fd, count)
+
+    monkeypatch.setattr(fastcopy.os, "copy_file_range", copy_range)
+    monkeypatch.setattr(fastcopy, "TIERS", fastcopy.TIERS[1:])
+    assert fastcopy.copy_file(source, tmp_path / "one") == "sendfile"
+    assert fastcopy.copy_file(source, tmp_path / "two") == "copy_file_range"
+    assert_copied(source, tmp_path / "two")
+
+    # A filesystem without the feature is remembered, until the next run resets the cache.
+    def cross_device(src_fd, dst_fd, count):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(fastcopy.os, "copy_file_range", cross_device)
+    assert fastcopy.copy_file(source, tmp_path / "three") == "sendfile"
+    monkeypatch.setattr(fastcopy.os, "copy_file_range", real_copy_range)
+    assert fastcopy.copy_file(source, tmp_path / "four") == "sendfile"
+    fastcopy.reset_fallback_cache()
+    assert fastcopy.copy_file(source, tmp_path / "five") == "copy_file_range"
+
+
+def test_real_errors_are_not_swallowed(tmp_path: Path, source: Path, monkeypatch: pytest.MonkeyPatch):
+    def full_disk(src_fd, dst_fd):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(fastcopy.fcntl, "ioctl", lambda fd, request, arg: full_disk(arg, fd))
+    with pytest.raises(OSError) as excinfo:
+        fastcopy.copy_file(source, tmp_path / "copy.bin")
+    assert excinfo.value.errno == errno.ENOSPC
+
+
+def test_empty_files_are_created(tmp_path: Path):
+    src = tmp_path / "empty"
+    src.touch()
+    assert fastcopy.copy_file(src, tmp_path / "copy") == "empty"
+    assert (tmp_path / "copy").read_bytes() == b""
+
+
+@pytest.mark.parametrize("reflink_works", [True, False])
+def test_hashing_copy_reads_once(tmp_path: Path, source: Path, monkeypatch: pytest.MonkeyPatch, reflink_works: bool):
+    import hashlib
+    import shutil
+
+    def fake_ioctl(dst_fd, request, src_fd):
+        if not reflink_works:
+            raise OSError(errno.EOPNOTSUPP, "no reflink")
+        shutil.copyfileobj(os.fdopen(os.dup(src_fd), "rb"), os.fdopen(os.dup(dst_fd), "wb"))
+
+    monkeypatch.setattr(fastcopy.fcntl, "ioctl", fake_ioctl)
+    hasher = hashlib.sha256()
+    method = fastcopy.copy_file(source, tmp_path / "copy.bin", hasher)
+    assert method == ("reflink" if reflink_works else "buffered")
+    assert hasher.hexdigest() == hashlib.sha256(source.read_bytes()).hexdigest()
+    assert_copied(source, tmp_path / "copy.bin")
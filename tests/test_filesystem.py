@@ -58,3 +58,79 @@ def test_has_rsync(monkeypatch: pytest.MonkeyPatch):
     assert fs.has_rsync()
     monkeypatch.setattr("shutil.which", lambda name: None)
     assert not fs.has_rsync()
+
+
+def test_browse_directory_paginates_with_cursor(prepared_root: Path):
+    (prepared_root / "sub").mkdir()
+    for index in range(7):
+        (prepared_root / f"file{index}.txt").write_text("x" * index)
+    (prepared_root / "photo.jpg").write_text("jpg")
+
+    seen = []
+    cursor = None
+    while True:
+        page = fs.browse_directory(prepared_root, cursor=cursor, limit=3)
+        assert page.total == 9
+        seen.extend(entry["name"] for entry in page.entries)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert seen[0] == "sub"
+    assert seen[1:] == sorted(name for name in seen[1:])
+    assert len(seen) == 9
+
+    by_size = fs.browse_directory(prepared_root, sort="size", descending=True, kind="file", pattern="FILE*")
+    assert [entry["name"] for entry in by_size.entries][:2] == ["file6.txt", "file5.txt"]
+    assert by_size.entries[0]["size"] == 6
+    assert by_size.total == 7
+
+    with pytest.raises(fs.InvalidCursorError):
+        fs.browse_directory(prepared_root, cursor="not-a-cursor")
+
+
+def test_browse_cursor_pages_in_any_order(prepared_root: Path):
+    for index in range(3):
+        (prepared_root / f"dir{index}").mkdir()
+    for index in range(10):
+        (prepared_root / f"file{index}.txt").write_text("x" * (index % 4))
+
+    for sort in fs.SORT_FIELDS:
+        for descending in (False, True):
+            everything = [e["name"] for e in fs.browse_directory(prepared_root, sort=sort, descending=descending).entries]
+            seen, cursor = [], None
+            while True:
+                page = fs.browse_directory(prepared_root, cursor=cursor, limit=4, sort=sort, descending=descending)
+                seen.extend(entry["name"] for entry in page.entries)
+                cursor = page.next_cursor
+                if cursor is None:
+                    break
+            assert seen == everything
+
+    # The entry a cursor points at may be gone by the next page.
+    page = fs.browse_directory(prepared_root, limit=4)
+    assert page.entries[-1]["name"] == "file0.txt"
+    (prepared_root / "file0.txt").unlink()
+    assert fs.browse_directory(prepared_root, cursor=page.next_cursor, limit=1).entries[0]["name"] == "file1.txt"
+
+    # A cursor is only valid for the sort and order it was made under.
+    with pytest.raises(fs.InvalidCursorError, match="sort=name"):
+        fs.browse_directory(prepared_root, cursor=page.next_cursor, sort="size")
+    with pytest.raises(fs.InvalidCursorError):
+        fs.browse_directory(prepared_root, cursor=page.next_cursor, descending=True)
+
+
+def test_iter_directory_checks_roots_before_streaming(prepared_root: Path):
+    (prepared_root / "a.txt").write_text("a")
+    assert [entry["name"] for entry in fs.iter_directory(prepared_root)] == ["a.txt"]
+    with pytest.raises(fs.UnsafePathError):
+        fs.iter_directory(prepared_root.parent)
+
+
+def test_group_by_device_keeps_same_disk_together(tmp_path: Path):
+    first = tmp_path / "a"
+    second = tmp_path / "b"
+    first.mkdir()
+    second.mkdir()
+    groups = fs.group_by_device([str(first), str(second), str(tmp_path / "missing")])
+    assert [str(first), str(second)] in groups
+    assert [str(tmp_path / "missing")] in groups
@@ -0,0 +1,56 @@
+import re
+
+import pytest
+
+from app.backup.filters import PathFilter, pattern_to_regex
+
+
+@pytest.mark.parametrize(
+    "pattern, path, expected",
+    [
+        ("*.log", "src/a/b/debug.log", True),
+        ("*.log", "src/a/log.txt", False),
+        ("cache", "src/a/cache", True),
+        ("a/*.txt", "src/a/x.txt", True),
+        ("a/*.txt", "src/a/b/x.txt", False),
+        ("a/**.txt", "src/a/b/x.txt", True),
+        ("/src/a", "src/a", True),
+        ("/src/a", "other/src/a", False),
+        ("/src/a/***", "src/a/deep/file", True),
+        ("/src/a/***", "src/a", True),
+        ("file?.txt", "src/file1.txt", True),
+        ("file[0-9].txt", "src/fileA.txt", False),
+        ("file[!0-9].txt", "src/fileA.txt", True),
+    ],
+)
+def test_pattern_semantics_match_rsync(pattern: str, path: str, expected: bool):
+    assert bool(re.search(pattern_to_regex(pattern), path)) is expected
+
+
+def test_excludes_win_and_directory_only_patterns():
+    path_filter = PathFilter(include_patterns=["*.txt"], exclude_patterns=["secret.txt", "tmp/"])
+    assert path_filter.includes_file("src/notes.txt")
+    assert not path_filter.includes_file("src/secret.txt")
+    assert not path_filter.includes_file("src/image.png")
+    # Directories are traversed in include mode unless an exclude prunes them.
+    assert path_filter.includes_dir("src/photos")
+    assert not path_filter.includes_dir("src/tmp")
+    # A directory-only exclude does not match a file of the same name.
+    assert path_filter.includes_file("src/tmp.txt")
+    assert PathFilter(exclude_patterns=["tmp/"]).includes_file("src/tmp")
+
+
+def test_rsync_args_mirror_python_semantics():
+    assert PathFilter().rsync_args() == []
+    assert PathFilter(exclude_patterns=["*.log"]).rsync_args() == ["--exclude", "*.log"]
+    assert PathFilter(include_patterns=["*.txt"], exclude_patterns=["*.log"]).rsync_args() == [
+        "--exclude",
+        "*.log",
+        "--include",
+        "*/",
+        "--include",
+        "*.txt",
+        "--exclude",
+        "*",
+        "--prune-empty-dirs",
+    ]
@@ -0,0 +1,71 @@
+from pathlib import Path
+
+import pytest
+
+import app.backup.config as config
+import app.backup.engine as engine
+import app.backup.history as history_module
+from app.backup.history import RunHistory, RunRecord, render_metrics
+
+
+def test_run_history_roundtrip_newest_first(tmp_path: Path):
+    history = RunHistory(tmp_path / "runs.jsonl")
+    assert history.records() == []
+    first = RunRecord(engine="python")
+    first.finish("succeeded")
+    second = RunRecord(engine="rsync")
+    second.finish("failed", error="boom")
+    history.append(first)
+    history.append(second)
+
+    records = history.records()
+    assert [r.run_id for r in records] == [second.run_id, first.run_id]
+    assert history.get(first.run_id).engine == "python"
+    assert records[0].error == "boom"
+
+
+def test_run_totals_survive_compaction(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    history = RunHistory(tmp_path / "runs.jsonl")
+    # A history from before the totals file existed is counted from its records.
+    with history.path.open("w", encoding="utf-8") as f:
+        for status in ["succeeded", "failed", "succeeded"]:
+            f.write(f'{{"status": "{status}"}}\n')
+    assert history.totals() == {"succeeded": 2, "failed": 1}
+
+    monkeypatch.setattr(history_module, "MAX_RECORDS", 2)
+    for _ in range(5):
+        record = RunRecord()
+        record.finish("succeeded")
+        history.append(record)
+    assert len(history.records()) < 8
+    assert history.totals() == {"succeeded": 7, "failed": 1}
+    assert 'pi_backup_runs_total{status="succeeded"} 7' in render_metrics(history.records(), history.totals())
+
+
+def test_run_backup_records_metrics(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    source = tmp_path / "src"
+    source.mkdir()
+    (source / "a.txt").write_text("hello")
+    cfg = config.BackupConfig(destination=str(tmp_path / "dest"), selected_paths=[str(source)], allowed_roots=[str(tmp_path)])
+    config.save_config(cfg)
+    monkeypatch.setattr(engine, "has_rsync", lambda: False)
+
+    engine.run_backup(cfg)
+    record = engine.run_history().records()[0]
+    assert record.status == "succeeded"
+    assert record.engine == "python"
+    assert record.files_copied == 1
+    assert record.bytes_copied == 5
+    assert set(record.phases) == {"scan", "copy", "retention", "catalog"}
+
+    config.save_config(config.BackupConfig(selected_paths=[], allowed_roots=[str(tmp_path)]))
+    with pytest.raises(ValueError):
+        engine.run_backup()
+    assert engine.run_history().records()[0].status == "failed"
+
+    history = engine.run_history()
+    text = render_metrics(history.records(), history.totals())
+    assert 'pi_backup_runs_total{status="succeeded"} 1' in text
+    assert 'pi_backup_runs_total{status="failed"} 1' in text
+    assert "pi_backup_last_run_success 0" in text
+    assert "# TYPE pi_backup_last_success_timestamp_seconds gauge" in text
@@ -0,0 +1,54 @@
+from pathlib import Path
+
+import pytest
+
+import app.backup.copier as copier
+from app.backup.filters import PathFilter
+from app.backup.index import INDEX_FILENAME, FileIndex, index_row
+
+
+def test_file_index_roundtrip_and_prune(tmp_path: Path):
+    source = tmp_path / "data.bin"
+    source.write_bytes(b"1234")
+    stat = source.stat()
+
+    with FileIndex.open(tmp_path) as index:
+        assert index.is_empty
+        index.record([index_row(source, Path("src/data.bin"), stat, "2024-01-01_00-00-00")])
+        entry = index.lookup(str(source))
+        assert entry is not None and entry.matches(stat)
+        assert entry.relative == "src/data.bin"
+        assert index.prune("2024-01-02_00-00-00") == 1
+        assert index.lookup(str(source)) is None
+
+    assert (tmp_path / INDEX_FILENAME).exists()
+
+
+def test_copy_files_links_from_index_without_stat_of_destination(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    source = tmp_path / "src"
+    source.mkdir()
+    (source / "same.txt").write_text("unchanged")
+    (source / "gone.txt").write_text("deleted later")
+    dest_root = tmp_path / "dest"
+    dest_root.mkdir()
+
+    with FileIndex.open(dest_root) as index:
+        copier.copy_files([str(source)], dest_root / "2024-01-01_00-00-00", PathFilter(), index=index)
+
+    (source / "gone.txt").unlink()
+    (source / "new.txt").write_text("fresh")
+
+    def fail(*args):
+        raise AssertionError("destination should not be compared when the index knows the file")
+
+    monkeypatch.setattr(copier, "is_unchanged", fail)
+    with FileIndex.open(dest_root) as index:
+        stats = copier.copy_files([str(source)], dest_root / "2024-01-02_00-00-00", PathFilter(), index=index)
+        assert index.lookup(str(source / "gone.txt")) is None
+        assert index.lookup(str(source / "new.txt")).snapshot == "2024-01-02_00-00-00"
+
+    assert stats.files_linked == 1
+    assert stats.files_copied == 1
+    old = dest_root / "2024-01-01_00-00-00" / "src" / "same.txt"
+    new = dest_root / "2024-01-02_00-00-00" / "src" / "same.txt"
+    assert old.stat().st_ino == new.stat().st_ino
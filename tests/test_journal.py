@@ -0,0 +1,170 @@
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import pytest
+
+import app.backup.config as config
+import app.backup.copier as copier
+import app.backup.engine as engine
+import app.backup.watcher as watcher_module
+from app.backup.journal import ChangeJournal, journal_path
+from app.backup.watcher import ChangeWatcher, Inotify, WatchError
+
+
+@pytest.fixture
+def watched_config(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> config.BackupConfig:
+    source = tmp_path / "src"
+    for name in ["a.txt", "docs/b.txt", "docs/c.log"]:
+        (source / name).parent.mkdir(parents=True, exist_ok=True)
+        (source / name).write_text(name)
+    cfg = config.BackupConfig(
+        destination=str(tmp_path / "dest"),
+        selected_paths=[str(source)],
+        allowed_roots=[str(tmp_path)],
+        exclude_patterns=["*.log"],
+        incremental=True,
+        watch_changes=True,
+        retention=config.RetentionRules(keep_last=None),
+    )
+    config.save_config(cfg)
+    monkeypatch.setattr(engine, "has_rsync", lambda: True)  # journaled runs use the Python engine anyway
+    return cfg
+
+
+def run_at(monkeypatch: pytest.MonkeyPatch, cfg: config.BackupConfig, stamp: str):
+    from tests.test_engine import freeze_time
+
+    freeze_time(monkeypatch, stamp)
+    snapshot = engine.run_backup(cfg)
+    return snapshot, engine.run_history().records()[0]
+
+
+def test_journal_driven_runs_only_scan_changed_paths(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, watched_config: config.BackupConfig
+):
+    source = tmp_path / "src"
+    with ChangeJournal(journal_path()) as journal:
+        journal.invalidate("watcher started")
+
+    first, record = run_at(monkeypatch, watched_config, "2000-01-01_00-00-00")
+    assert record.engine == "python"
+
+    (source / "a.txt").write_text("changed")
+    (source / "new").mkdir()
+    (source / "new" / "d.txt").write_text("d")
+    (source / "new" / "e.log").write_text("e")
+    (source / "docs" / "b.txt").unlink()
+    with ChangeJournal(journal_path()) as journal:
+        journal.record([str(source / "a.txt"), str(source / "new"), str(source / "docs" / "b.txt")])
+
+    scanned: list[str] = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(copier.os, "scandir", lambda path: scanned.append(path) or real_scandir(path))
+    second, record = run_at(monkeypatch, watched_config, "2000-01-02_00-00-00")
+    assert record.engine == "python-journal"
+    assert scanned == [str(source / "new")]
+    files = sorted(p.relative_to(second).as_posix() for p in (second / "src").rglob("*") if p.is_file())
+    assert files == ["src/a.txt", "src/new/d.txt"]
+    assert (second / "src" / "a.txt").read_text() == "changed"
+
+    # The journal is consumed; an unchanged tree links everything from the index.
+    third, record = run_at(monkeypatch, watched_config, "2000-01-03_00-00-00")
+    assert (record.engine, record.files_linked, record.files_copied) == ("python-journal", 2, 0)
+    assert (third / "src" / "new" / "d.txt").stat().st_ino == (second / "src" / "new" / "d.txt").stat().st_ino
+
+    # A watcher restart or overflow forces a full scan.
+    with ChangeJournal(journal_path()) as journal:
+        journal.invalidate("inotify event queue overflowed")
+    _, record = run_at(monkeypatch, watched_config, "2000-01-04_00-00-00")
+    assert record.engine == "python"
+
+
+def test_journal_requires_a_live_watcher(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, watched_config):
+    with ChangeJournal(journal_path()) as journal:
+        journal.invalidate("watcher started")
+    run_at(monkeypatch, watched_config, "2000-01-01_00-00-00")
+    monkeypatch.setattr("app.backup.journal.time.time", lambda: time.monotonic() + 10**10)
+    _, record = run_at(monkeypatch, watched_config, "2000-01-02_00-00-00")
+    assert record.engine == "python"
+
+
+def skip_without_inotify() -> None:
+    try:
+        Inotify().close()
+    except WatchError:
+        pytest.skip("inotify not available")
+
+
+def wait_for_changes(path: Path, expected: set, deadline: float) -> set:
+    recorded: set = set()
+    with ChangeJournal(path) as journal:
+        while not expected <= recorded and time.monotonic() < deadline:
+            time.sleep(0.05)
+            recorded = {row[0] for row in journal._conn.execute("SELECT path FROM changes")}
+    return recorded
+
+
+def test_watcher_records_changes(tmp_path: Path):
+    skip_without_inotify()
+    source = tmp_path / "src"
+    (source / "sub").mkdir(parents=True)
+    path = tmp_path / "journal.sqlite"
+    watcher = ChangeWatcher(path, lambda: [str(source)])
+    watcher.start()
+    try:
+        deadline = time.monotonic() + 10
+        assert watcher.ready.wait(10)
+        (source / "sub" / "file.txt").write_text("x")
+        (source / "newdir").mkdir()
+        # The watcher watches a new directory before it records it.
+        first = {str(source / "sub" / "file.txt"), str(source / "newdir")}
+        assert first <= wait_for_changes(path, first, deadline)
+        (source / "newdir" / "inner.txt").write_text("y")
+
+        expected = first | {str(source / "newdir" / "inner.txt")}
+        recorded = wait_for_changes(path, expected, deadline)
+    finally:
+        watcher.stop()
+    assert expected <= recorded
+
+
+def test_watcher_survives_journal_errors(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    skip_without_inotify()
+    source = tmp_path / "src"
+    source.mkdir()
+    path = tmp_path / "journal.sqlite"
+    journal_class = watcher_module.ChangeJournal
+    record = journal_class.record
+    failures = []
+
+    def locked(journal, paths) -> None:
+        if not failures:
+            failures.append(list(paths))
+            raise sqlite3.OperationalError("database is locked")
+        record(journal, paths)
+
+    monkeypatch.setattr(journal_class, "record", locked)
+    monkeypatch.setattr(watcher_module, "RESTART_DELAY", 0.1)
+    watcher = ChangeWatcher(path, lambda: [str(source)])
+    watcher.start()
+    try:
+        deadline = time.monotonic() + 10
+        assert watcher.ready.wait(10)
+        with ChangeJournal(path) as journal:
+            journal.commit(journal.begin({}), {})
+        (source / "lost.txt").write_text("x")
+        # The change that failed to be recorded makes the next run scan everything.
+        with ChangeJournal(path) as journal:
+            while journal.begin({}).changed_paths is not None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert journal.begin({}).changed_paths is None
+        # And the watcher carries on once it has started over.
+        assert watcher.ready.wait(10)
+        (source / "kept.txt").write_text("y")
+        expected = {str(source / "kept.txt")}
+        assert expected <= wait_for_changes(path, expected, deadline)
+    finally:
+        watcher.stop()
+    assert failures == [[str(source / "lost.txt")]]
@@ -0,0 +1,113 @@
+import logging
+import threading
+from pathlib import Path
+
+import pytest
+
+import app.backup.logreader as logreader
+from app.backup.logreader import LogQuery, RunIdFilter, follow, read_logs
+
+
+def line(second: int, level: str, message: str, run_id: str = "") -> str:
+    run_tag = f"[{run_id}]" if run_id else ""
+    return f"2026-01-01 00:00:{second:02d},000 [{level}] backup{run_tag}: {message}\n"
+
+
+@pytest.fixture
+def small_blocks(monkeypatch: pytest.MonkeyPatch):
+    # Tiny reads and index blocks so the tests cross every chunk and block boundary.
+    monkeypatch.setattr(logreader, "READ_CHUNK", 37)
+    monkeypatch.setattr(logreader, "INDEX_BLOCK_SIZE", 100)
+
+
+@pytest.fixture
+def rotated_logs(tmp_path: Path) -> Path:
+    log_file = tmp_path / "backup.log"
+    (tmp_path / "backup.log.2").write_text("".join(line(s, "INFO", f"old {s}") for s in range(0, 10)))
+    (tmp_path / "backup.log.1").write_text(
+        "".join(line(s, "INFO", f"mid {s}", "aaa111") for s in range(10, 20))
+        + line(20, "ERROR", "failed", "aaa111")
+        + "Traceback (most recent call last):\n  OSError: disk full\n"
+    )
+    log_file.write_text("".join(line(s, "WARNING" if s % 5 == 0 else "INFO", f"new {s}", "bbb222") for s in range(21, 40)))
+    return log_file
+
+
+def test_tail_spans_rotated_files_newest_first(rotated_logs: Path, small_blocks):
+    entries = logreader.tail(rotated_logs, 3, 25)
+    assert [e.message for e in entries[:2]] == ["new 39", "new 38"]
+    error = entries[19]
+    assert error.level == "ERROR" and error.run_id == "aaa111"
+    assert error.message == "failed\nTraceback (most recent call last):\n  OSError: disk full"
+    assert entries[-1].message == "mid 15"
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        LogQuery(),
+        LogQuery(level="warning"),
+        LogQuery(run_id="aaa111"),
+        LogQuery(since="2026-01-01T00:00:08", until="2026-01-01T00:00:22"),
+    ],
+)
+def test_read_logs_filters_and_paginates(rotated_logs: Path, small_blocks, query: LogQuery):
+    everything = logreader.tail(rotated_logs, 3, 1000)
+    expected = [e.text for e in everything if query.matches(e)]
+    seen, cursor = [], None
+    while True:
+        page = read_logs(rotated_logs, 3, limit=4, cursor=cursor, query=query)
+        seen.extend(e.text for e in page.entries)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert seen == expected and expected
+
+
+def test_cursor_survives_rotation_and_appends(rotated_logs: Path):
+    page = read_logs(rotated_logs, 3, limit=5)
+    rotated_logs.rename(rotated_logs.with_name("backup.log.1.new"))
+    (rotated_logs.parent / "backup.log.1").rename(rotated_logs.with_name("backup.log.2"))
+    rotated_logs.with_name("backup.log.1.new").rename(rotated_logs.with_name("backup.log.1"))
+    rotated_logs.write_text(line(50, "INFO", "after rotation"))
+
+    following = read_logs(rotated_logs, 3, limit=1, cursor=page.next_cursor)
+    assert following.entries[0].message == "new 34"
+    with pytest.raises(logreader.InvalidCursorError):
+        read_logs(rotated_logs, 3, cursor="garbage")
+
+
+def test_run_id_filter_tags_log_lines(tmp_path: Path):
+    log_file = tmp_path / "run.log"
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(logging.Formatter(logreader.LOG_FORMAT))
+    handler.addFilter(RunIdFilter())
+    logger = logging.getLogger("test-run-id")
+    logger.addHandler(handler)
+    try:
+        logger.warning("outside")
+        token = logreader.set_run_id("abc123")
+        logger.warning("inside")
+        logreader.reset_run_id(token)
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+    inside, outside = logreader.tail(log_file, 0, 10)
+    assert (inside.run_id, inside.message) == ("abc123", "inside")
+    assert (outside.run_id, outside.logger) == (None, "test-run-id")
+
+
+def test_follow_yields_appended_entries_across_rotation(tmp_path: Path):
+    log_file = tmp_path / "backup.log"
+    log_file.write_text(line(1, "INFO", "before"))
+    stop = threading.Event()
+    stream = follow(log_file, poll_interval=0.01, stop=stop)
+    assert next(stream) is None
+    with log_file.open("a") as f:
+        f.write(line(2, "INFO", "appended"))
+    assert next(stream).message == "appended"
+    log_file.rename(tmp_path / "backup.log.1")
+    log_file.write_text(line(3, "ERROR", "rotated"))
+    entry = next(entry for entry in stream if entry is not None)
+    assert (entry.message, entry.level) == ("rotated", "ERROR")
+    stop.set()
@@ -0,0 +1,181 @@
+import os
+from pathlib import Path
+
+import pytest
+
+import app.backup.config as config
+import app.backup.engine as engine
+import app.backup.packs as packs
+from app.backup.catalog import SnapshotCatalog, restore_paths
+from app.backup.manifest import MANIFEST_NAME
+from app.backup.verify import verify_snapshot
+from tests.test_engine import freeze_time
+
+
+def make_source(root: Path) -> Path:
+    source = root / "src"
+    (source / "mail" / "cur").mkdir(parents=True)
+    for i in range(20):
+        (source / "mail" / "cur" / f"msg{i:02d}").write_text(f"message {i}\n" * (i + 1))
+    (source / "empty").touch()
+    (source / "script.sh").write_text("#!/bin/sh\necho hi\n")
+    os.chmod(source / "script.sh", 0o750)
+    (source / "big.bin").write_bytes(os.urandom(20_000))
+    return source
+
+
+@pytest.fixture
+def packed_config(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> config.BackupConfig:
+    source = make_source(tmp_path)
+    cfg = config.BackupConfig(
+        destination=str(tmp_path / "dest"),
+        selected_paths=[str(source)],
+        allowed_roots=[str(tmp_path)],
+        incremental=True,
+        retention=config.RetentionRules(keep_last=None),
+        pack_below_kib=4,
+    )
+    config.save_config(cfg)
+    # Packing bypasses rsync by itself; make sure it is not the reason rsync is unused here.
+    monkeypatch.setattr(engine, "has_rsync", lambda: True)
+    return cfg
+
+
+def test_small_files_are_packed_and_large_ones_copied(packed_config: config.BackupConfig, tmp_path: Path):
+    snapshot = engine.run_backup(packed_config)
+    record = engine.run_history().records()[0]
+    assert record.engine == "python" and record.files_copied == 23
+
+    # Only the large file exists as a file; the mail folder was never created.
+    files = sorted(p.relative_to(snapshot).as_posix() for p in snapshot.rglob("*") if p.is_file())
+    assert [f for f in files if not f.startswith(".pi-backup-")] == ["src/big.bin"]
+    index = packs.read_pack_index(snapshot)
+    assert len(index) == 22 and {e["pack"] for e in index.values()} == {f"{snapshot.name}-00001.pack"}
+    assert index["src/script.sh"]["mode"] == 0o750
+    assert verify_snapshot(snapshot).ok
+
+    target = tmp_path / "restore"
+    assert restore_paths(snapshot, ["src/mail", "src/script.sh", "src/big.bin"], target) == 22
+    source = tmp_path / "src"
+    for name in ["mail/cur/msg00", "mail/cur/msg19", "script.sh", "big.bin"]:
+        assert (target / "src" / name).read_bytes() == (source / name).read_bytes()
+    restored = (target / "src" / "script.sh").stat()
+    assert restored.st_mode & 0o7777 == 0o750
+    assert restored.st_mtime_ns == (source / "script.sh").stat().st_mtime_ns
+    with pytest.raises(FileNotFoundError):
+        restore_paths(snapshot, ["src/missing"], target)
+
+
+def test_incremental_run_links_unchanged_packs(
+    packed_config: config.BackupConfig, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    freeze_time(monkeypatch, "2000-01-01_00-00-00")
+    first = engine.run_backup(packed_config)
+    (tmp_path / "src" / "mail" / "cur" / "msg03").write_text("edited")
+    freeze_time(monkeypatch, "2000-01-02_00-00-00")
+    second = engine.run_backup(packed_config)
+
+    record = engine.run_history().records()[0]
+    assert (record.files_copied, record.files_linked) == (1, 22)
+    assert not (second / packs.REUSE_DB_NAME).exists()
+    old_pack = first / packs.PACK_DIR / "2000-01-01_00-00-00-00001.pack"
+    assert (second / packs.PACK_DIR / old_pack.name).stat().st_ino == old_pack.stat().st_ino
+    index = packs.read_pack_index(second)
+    assert index["src/mail/cur/msg03"]["pack"] == "2000-01-02_00-00-00-00001.pack"
+    assert verify_snapshot(second).ok
+
+    # The linked pack keeps the newer snapshot restorable once the older one is gone.
+    packs_dir = first / packs.PACK_DIR
+    os.unlink(old_pack)
+    os.rmdir(packs_dir)
+    target = tmp_path / "restore"
+    assert restore_paths(second, ["src/mail"], target) == 20
+    assert (target / "src" / "mail" / "cur" / "msg03").read_text() == "edited"
+
+
+def test_unlinkable_or_mostly_dead_packs_are_copied(
+    packed_config: config.BackupConfig, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    freeze_time(monkeypatch, "2000-01-01_00-00-00")
+    engine.run_backup(packed_config)
+    # As on FAT: no hard links.
+    link = os.link
+    monkeypatch.setattr(packs.os, "link", lambda src, dst: (_ for _ in ()).throw(OSError(1, "not permitted")))
+    freeze_time(monkeypatch, "2000-01-02_00-00-00")
+    second = engine.run_backup(packed_config)
+    assert sorted(os.listdir(second / packs.PACK_DIR)) == ["2000-01-02_00-00-00-00001.pack"]
+    assert verify_snapshot(second).ok
+
+    monkeypatch.setattr(packs.os, "link", link)
+    monkeypatch.setattr(packs, "MIN_LIVE_FRACTION", 1.1)
+    freeze_time(monkeypatch, "2000-01-03_00-00-00")
+    third = engine.run_backup(packed_config)
+    assert sorted(os.listdir(third / packs.PACK_DIR)) == ["2000-01-03_00-00-00-00001.pack"]
+    assert engine.run_history().records()[0].files_linked == 23
+
+
+def test_pack_index_keeps_each_pack_together(
+    packed_config: config.BackupConfig, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    # Tiny packs, so a run both links packs and copies files out of others next to new ones.
+    monkeypatch.setattr(packs, "PACK_SIZE", 64)
+    freeze_time(monkeypatch, "2000-01-01_00-00-00")
+    engine.run_backup(packed_config)
+    for i in range(0, 20, 3):
+        (tmp_path / "src" / "mail" / "cur" / f"msg{i:02d}").write_text("edited")
+    freeze_time(monkeypatch, "2000-01-02_00-00-00")
+    second = engine.run_backup(packed_config)
+
+    names = [pack for pack, _ in packs.iter_packs(second)]
+    assert len(names) == len(set(names)) > 1
+    assert any(name.startswith("2000-01-01") for name in names)
+    assert sum(len(entries) for _, entries in packs.iter_packs(second)) == 22
+    assert verify_snapshot(second).ok
+
+
+def test_files_that_grew_after_the_scan_are_copied_as_files(packed_config: config.BackupConfig, tmp_path: Path, monkeypatch):
+    grown = tmp_path / "src" / "script.sh"
+    add = packs.PackWriter.add
+
+    def growing(self, path, relative, size, mtime_ns, limiter=None):
+        if path == grown:
+            grown.write_bytes(b"x" * 100_000)
+        return add(self, path, relative, size, mtime_ns, limiter)
+
+    monkeypatch.setattr(packs.PackWriter, "add", growing)
+    snapshot = engine.run_backup(packed_config)
+    assert "src/script.sh" not in packs.read_pack_index(snapshot)
+    assert (snapshot / "src" / "script.sh").read_bytes() == b"x" * 100_000
+    assert engine.run_history().records()[0].files_copied == 23
+    assert verify_snapshot(snapshot).ok
+
+
+def test_verify_reports_damaged_and_missing_packs(packed_config: config.BackupConfig):
+    snapshot = engine.run_backup(packed_config)
+    index = packs.read_pack_index(snapshot)
+    pack = snapshot / packs.PACK_DIR / index["src/script.sh"]["pack"]
+    data = bytearray(pack.read_bytes())
+    data[index["src/script.sh"]["offset"]] ^= 0xFF
+    pack.write_bytes(bytes(data))
+    report = verify_snapshot(snapshot)
+    assert report.corrupt == ["src/script.sh"] and report.missing_count == 0
+
+    pack.unlink()
+    report = verify_snapshot(snapshot)
+    assert report.missing_count == 22 and report.corrupt_count == 0
+
+    # Entries lost from the pack index still fail the verification.
+    index = packs.pack_index_path(snapshot)
+    lines = index.read_text().splitlines()
+    index.write_text("\n".join(lines[:-2]) + "\n")
+    report = verify_snapshot(snapshot)
+    assert not report.ok and report.errors == 2
+
+
+def test_catalog_lists_packed_files_without_a_manifest(packed_config: config.BackupConfig, tmp_path: Path):
+    packed_config.hash_manifests = False
+    snapshot = engine.run_backup(packed_config)
+    assert not (snapshot / MANIFEST_NAME).exists()
+    with SnapshotCatalog.open(tmp_path / "dest") as catalog:
+        info = catalog.snapshots()[0]
+        assert (info.files, info.bytes) == (23, sum(p.stat().st_size for p in (tmp_path / "src").rglob("*") if p.is_file()))
@@ -0,0 +1,120 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+import app.backup.config as config
+import app.backup.engine as engine
+from app.backup.logreader import run_context
+from app.backup.profiling import RunProfile, SamplingProfiler, active_profile, format_report, reset_profile, set_profile
+
+
+def test_run_profile_spans_and_counters():
+    profile = RunProfile()
+    with profile.span("copy"):
+        pass
+    with profile.span("copy"):
+        pass
+    profile.add_time("copy.scan", 0.5)
+    profile.count("files.buffered")
+    profile.count("bytes.buffered", 100)
+
+    data = profile.to_dict()
+    assert data["spans"]["copy"]["calls"] == 2
+    assert data["spans"]["copy.scan"] == {"seconds": 0.5, "calls": 1}
+    assert data["counters"] == {"bytes.buffered": 100, "files.buffered": 1}
+    assert set(profile.phases(["copy", "hash"])) == {"copy"}
+
+
+def test_pool_workers_add_to_the_active_profile():
+    profile = RunProfile()
+    token = set_profile(profile)
+    try:
+        with ThreadPoolExecutor(max_workers=4, **run_context()) as pool:
+            list(pool.map(lambda _: active_profile().count("work"), range(20)))
+    finally:
+        reset_profile(token)
+    assert profile.counters["work"] == 20
+    # Outside a run nothing is collected.
+    active_profile().count("work")
+    assert active_profile().to_dict()["counters"] == {}
+
+
+def _spin(seconds: float) -> None:
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+def test_sampling_profiler_finds_busy_threads(tmp_path: Path):
+    idle = threading.Event()
+    waiter = threading.Thread(target=idle.wait)
+    waiter.start()
+    try:
+        with SamplingProfiler(interval=0.001) as sampler:
+            worker = threading.Thread(target=_spin, args=(0.2,))
+            worker.start()
+            worker.join()
+    finally:
+        idle.set()
+        waiter.join()
+
+    assert sampler.samples > 0
+    hotspots = sampler.hotspots()
+    assert hotspots[0]["function"].endswith(":_spin")
+    assert hotspots[0]["self"] > 50
+    # The thread blocked on the event never counts as busy.
+    assert not any(spot["function"].endswith(":wait") for spot in hotspots)
+
+    output = tmp_path / "stacks.folded"
+    sampler.write_collapsed(output)
+    assert any("_spin" in line for line in output.read_text().splitlines())
+
+
+def test_format_report():
+    report = format_report(
+        {
+            "spans": {"run": {"seconds": 2.0, "calls": 1}, "copy": {"seconds": 1.5, "calls": 1}},
+            "counters": {"files.buffered": 3},
+            "hotspots": [{"function": "copier.py:10:_transfer", "self": 40.0, "total": 90.0}],
+        }
+    )
+    assert "75.0%" in report
+    assert "files.buffered" in report
+    assert "copier.py:10:_transfer" in report
+
+
+@pytest.fixture
+def backup_config(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> config.BackupConfig:
+    source = tmp_path / "src"
+    (source / "sub").mkdir(parents=True)
+    (source / "a.txt").write_text("hello")
+    (source / "sub" / "b.txt").write_text("world!")
+    cfg = config.BackupConfig(destination=str(tmp_path / "dest"), selected_paths=[str(source)], allowed_roots=[str(tmp_path)])
+    config.save_config(cfg)
+    monkeypatch.setattr(engine, "has_rsync", lambda: False)
+    return cfg
+
+
+def test_run_backup_records_profile(backup_config: config.BackupConfig):
+    engine.run_backup(backup_config)
+    record = engine.run_history().records()[0]
+    spans = record.profile["spans"]
+    assert {"run", "select", "copy", "copy.scan", "retention", "catalog"} <= set(spans)
+    counters = record.profile["counters"]
+    assert (counters["scan.dirs"], counters["scan.stats"]) == (2, 2)
+    assert sum(value for name, value in counters.items() if name.startswith("files.")) == 2
+    assert sum(value for name, value in counters.items() if name.startswith("bytes.")) == 11
+    assert record.phases["copy"] == round(spans["copy"]["seconds"], 3)
+    assert "hotspots" not in record.profile
+
+
+def test_main_profile_writes_report(backup_config: config.BackupConfig, tmp_path: Path, capsys):
+    output = tmp_path / "profile.folded"
+    engine.main(["--profile", str(output)])
+    out = capsys.readouterr().out
+    assert "Phases (" in out and "scan.dirs" in out
+    assert output.exists()
+    assert "hotspots" in engine.run_history().records()[0].profile
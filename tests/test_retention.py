@@ -1,5 +1,9 @@
+import os
 from datetime import datetime, timedelta
 from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
 
 import app.backup.retention as retention
 
@@ -38,3 +42,45 @@ def test_remove_path_deletes_tree(tmp_path: Path):
     child.write_text("data")
     retention.remove_path(nested)
     assert not nested.exists()
+
+
+def test_pruned_snapshots_go_through_the_trash(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    root = tmp_path / "dest"
+    started: list = []
+    monkeypatch.setattr(retention, "purge_trash_in_background", started.append)
+    names = ["2000-01-01_00-00-00", "2000-01-02_00-00-00"]
+    for name in names:
+        for sub in ["a/b/c", "a/d", "e"]:
+            folder = root / name / sub
+            folder.mkdir(parents=True)
+            for i in range(5):
+                (folder / f"f{i}").write_text("x")
+    retention.enforce_retention(root, retention.RetentionRules(keep_last=1))
+    # Renamed away at once, deleted later.
+    assert [p.name for p in retention.parse_timestamped_dirs(root)] == names[1:]
+    trashed = list((root / retention.TRASH_DIR).iterdir())
+    assert [p.name.split(".")[0] for p in trashed] == names[:1]
+    assert started == [root]
+
+    assert retention.purge_trash(root, max_workers=3) == 1
+    assert sorted(p.name for p in root.iterdir()) == names[1:]
+
+
+def test_min_free_gb_prunes_oldest_using_catalog_sizes(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    root = tmp_path / "dest"
+    monkeypatch.setattr(retention, "GIB", 1000)
+    monkeypatch.setattr(retention.shutil, "disk_usage", lambda path: SimpleNamespace(free=1000))
+    names = ["2000-01-01_00-00-00", "2000-01-02_00-00-00", "2000-01-03_00-00-00"]
+    for name, unique in zip(names, [3000, 500, 100]):
+        folder = root / name / "src"
+        folder.mkdir(parents=True)
+        (folder / f"only-{name}.bin").write_bytes(b"x" * unique)
+        # Unchanged in every snapshot (hard-linked by incremental runs), so deleting one copy frees nothing.
+        shared = folder / "shared.bin"
+        shared.write_bytes(b"s" * 10_000)
+        os.utime(shared, ns=(1, 1))
+
+    # 4000 bytes are missing: the oldest frees 3000, the next 500, and the newest is always kept.
+    retention.enforce_retention(root, retention.RetentionRules(keep_last=None, min_free_gb=5))
+    assert retention.wait_for_trash(timeout=10)
+    assert [p.name for p in retention.parse_timestamped_dirs(root)] == names[2:]
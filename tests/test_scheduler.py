@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+from app.backup.config import BackupConfig, ScheduleRules
+from app.backup.jobs import JobBusyError
+from app.backup.scheduler import CronSpec, Scheduler
+
+
+@pytest.mark.parametrize(
+    "spec, after, expected",
+    [
+        ("30 2 * * *", "2026-03-01 02:30", "2026-03-02 02:30"),
+        ("*/15 * * * *", "2026-03-01 10:07", "2026-03-01 10:15"),
+        ("0 3 * * 1-5", "2026-03-06 04:00", "2026-03-09 03:00"),  # Friday -> Monday
+        ("0 0 1,15 * 0", "2026-03-02 00:00", "2026-03-08 00:00"),  # either day field matches
+        ("0 4 29 2 *", "2026-03-01 00:00", "2028-02-29 04:00"),
+        ("@weekly", "2026-03-01 00:00", "2026-03-08 00:00"),
+    ],
+)
+def test_cron_next_after(spec: str, after: str, expected: str):
+    parsed = CronSpec(spec).next_after(datetime.fromisoformat(after))
+    assert parsed == datetime.fromisoformat(expected)
+
+
+@pytest.mark.parametrize("spec", ["* * * *", "61 * * * *", "5-1 * * * *", "*/0 * * * *", "a * * * *"])
+def test_cron_rejects_invalid_specs(spec: str):
+    with pytest.raises(ValueError):
+        CronSpec(spec)
+
+
+class Harness:
+    def __init__(self, tmp_path: Path, rules: ScheduleRules, now: str) -> None:
+        self.config = BackupConfig(destination=str(tmp_path / "dest"), schedule=rules)
+        self.now = datetime.fromisoformat(now)
+        self.submitted: list[datetime] = []
+        self.busy = False
+        self.scheduler = Scheduler(tmp_path / "state.json", self.submit, lambda: self.config, lambda: self.now)
+
+    def submit(self, config: BackupConfig) -> None:
+        if self.busy:
+            raise JobBusyError(type("FakeJob", (), {"kind": "backup", "id": "x", "key": config.destination})())
+        self.submitted.append(self.now)
+
+    def at(self, when: str) -> "Harness":
+        self.now = datetime.fromisoformat(when)
+        self.scheduler.tick()
+        return self
+
+
+def test_scheduler_runs_each_slot_once(tmp_path: Path):
+    harness = Harness(tmp_path, ScheduleRules(cron="0 * * * *"), "2026-03-01 10:20")
+    assert harness.scheduler.tick() == 60.0
+    harness.at("2026-03-01 10:59").at("2026-03-01 11:00").at("2026-03-01 11:01")
+    assert harness.submitted == [datetime(2026, 3, 1, 11, 0)]
+
+
+def test_scheduler_catches_up_missed_runs_once(tmp_path: Path):
+    harness = Harness(tmp_path, ScheduleRules(cron="0 * * * *"), "2026-03-01 10:20")
+    harness.scheduler.tick()
+    # The Pi was off for several slots; a fresh scheduler reads the state file.
+    harness.scheduler = Scheduler(tmp_path / "state.json", harness.submit, lambda: harness.config, lambda: harness.now)
+    harness.at("2026-03-01 15:30").at("2026-03-01 15:31")
+    assert harness.submitted == [datetime(2026, 3, 1, 15, 30)]
+    harness.at("2026-03-01 16:00")
+    assert len(harness.submitted) == 2
+
+
+def test_scheduler_skips_missed_runs_without_catch_up(tmp_path: Path):
+    harness = Harness(tmp_path, ScheduleRules(cron="0 * * * *", catch_up=False), "2026-03-01 10:20")
+    harness.scheduler.tick()
+    harness.at("2026-03-01 15:30")
+    assert harness.submitted == []
+
+
+def test_scheduler_retries_a_slot_while_the_destination_is_busy(tmp_path: Path):
+    harness = Harness(tmp_path, ScheduleRules(cron="0 * * * *", catch_up=False), "2026-03-01 10:20")
+    harness.scheduler.tick()
+    harness.busy = True
+    harness.now = datetime(2026, 3, 1, 11, 0)
+    assert harness.scheduler.tick() == 60.0
+    # A manual run holds the destination well past the grace period, and across the next slot.
+    harness.at("2026-03-01 11:30").at("2026-03-01 12:10")
+    assert harness.submitted == []
+    harness.busy = False
+    harness.at("2026-03-01 12:11").at("2026-03-01 12:12")
+    assert harness.submitted == [datetime(2026, 3, 1, 12, 11)]
+    harness.at("2026-03-01 13:00")
+    assert len(harness.submitted) == 2
+
+
+def test_scheduler_applies_stable_jitter(tmp_path: Path):
+    harness = Harness(tmp_path, ScheduleRules(cron="0 * * * *", jitter_seconds=600), "2026-03-01 10:20")
+    harness.scheduler.tick()
+    jitter = Scheduler._jitter(datetime(2026, 3, 1, 11, 0), 600)
+    assert timedelta(0) < jitter <= timedelta(seconds=600)
+    fire_at = datetime(2026, 3, 1, 11, 0) + jitter
+    harness.now = fire_at - timedelta(seconds=1)
+    assert harness.scheduler.tick() == pytest.approx(1.0)
+    harness.now = fire_at
+    harness.scheduler.tick()
+    assert harness.submitted == [fire_at]
@@ -0,0 +1,190 @@
+import signal
+import time
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.backup.config as config
+import app.backup.copier as copier
+import app.backup.engine as engine
+import app.backup.fastcopy as fastcopy
+import app.backup.throttle as throttle
+import app.main as main
+from tests.test_engine import FakePopen
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 100.0
+        self.slept: list = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(round(seconds, 3))
+        self.now += seconds
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.consumed = 0
+
+    def consume(self, size: int) -> None:
+        self.consumed += size
+
+
+def test_token_bucket_paces_workers_to_the_rate(monkeypatch: pytest.MonkeyPatch):
+    clock = FakeClock()
+    monkeypatch.setattr(throttle.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(throttle.time, "sleep", clock.sleep)
+    bucket = throttle.TokenBucket(rate=1000)
+    bucket.consume(1000)  # the first second's burst is free
+    bucket.consume(500)
+    bucket.consume(500)
+    assert clock.slept == [0.5, 0.5]
+    clock.now += 10  # idle time refills at most one burst
+    bucket.consume(1500)
+    assert clock.slept[-1] == 0.5
+    bucket.set_rate(None)
+    bucket.consume(10**9)
+    assert len(clock.slept) == 3
+    assert bucket.consumed == 3500 + 10**9
+
+
+def test_adaptive_mode_backs_off_and_recovers():
+    rules = config.ThrottleRules(bwlimit_kib=1000, adaptive=True, max_iowait_percent=20, max_load_per_cpu=1.0)
+    limiter = throttle.Throttle(rules)
+    limiter.adjust(throttle.LoadSample(iowait=0.5, load=0.2), 1.0)
+    assert limiter.bucket.rate == 512_000
+    limiter.adjust(throttle.LoadSample(iowait=0.1, load=1.5), 1.0)
+    assert limiter.bucket.rate == 256_000
+    # Between the thresholds: hold the current speed.
+    limiter.adjust(throttle.LoadSample(iowait=0.15, load=0.2), 1.0)
+    assert limiter.bucket.rate == 256_000
+    for _ in range(10):
+        limiter.adjust(throttle.LoadSample(iowait=0.0, load=0.1), 1.0)
+    assert limiter.factor == 1.0 and limiter.bucket.rate == 1_024_000
+
+    # Without a cap the run is slowed relative to the fastest rate it reached.
+    uncapped = throttle.Throttle(config.ThrottleRules(adaptive=True))
+    uncapped.bucket.consume(8_000_000)
+    uncapped.adjust(throttle.LoadSample(iowait=0.0, load=0.1), 2.0)
+    assert uncapped.bucket.rate is None
+    uncapped.adjust(throttle.LoadSample(iowait=0.9, load=0.1), 2.0)
+    assert uncapped.bucket.rate == 2_000_000
+    for _ in range(20):
+        uncapped.adjust(throttle.LoadSample(iowait=0.0, load=0.1), 2.0)
+    assert uncapped.bucket.rate is None
+
+
+def test_throttled_copies_charge_every_byte(tmp_path: Path):
+    source = tmp_path / "big.bin"
+    source.write_bytes(b"x" * (3 * fastcopy.COPY_BUFFER_SIZE + 17))
+    for tiers in [fastcopy.TIERS[1:], fastcopy.TIERS[2:], fastcopy.TIERS[3:]]:
+        fastcopy.reset_fallback_cache()
+        recorder = Recorder()
+        original = fastcopy.TIERS
+        fastcopy.TIERS = tiers
+        try:
+            method = fastcopy.copy_file(source, tmp_path / "copy.bin", limiter=recorder)
+        finally:
+            fastcopy.TIERS = original
+        assert recorder.consumed == source.stat().st_size, method
+        assert (tmp_path / "copy.bin").read_bytes() == source.read_bytes()
+
+
+def test_only_throttled_runs_charge_a_limiter(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    source = tmp_path / "src"
+    source.mkdir()
+    (source / "a.bin").write_bytes(b"a" * 5000)
+    monkeypatch.setattr(engine, "has_rsync", lambda: False)
+    limiters: list = []
+    real_copy = copier.copy_file
+
+    def copy_file(src, dst, hasher=None, limiter=None):
+        limiters.append(limiter)
+        return real_copy(src, dst, hasher, limiter)
+
+    monkeypatch.setattr(copier, "copy_file", copy_file)
+    for rules in [config.ThrottleRules(), config.ThrottleRules(bwlimit_kib=100_000), config.ThrottleRules(adaptive=True)]:
+        cfg = config.BackupConfig(
+            destination=str(tmp_path / "dest"), selected_paths=[str(source)], allowed_roots=[str(tmp_path)], throttle=rules
+        )
+        config.save_config(cfg)
+        engine.run_backup(cfg)
+    # Unthrottled copies keep the kernel copies in KERNEL_CHUNK pieces.
+    assert limiters[0] is None
+    assert all(isinstance(limiter, throttle.TokenBucket) for limiter in limiters[1:]) and len(limiters) == 3
+
+
+def test_rsync_gets_bwlimit_and_is_paced(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    fake = FakePopen()
+    monkeypatch.setattr(engine.subprocess, "Popen", fake)
+    limiter = throttle.Throttle(config.ThrottleRules(bwlimit_kib=500))
+    engine._run_rsync([str(tmp_path / "src")], tmp_path / "dest", [], [], throttle=limiter)
+    assert "--bwlimit=500" in fake.calls[0]
+
+    monkeypatch.setattr(throttle, "PACE_PERIOD", 0.02)
+
+    class Process:
+        def __init__(self, returncode=None) -> None:
+            self.returncode = returncode
+            self.signals: list = []
+
+        def poll(self):
+            return self.returncode
+
+        def send_signal(self, sig: int) -> None:
+            self.signals.append(sig)
+
+    adaptive = throttle.Throttle(config.ThrottleRules(adaptive=True))
+    adaptive.factor = 0.5
+    running = Process()
+    with adaptive.pace_process(running):
+        time.sleep(0.15)
+    signals = running.signals
+    assert signals[0] == signal.SIGSTOP and signals[-1] == signal.SIGCONT
+    assert signals.count(signal.SIGSTOP) == signals.count(signal.SIGCONT) >= 2
+
+    # A process that has exited (and may have been reaped) is never signalled.
+    exited = Process(returncode=0)
+    with adaptive.pace_process(exited):
+        time.sleep(0.05)
+    assert exited.signals == []
+
+
+def test_priority_is_applied_to_the_run_thread(monkeypatch: pytest.MonkeyPatch):
+    calls: list = []
+    monkeypatch.setattr(throttle.os, "getpriority", lambda which, who: 0)
+    monkeypatch.setattr(throttle.os, "setpriority", lambda which, who, value: calls.append(("nice", who, value)))
+    monkeypatch.setattr(throttle.shutil, "which", lambda name: "/usr/bin/ionice")
+
+    class Done:
+        returncode = 0
+        stderr = ""
+
+    monkeypatch.setattr(throttle.subprocess, "run", lambda cmd, **kwargs: calls.append(cmd) or Done())
+    rules = config.ThrottleRules(nice=10, ionice_class="best-effort", ionice_level=7)
+    throttle.Throttle(rules).apply_priority()
+    tid = throttle.threading.get_native_id()
+    assert calls == [("nice", tid, 10), ["/usr/bin/ionice", "-c", "2", "-n", "7", "-p", str(tid)]]
+
+
+def test_config_api_rejects_bad_throttle_settings(tmp_path: Path):
+    client = TestClient(main.app)
+    base = config.BackupConfig(allowed_roots=[str(tmp_path)]).to_dict()
+    bad_settings = [
+        {"nice": 25},
+        {"ionice_class": "realtime"},
+        {"bwlimit_kib": 0},
+        {"adaptive": True, "max_iowait_percent": 0},
+        {"adaptive": True, "max_load_per_cpu": -1},
+    ]
+    for bad in bad_settings:
+        resp = client.post("/api/config", json={**base, "throttle": bad})
+        assert resp.status_code == 400, bad
+    resp = client.post("/api/config", json={**base, "throttle": {"bwlimit_kib": 2048, "adaptive": True}})
+    assert resp.status_code == 200
+    assert config.load_config().throttle.bwlimit_kib == 2048
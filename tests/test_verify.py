@@ -0,0 +1,172 @@
+import hashlib
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+import app.backup.config as config
+import app.backup.engine as engine
+import app.backup.verify as verify
+from app.backup.chunkstore import CHUNK_DIR, ChunkStore, backup_to_chunks
+from app.backup.filters import PathFilter
+from app.backup.manifest import path_key, read_manifest
+from tests.test_engine import freeze_time
+
+
+def sha256(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def make_snapshot(root: Path, name: str, files: dict) -> Path:
+    snapshot = root / name
+    for rel, data in files.items():
+        path = snapshot / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    return snapshot
+
+
+def test_build_manifest_reuses_hashes_of_linked_files(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    first = make_snapshot(tmp_path, "2000-01-01_00-00-00", {"src/a.txt": b"a" * 5000, "src/d/b.txt": b"b"})
+    assert verify.build_manifest(first) == (2, 0, 0)
+
+    second = make_snapshot(tmp_path, "2000-01-02_00-00-00", {"src/new.txt": b"new"})
+    for rel in ["src/a.txt", "src/d/b.txt"]:
+        (second / rel).parent.mkdir(parents=True, exist_ok=True)
+        os.link(first / rel, second / rel)
+    hashed: list[Path] = []
+    real_hash = verify.hash_file
+    monkeypatch.setattr(verify, "hash_file", lambda path: hashed.append(path) or real_hash(path))
+    assert verify.build_manifest(second, first) == (1, 2, 0)
+    assert hashed == [second / "src/new.txt"]
+    entries = {e["path"]: e for e in read_manifest(second)}
+    assert {path: e["sha256"] for path, e in entries.items()} == {
+        rel: sha256(second / rel) for rel in ["src/a.txt", "src/d/b.txt", "src/new.txt"]
+    }
+
+
+def test_build_manifest_merge_walks_the_previous_manifest(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # "a-b" sorts between "a" and "a/z" as a string, but after all of a/ in walk order.
+    files = {"src/a-b": b"1", "src/a/z": b"2", "src/a/b/c": b"3", "src/b": b"4" * 3000, "src/0": b"5"}
+    first = make_snapshot(tmp_path, "2000-01-01_00-00-00", files)
+    real_hash = verify.hash_file
+
+    def slow_first(path: Path) -> str:
+        # Later files finish first, so the manifest is only in walk order if it is kept that way.
+        if path.name == "0":
+            time.sleep(0.1)
+        return real_hash(path)
+
+    monkeypatch.setattr(verify, "hash_file", slow_first)
+    assert verify.build_manifest(first, max_workers=4) == (5, 0, 0)
+    paths = [entry["path"] for entry in read_manifest(first)]
+    assert paths == ["src/0", "src/a/b/c", "src/a/z", "src/a-b", "src/b"]
+    assert paths == sorted(paths, key=path_key)
+
+    second = tmp_path / "2000-01-02_00-00-00"
+    for rel in files:
+        (second / rel).parent.mkdir(parents=True, exist_ok=True)
+        os.link(first / rel, second / rel)
+    (second / "src" / "new").write_bytes(b"new")
+    assert verify.build_manifest(second, first) == (1, 5, 0)
+
+
+def test_verify_reports_corrupt_and_missing_files(tmp_path: Path):
+    first = make_snapshot(tmp_path, "2000-01-01_00-00-00", {"src/a.txt": b"aaaa", "src/b.txt": b"bbbb"})
+    verify.build_manifest(first)
+    second = make_snapshot(tmp_path, "2000-01-02_00-00-00", {"src/c.txt": b"cccc"})
+    os.link(first / "src/a.txt", second / "src/a.txt")
+    os.link(first / "src/b.txt", second / "src/b.txt")
+    verify.build_manifest(second, first)
+
+    cache: verify.InodeCache = {}
+    assert verify.verify_snapshot(first, max_workers=2, cache=cache).ok
+    report = verify.verify_snapshot(second, max_workers=2, cache=cache)
+    assert report.ok
+    # Hard links verified in the first snapshot are not read again.
+    assert (report.files_checked, report.files_cached) == (3, 2)
+
+    # Same size and mtime, different bytes: only the hash can tell.
+    stat = (second / "src/c.txt").stat()
+    (second / "src/c.txt").write_bytes(b"XXXX")
+    os.utime(second / "src/c.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    (second / "src/b.txt").unlink()
+    report = verify.verify_snapshot(second)
+    assert not report.ok
+    assert (report.corrupt, report.missing) == (["src/c.txt"], ["src/b.txt"])
+    assert str(report) == f"{second.name}: 1 corrupt and 1 missing of 3 files"
+
+    with pytest.raises(ValueError, match="no manifest"):
+        verify.verify_snapshot(make_snapshot(tmp_path, "2000-01-03_00-00-00", {"x": b"x"}))
+
+
+def test_verify_counts_unexpected_worker_errors(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    snapshot = make_snapshot(tmp_path, "2000-01-01_00-00-00", {"src/a.txt": b"aaaa", "src/b.txt": b"bbbb"})
+    verify.build_manifest(snapshot)
+    real_hash = verify.hash_file
+
+    def broken_hash(path, *args, **kwargs):
+        if Path(path).name == "b.txt":
+            raise UnicodeEncodeError("utf-8", "b", 0, 1, "surrogates not allowed")
+        return real_hash(path, *args, **kwargs)
+
+    monkeypatch.setattr(verify, "hash_file", broken_hash)
+    report = verify.verify_snapshot(snapshot)
+    assert not report.ok
+    assert (report.errors, report.corrupt_count, report.missing_count) == (1, 0, 0)
+    assert str(report).endswith(", 1 not checked")
+
+
+def test_verify_chunk_snapshot(tmp_path: Path):
+    source = tmp_path / "src"
+    source.mkdir()
+    (source / "one.bin").write_bytes(os.urandom(1000))
+    (source / "two.bin").write_bytes(os.urandom(1000))
+    snapshot = tmp_path / "dest" / "2000-01-01_00-00-00"
+    backup_to_chunks([str(source)], snapshot, PathFilter())
+    assert verify.verify_snapshot(snapshot).ok
+
+    entry = next(e for e in read_manifest(snapshot) if e["path"] == "src/two.bin")
+    ChunkStore(snapshot.parent / CHUNK_DIR).chunk_path(entry["chunks"][0]).write_bytes(b"rot")
+    report = verify.verify_snapshot(snapshot)
+    assert report.corrupt == ["src/two.bin"] and report.missing == []
+
+
+def test_python_engine_hashes_while_copying(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    import app.backup.copier as copier
+
+    source = tmp_path / "src"
+    (source / "d").mkdir(parents=True)
+    (source / "a.txt").write_text("alpha")
+    (source / "d" / "b.txt").write_text("beta")
+    cfg = config.BackupConfig(
+        destination=str(tmp_path / "dest"),
+        selected_paths=[str(source)],
+        allowed_roots=[str(tmp_path)],
+        incremental=True,
+    )
+    config.save_config(cfg)
+    monkeypatch.setattr(engine, "has_rsync", lambda: False)
+    # Every hash comes from the copy itself or the index, never from reading a file again.
+    monkeypatch.setattr(copier, "hash_file", lambda path: pytest.fail(f"re-read {path}"))
+    freeze_time(monkeypatch, "2000-01-01_00-00-00")
+    first = engine.run_backup(cfg)
+    assert {e["path"]: e["sha256"] for e in read_manifest(first)} == {
+        "src/a.txt": sha256(source / "a.txt"),
+        "src/d/b.txt": sha256(source / "d" / "b.txt"),
+    }
+
+    (source / "a.txt").write_text("changed")
+    freeze_time(monkeypatch, "2000-01-02_00-00-00")
+    second = engine.run_backup(cfg)
+    assert (second / "src/d/b.txt").stat().st_ino == (first / "src/d/b.txt").stat().st_ino
+    assert verify.verify_snapshot(second).ok
+    assert {e["path"]: e["sha256"] for e in read_manifest(second)}["src/a.txt"] == sha256(source / "a.txt")
+
+    assert engine.verify_snapshots(["all"])[0].snapshot == second.name
+    engine.main(["--verify", first.name])
+    (second / "src/a.txt").write_text("tampered")
+    with pytest.raises(SystemExit) as excinfo:
+        engine.main(["--verify"])
+    assert excinfo.value.code == 1